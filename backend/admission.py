@@ -0,0 +1,184 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+# --- Configuration ---
+# Appels simultanés aux modèles Groq (agent et Llama Guard) pour le processus
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+# Appels en attente d'une place au-delà desquels les nouveaux sont refusés immédiatement
+LLM_MAX_WAITING = int(os.getenv("LLM_MAX_WAITING", "128"))
+# Attente maximale d'une place (s) avant de répondre « réessayez dans un instant »
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "3"))
+# Tours par session web / numéro WhatsApp : rafale, puis débit soutenu par minute
+ADMISSION_SESSION_BURST = float(os.getenv("ADMISSION_SESSION_BURST", "10"))
+ADMISSION_SESSION_PER_MINUTE = float(os.getenv("ADMISSION_SESSION_PER_MINUTE", "30"))
+
+BUSY_REPLY = "Nous recevons beaucoup de demandes en ce moment. Merci de réessayer dans quelques secondes."
+
+
+class Overloaded(Exception):
+    """Demande refusée par le contrôle d'admission ; `retry_after` en secondes."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Surcharge ({reason}), réessayer dans {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class KeyedTokenBuckets:
+    """Un seau à jetons par clé (session, numéro), les clés les moins récentes étant oubliées."""
+
+    def __init__(self, burst: float, per_minute: float, max_keys: int = 10000):
+        self.capacity = burst
+        self.rate = per_minute / 60.0
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # clé -> (jetons, horodatage)
+        self._lock = threading.Lock()
+
+    def take(self, key: str) -> float:
+        """Prend un jeton pour `key` ; retourne 0 si admis, sinon l'attente avant le prochain jeton."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else 60.0
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class ConcurrencyGate:
+    """
+    Au plus `limit` appels simultanés, servis dans l'ordre d'arrivée. Au-delà, un appel attend au
+    plus `timeout` secondes dans une file de `max_waiting` places ; file pleine ou attente
+    dépassée : Overloaded. Partagé entre threads (mode gthread) et boucle asyncio (async_app).
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters = deque()
+
+    def _enter(self, wake):
+        """Prend une place (retourne None) ou inscrit un nouvel attendant (retourné)."""
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return None
+            if len(self._waiters) >= self.max_waiting:
+                self._reject("queue_full")
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _withdraw(self, waiter: _Waiter) -> bool:
+        """Retire un attendant qui abandonne ; True si la place lui a été accordée entre-temps."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _reject(self, reason: str):
+        metrics.counter("admission_rejected_total", gate=self.name, reason=reason).inc()
+        raise Overloaded(reason, retry_after=max(1.0, self.timeout))
+
+    def try_acquire(self) -> bool:
+        """Prend une place libre sans attendre (False sinon) ; à rendre par release()."""
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return True
+            return False
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()  # La place passe directement à l'attendant suivant
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self._in_use -= 1
+
+    @contextmanager
+    def slot(self):
+        t0 = time.perf_counter()
+        event = threading.Event()
+        waiter = self._enter(event.set)
+        if waiter is not None and not event.wait(self.timeout) and not self._withdraw(waiter):
+            self._reject("timeout")
+        metrics.histogram("admission_wait_seconds", gate=self.name).observe(time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        t0 = time.perf_counter()
+        loop, event = asyncio.get_running_loop(), asyncio.Event()
+        waiter = self._enter(lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(event.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                if not self._withdraw(waiter):
+                    self._reject("timeout")
+            except BaseException:
+                if self._withdraw(waiter):  # Requête annulée : la place accordée est rendue
+                    self.release()
+                raise
+        metrics.histogram("admission_wait_seconds", gate=self.name).observe(time.perf_counter() - t0)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_use, waiting = self._in_use, len(self._waiters)
+        return {"limit": self.limit, "in_use": in_use, "waiting": waiting, "max_waiting": self.max_waiting}
+
+
+llm_gate = ConcurrencyGate("llm", LLM_MAX_CONCURRENCY, LLM_MAX_WAITING, LLM_QUEUE_TIMEOUT)
+_turn_buckets = KeyedTokenBuckets(ADMISSION_SESSION_BURST, ADMISSION_SESSION_PER_MINUTE)
+
+metrics.gauge("llm_in_flight", lambda: llm_gate.stats()["in_use"])
+metrics.gauge("llm_waiting", lambda: llm_gate.stats()["waiting"])
+
+
+def admit_turn(key: str):
+    """Limite de débit par session (`web:<id>`) ou numéro (`whatsapp:<numéro>`). Lève Overloaded."""
+    wait = _turn_buckets.take(key)
+    if wait > 0:
+        metrics.counter("admission_rejected_total", gate=key.split(":", 1)[0], reason="rate").inc()
+        raise Overloaded("rate", retry_after=wait)
+
+
+def stats() -> dict:
+    rejected = metrics.snapshot("admission_rejected_total").get("admission_rejected_total", {})
+    return {
+        "llm": llm_gate.stats(),
+        "wait_seconds": metrics.histogram("admission_wait_seconds", gate="llm").snapshot(),
+        "rejected": rejected,
+    }
@@ -1,14 +1,30 @@
+import startup  # En premier : référence des durées de démarrage
 import os
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from functools import wraps
 from dotenv import load_dotenv
-from whatsapp_webhook import whatsapp
+import tracing
+# Logs avec identifiant de trace, configurés avant l'import des modules qui journalisent
+tracing.configure_logging()
+from whatsapp_webhook import whatsapp, incoming_queue
 import traceback
-from langchain.memory import ConversationBufferMemory
-import threading
-from lead_graph import get_agent_executor, TicketData, process_appointment_backend, get_supabase_client
-import re
+import json
+import math
+import metrics
+from admission import BUSY_REPLY, Overloaded, admit_turn
+import admission
+import resilient_llm
+from lead_graph import get_agent_executor, get_compiled_agent, get_llm, get_llama_guard, get_llm_response_cache, warm_up_calendar, answer_appointment_turn, booking_in_progress, confirm_appointment, CONFIRM_SENTINEL, PROCESSING_REPLY
+from jobs import get_job_queue
+from ticket_writer import get_ticket_writer
+from email_dispatcher import get_email_dispatcher
+import faq
+import moderation
+from supabase_client import get_supabase_pool
+from session_store import open_session, save_session
+from chat_stream import stream_reply
+from session_turns import get_session_turns
 from datetime import datetime, timedelta
 
 # --- Chargement explicite et prioritaire des variables d'environnement ---
@@ -20,10 +36,7 @@ print(f"[APP_INIT] GROQ_API_KEY loaded: {os.getenv('GROQ_API_KEY') is not None}"
 # --- Section d'importation des modules de traitement ---
 from langchain_core.messages import HumanMessage, AIMessage
 print("[APP_INIT] Successfully imported all necessary modules.")
-
-# --- Dictionnaire pour stocker les mémoires des utilisateurs web ---
-# NOTE: En production, utilisez une solution plus robuste comme Redis.
-web_user_memories = {}
+startup.mark("imports")
 
 # --- DÉBOGAGE FINAL : On affiche le répertoire de travail actuel de Flask ---
 print(f"!!! [FLASK CWD CHECK] Le répertoire de travail est : {os.getcwd()}")
@@ -35,138 +48,37 @@ STATIC_FOLDER_PATH = os.path.join(APP_DIR, 'static')
 app = Flask(__name__, static_folder=STATIC_FOLDER_PATH, static_url_path='')
 CORS(app)
 app.register_blueprint(whatsapp, url_prefix='/whatsapp')
-
-def extract_user_data_from_memory(memory):
-    # Extraction naïve à partir des messages (à affiner selon ton cas)
-    messages = memory.chat_memory.messages
-    user_data = {"name": "", "email": "", "phone": "", "service_type": "", "proposed_date": "", "proposed_time": ""}
-
-    print(f"[DEBUG] Extraction des données utilisateur depuis {len(messages)} messages")
-    
-    for i, msg in enumerate(reversed(messages)):
-        content = msg.content.lower()
-        print(f"[DEBUG] Message {i}: {content[:100]}...")
-        
-        if not user_data["email"] and "@" in content:
-            user_data["email"] = extract_email(content)
-            print(f"[DEBUG] Email extrait: {user_data['email']}")
-            
-        if not user_data["phone"] and any(x in content for x in ["77", "tel", "tél", "+"]):
-            user_data["phone"] = extract_phone(content)
-            print(f"[DEBUG] Téléphone extrait: {user_data['phone']}")
-            
-        if not user_data["name"] and ("je m'appelle" in content or "nom" in content):
-            user_data["name"] = extract_name(content)
-            print(f"[DEBUG] Nom extrait: {user_data['name']}")
-            
-        # Amélioration : chercher le type de soin dans TOUS les messages, pas seulement ceux contenant "soin"
-        if not user_data["service_type"]:
-            extracted_service = extract_service_type(content)
-            if extracted_service and extracted_service != "Consultation":
-                user_data["service_type"] = extracted_service
-                print(f"[DEBUG] Type de soin extrait: {user_data['service_type']}")
-                
-        if not user_data["proposed_time"] and "h" in content:
-            user_data["proposed_time"] = extract_time(content)
-            print(f"[DEBUG] Heure extraite: {user_data['proposed_time']}")
-            
-        if not user_data["proposed_date"] and any(x in content for x in ["demain", "/", "lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]):
-            user_data["proposed_date"] = extract_date(content)
-            print(f"[DEBUG] Date extraite: {user_data['proposed_date']}")
-    
-    print(f"[DEBUG] Données finales extraites: {user_data}")
-    return user_data
-
-
-# --- Fonctions d'extraction d'infos utilisateur ---
-def extract_email(text):
-    match = re.search(r"[\w\.-]+@[\w\.-]+\.\w+", text)
-    return match.group(0) if match else ""
-
-def extract_phone(text):
-    match = re.search(r"(?:\+221)?\s*(\d{2,3}[\s\-]?\d{3}[\s\-]?\d{3,4})", text)
-    return match.group(1).replace(" ", "").replace("-", "") if match else ""
-
-def extract_name(text):
-    # Cherche les formulations classiques
-    match = re.search(r"(?:je m'appelle|nom est|je suis)\s*([A-Za-zÀ-ÿ\- ]+)", text, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    # Sinon, tente de trouver un prénom/nom isolé (ex: "Nom: Wade" ou juste "Wade")
-    match = re.search(r"nom[:\s]+([A-Za-zÀ-ÿ\- ]+)", text, re.IGNORECASE)
-    if match:
-        return match.group(1).strip()
-    # Si le message ne contient qu'un mot (et que ce n'est pas un mot-clé), on suppose que c'est le nom
-    words = text.strip().split()
-    if len(words) == 1 and len(words[0]) > 2 and not re.search(r"@|tel|mail|soin|rdv|rendez-vous|demain|lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|\d", words[0], re.IGNORECASE):
-        return words[0]
-    return ""
-
-def extract_service_type(text):
-    # Amélioration de la regex pour mieux capturer les types de soins
-    match = re.search(r"(détartrage|extraction|consultation|orthodontie|blanchiment|carie[s]?|prothèse[s]?|parodontologie|cavité[s]?|douleur[s]?|mal de dents?)", text, re.IGNORECASE)
-    if match:
-        service = match.group(1).capitalize()
-        # Normalisation des termes
-        if service.lower() in ["carie", "caries", "cavité", "cavités"]:
-            return "Carie"
-        elif service.lower() in ["douleur", "douleurs", "mal de dents"]:
-            return "Douleur"
-        else:
-            return service
-    return "Consultation"
-
-def extract_time(text):
-    match = re.search(r"(\d{1,2})h(\d{0,2})", text)
-    if match:
-        return f"{match.group(1)}h{match.group(2) if match.group(2) else '00'}"
-    return ""
-
-def extract_date(text):
-    import datetime
-    import re
-    from dateutil.relativedelta import relativedelta, MO, TU, WE, TH, FR, SA, SU
-    
-    text = text.lower()
-    today = datetime.date.today()
-    jours = {
-        'lundi': 0, 'mardi': 1, 'mercredi': 2, 'jeudi': 3, 'vendredi': 4, 'samedi': 5, 'dimanche': 6
-    }
-    # 1. Demain, après-demain
-    if 'après-demain' in text or 'apres-demain' in text:
-        return (today + datetime.timedelta(days=2)).strftime('%Y-%m-%d')
-    if 'demain' in text:
-        return (today + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
-    # 2. samedi prochain, lundi prochain, etc.
-    match = re.search(r'(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche) prochain', text)
-    if match:
-        jour = match.group(1)
-        target = jours[jour]
-        days_ahead = (target - today.weekday() + 7) % 7
-        if days_ahead == 0:
-            days_ahead = 7
-        return (today + datetime.timedelta(days=days_ahead)).strftime('%Y-%m-%d')
-    # 3. juste samedi, lundi, etc.
-    match = re.search(r'(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche)', text)
-    if match:
-        jour = match.group(1)
-        target = jours[jour]
-        days_ahead = (target - today.weekday() + 7) % 7
-        if days_ahead == 0:
-            days_ahead = 7
-        return (today + datetime.timedelta(days=days_ahead)).strftime('%Y-%m-%d')
-    # 4. format date classique (ex: 25/12/2024)
-    match = re.search(r'(\d{1,2})/(\d{1,2})/(\d{2,4})', text)
-    if match:
-        day, month, year = match.groups()
-        if len(year) == 2:
-            year = '20' + year
-        try:
-            date = datetime.date(int(year), int(month), int(day))
-            return date.strftime('%Y-%m-%d')
-        except:
-            return ''
-    return ''
+# Une trace par requête : identifiant dans les logs et l'en-tête X-Trace-Id, spans de latence
+tracing.init_app(app)
+
+startup.mark("flask_app")
+
+# Démarre les workers de tâches et reprend les rendez-vous non traités avant l'arrêt
+get_job_queue().start()
+startup.mark("job_queue")
+
+# Réinsère dans Supabase les tickets restés au journal local (processus arrêté avant l'envoi)
+get_ticket_writer().start()
+startup.mark("ticket_writer")
+
+def ticket_email_dispatcher():
+    """Répartiteur des e-mails de confirmation (identifiants SMTP du .env, comme send_ticket_email)."""
+    return get_email_dispatcher(os.getenv("SENDER_EMAIL"), os.getenv("SENDER_APP_PASSWORD"))
+
+# Renvoie les e-mails de confirmation restés dans la boîte d'envoi locale (processus arrêté avant l'envoi)
+ticket_email_dispatcher().start()
+startup.mark("email_dispatcher")
+
+# Clients lourds préparés en arrière-plan : le worker accepte les requêtes sans les attendre
+if startup.WARMUP_ON_START:
+    startup.start_warmup([
+        ("llm_cache", get_llm_response_cache),
+        ("llm", get_llm),
+        ("llama_guard", get_llama_guard),
+        ("agent", get_compiled_agent),
+        ("supabase", lambda: get_supabase_pool() and get_supabase_pool().client()),
+        ("calendar", warm_up_calendar),
+    ])
 
 @app.route('/')
 def root():
@@ -181,6 +93,92 @@ def log_requests(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def build_chat_result(session, bot_reply: str) -> dict:
+    """Réponse renvoyée au widget ; lance le traitement du rendez-vous si l'agent l'a confirmé."""
+    # --- ⚡️ Si l'agent confirme la prise de RDV ---
+    if CONFIRM_SENTINEL in bot_reply:
+        print("[INFO] Confirmation détectée. Traitement asynchrone lancé.")
+        job_id = confirm_appointment(session)
+        save_session(session)
+        return {"status": "success", "response": PROCESSING_REPLY, "job_id": job_id}
+
+    # Sinon, retour standard de l'agent
+    return {"status": "success", "response": bot_reply}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_chat(session_id: str, user_input: str, trace_id: str = None):
+    """
+    Diffuse la réponse de l'agent token par token (Server-Sent Events).
+    Événements : `token` (texte partiel), puis `done` (réponse finale, qui remplace le texte
+    partiel) ou `error`. Le marqueur de confirmation n'est jamais diffusé.
+    Le tour entier (verrou de la session sans fusion de messages, agent, sauvegarde, prise de
+    rendez-vous) s'exécute dans le worker du flux : si le client se déconnecte, il va quand même
+    jusqu'au bout en gardant la session pour lui seul.
+    """
+    def run(callbacks):
+        # Le flux est lu après la fin de la requête : la trace est rattachée explicitement
+        with tracing.trace(trace_id), get_session_turns().lock(f"web:{session_id}"):
+            return chat_turn(session_id, user_input, callbacks)
+
+    for event in stream_reply(run, CONFIRM_SENTINEL):
+        yield sse_chat_event(event)
+
+def busy_result(error: Overloaded) -> dict:
+    """Réponse du widget quand la demande est refusée par le contrôle d'admission (HTTP 429)."""
+    return {"status": "error", "response": BUSY_REPLY, "retry_after": math.ceil(error.retry_after)}
+
+def sse_chat_event(event: tuple) -> str:
+    """Événement SSE du widget pour un événement de stream_reply / astream_reply (tour : chat_turn / achat_turn)."""
+    if event[0] == "token":
+        return sse_event("token", {"text": event[1]})
+    if event[0] == "error":
+        if isinstance(event[1], Overloaded):
+            return sse_event("error", busy_result(event[1]))
+        traceback.print_exception(event[1])
+        return sse_event("error", {"status": "error", "response": "Une erreur interne est survenue."})
+    ttft = event[1]["ttft"]
+    return sse_event("done", {**event[1]["output"], "ttft_ms": round(ttft * 1000) if ttft is not None else None})
+
+def answer_without_agent(session, user_input: str):
+    """Réponse du widget sans appel à l'agent (session sauvegardée), ou None si l'agent est nécessaire."""
+    # Récapitulatif et confirmation du rendez-vous : traités localement, sans appel LLM
+    local = answer_appointment_turn(session, user_input)
+    if local is not None:
+        save_session(session)
+        result = {"status": "success", "response": local["response"]}
+        if local["job_id"]:
+            result["job_id"] = local["job_id"]
+        return result
+
+    # Questions fréquentes (horaires, adresse, téléphone) : réponse directe sans l'agent,
+    # sauf pendant la collecte d'un rendez-vous (« samedi », « téléphone » y sont des réponses)
+    faq_reply = None if booking_in_progress(session) else faq.answer(user_input)
+    if faq_reply is not None:
+        session.memory.save_context({"input": user_input}, {"output": faq_reply})
+        save_session(session)
+        return {"status": "success", "response": faq_reply}
+    return None
+
+def chat_turn(session_id: str, user_input: str, callbacks: list = None) -> dict:
+    """
+    Un tour du widget : messages (éventuellement fusionnés) de l'utilisateur, réponse de l'agent.
+    `callbacks` : callbacks LangChain de l'appel à l'agent (diffusion des tokens). Sans eux,
+    l'agent n'est pas diffusé et ses réponses peuvent venir du cache des réponses LLM.
+    """
+    # La mémoire de la conversation est chargée depuis le stockage de sessions partagé
+    session = open_session(f"web:{session_id}")
+    local_result = answer_without_agent(session, user_input)
+    if local_result is not None:
+        return local_result
+
+    agent_executor = get_agent_executor(memory=session.memory, stream=bool(callbacks))
+    response = agent_executor.invoke({"input": user_input}, config={"callbacks": callbacks or []})
+    bot_reply = response['output']
+    save_session(session)
+    return build_chat_result(session, bot_reply)
+
 @app.route("/api/chat", methods=["POST"])
 @log_requests
 def chat():
@@ -192,57 +190,132 @@ def chat():
         return jsonify({"status": "error", "response": "L'historique de conversation est vide"}), 400
 
     try:
-        if session_id not in web_user_memories:
-            web_user_memories[session_id] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
-        memory = web_user_memories[session_id]
         user_input = history[-1].get("content")
         if not user_input:
             return jsonify({"status": "error", "response": "Message utilisateur vide"}), 400
 
-        agent_executor = get_agent_executor(memory=memory)
-        response = agent_executor.invoke({"input": user_input})
-        bot_reply = response['output']
-
-        # --- ⚡️ Si l'agent confirme la prise de RDV ---
-        if "[CONFIRM_APPOINTMENT]" in bot_reply:
-            print("[INFO] Confirmation détectée. Traitement asynchrone lancé.")
-            
-            # Exemple : stockage temporaire des infos en mémoire utilisateur
-            user_data = extract_user_data_from_memory(memory)
-
-            print(f"[DEBUG] Nom extrait pour le ticket : {user_data['name']}")
-
-            ticket_data = TicketData(
-                type="appointment",
-                name=user_data["name"],
-                email=user_data["email"],
-                phone=user_data["phone"],
-                service_type=user_data["service_type"],
-                proposed_date=user_data["proposed_date"],
-                proposed_time=user_data["proposed_time"]
-            )
+        # Débit de la session limité : refus immédiat plutôt qu'une attente (voir admission.py)
+        admit_turn(f"web:{session_id}")
 
-            threading.Thread(target=process_appointment_backend, args=(ticket_data,)).start()
+        # Mode streaming : la réponse est diffusée au fil de la génération
+        if data.get("stream"):
+            return Response(stream_chat(session_id, user_input, tracing.current_trace_id()), mimetype="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-            return jsonify({
-                "status": "success",
-                "response": "Votre demande est en cours de traitement. Vous recevrez une confirmation par e-mail sous peu."
-            })
-
-        # Sinon, retour standard de l'agent
-        return jsonify({"status": "success", "response": bot_reply})
+        # Un tour à la fois par session ; les messages arrivés pendant l'attente sont traités
+        # dans le même tour, et chaque requête reçoit sa réponse
+        return jsonify(get_session_turns().run(f"web:{session_id}", user_input,
+                                               lambda text: chat_turn(session_id, text)))
 
+    except Overloaded as e:
+        result = busy_result(e)
+        return jsonify(result), 429, {"Retry-After": str(result["retry_after"])}
     except Exception as e:
         traceback.print_exc()
         return jsonify({"status": "error", "response": "Une erreur interne est survenue."}), 500
 
 
+@app.route("/metrics")
+def prometheus_metrics():
+    """Histogrammes de latence, compteurs et jauges au format texte Prometheus."""
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+metrics.gauge("job_queue_depth", lambda: get_job_queue().pending())
+metrics.gauge("whatsapp_incoming_queue_depth", incoming_queue.depth)
+
 @app.route("/health")
 def health():
     """Route pour vérifier que le service est en ligne."""
     return jsonify({"status": "healthy"}), 200
 
+@app.route("/api/jobs/<job_id>")
+def job_status(job_id):
+    """État d'une tâche de fond (queued/running/done/failed)."""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Tâche introuvable"}), 404
+    return jsonify({"status": "success", "job": job})
+
+# Durée maximale d'un flux de confirmation ; le navigateur (EventSource) se reconnecte ensuite
+# automatiquement. Reste sous le timeout des workers gunicorn (30s par défaut).
+CONFIRMATION_STREAM_TIMEOUT = float(os.getenv("CONFIRMATION_STREAM_TIMEOUT", "25"))
+
+@app.route("/api/confirmations/<job_id>/events")
+def confirmation_events(job_id):
+    """
+    Flux Server-Sent Events de la confirmation d'un rendez-vous.
+    Émet `confirmed` (infos du ticket) ou `failed` dès la fin du traitement.
+    """
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return jsonify({"status": "error", "message": "Confirmation introuvable"}), 404
+
+    def stream():
+        yield "retry: 2000\n\n"
+        job = queue.wait(job_id, timeout=CONFIRMATION_STREAM_TIMEOUT)
+        if job["state"] == "done":
+            yield sse_event("confirmed", job["result"])
+        elif job["state"] == "failed":
+            yield sse_event("failed", {"error": job["error"]})
+        else:
+            yield sse_event("pending", {"state": job["state"]})
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/jobs")
+def jobs_stats():
+    """Débit et latence de la file de tâches."""
+    return jsonify(get_job_queue().stats())
+
+@app.route("/api/faq/stats")
+def faq_stats():
+    """Taux de réponses servies par la FAQ locale."""
+    return jsonify(faq.stats())
+
+@app.route("/api/moderation/stats")
+def moderation_stats():
+    """Verdicts de modération par source (listes, cache, Llama Guard) et latence économisée."""
+    return jsonify(moderation.stats())
+
+@app.route("/api/llm_cache/stats")
+def llm_cache_stats():
+    """Taux de succès et taille du cache des réponses LLM (modération et tours d'agent non diffusés, voir llm_cache.py)."""
+    return jsonify(get_llm_response_cache().stats())
+
+@app.route("/api/admission/stats")
+def admission_stats():
+    """Appels aux modèles en cours et en attente, temps d'attente et refus par motif."""
+    return jsonify(admission.stats())
+
+@app.route("/api/llm/models")
+def llm_models_stats():
+    """Latence récente et état du disjoncteur de chaque modèle conversationnel."""
+    return jsonify(resilient_llm.stats())
+
+@app.route("/api/ticket_writer/stats")
+def ticket_writer_stats():
+    """Tickets en attente d'insertion dans Supabase, lots envoyés et échecs."""
+    return jsonify(get_ticket_writer().stats())
+
+@app.route("/api/tickets/<ticket_id>/email")
+def ticket_email_status(ticket_id):
+    """État de livraison de l'e-mail de confirmation d'un ticket (queued/retrying/sent/failed)."""
+    status = ticket_email_dispatcher().delivery_status(ticket_id)
+    if status["status"] == "unknown":
+        return jsonify({"status": "error", "message": "Aucun e-mail pour ce ticket"}), 404
+    return jsonify({"status": "success", "email": status})
+
+@app.route("/api/email/stats")
+def email_stats():
+    """E-mails de confirmation par état de livraison, envois et nouveaux essais."""
+    return jsonify(ticket_email_dispatcher().stats())
+
+@app.route("/api/startup")
+def startup_report():
+    """Durée des phases de démarrage (imports, initialisation, préchauffage)."""
+    return jsonify(startup.report())
+
 @app.route("/api/check_ticket", methods=["GET"])
 def check_ticket():
     email = request.args.get("email")
@@ -250,14 +323,17 @@ def check_ticket():
         return jsonify({"status": "error", "message": "Email manquant"}), 400
 
     try:
-        client = get_supabase_client()
-        if not client:
+        pool = get_supabase_pool()
+        if not pool:
             return jsonify({"status": "error", "message": "Erreur interne Supabase"}), 500
 
         time_limit = (datetime.utcnow() - timedelta(minutes=2)).isoformat()
 
-        result = client.table("tickets").select("*").eq("email", email).gte("created_at", time_limit).execute()
-        tickets = result.data if hasattr(result, 'data') else result  # fallback si .data non dispo
+        # Tickets pas encore insérés dans Supabase (écriture différée, voir ticket_writer.py)
+        tickets = get_ticket_writer().pending_for_email(email, time_limit)
+        if not tickets:
+            result = pool.execute("tickets", "select", lambda table: table.select("*").eq("email", email).gte("created_at", time_limit))
+            tickets = result.data if hasattr(result, 'data') else result  # fallback si .data non dispo
 
         if tickets and len(tickets) > 0:
             return jsonify({
@@ -0,0 +1,241 @@
+# Mode de service asynchrone : les routes à forte attente (chat, webhook WhatsApp, flux de
+# confirmation) sont servies par aiohttp sur la boucle d'événements ; un worker garde ainsi des
+# centaines de conversations en vol sans un thread par attente LLM. Les autres routes passent
+# par un pont WSGI vers l'application Flask (app.py), exécuté sur un petit pool de threads.
+#
+#   gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+import asyncio
+import io
+import os
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from aiohttp import web
+
+import app as flask_module
+import metrics
+import tracing
+from admission import Overloaded, admit_turn
+from app import CONFIRMATION_STREAM_TIMEOUT, answer_without_agent, build_chat_result, busy_result, sse_chat_event, sse_event
+from chat_stream import astream_reply
+from jobs import get_job_queue
+from lead_graph import CONFIRM_SENTINEL, get_agent_executor
+from message_queue import AsyncKeyedWorkQueue, QueueFull
+from session_store import open_session, run_blocking, save_session
+from session_turns import get_async_session_turns, merge_messages
+from whatsapp_webhook import WHATSAPP_DEBOUNCE_SECONDS, ahandle_incoming_message, enqueue_notification
+
+# --- Configuration ---
+# Messages WhatsApp traités simultanément (tâches asyncio, pas de threads)
+WHATSAPP_ASYNC_CONCURRENCY = int(os.getenv("WHATSAPP_ASYNC_CONCURRENCY", "256"))
+# Threads du pont WSGI (routes Flask courtes : santé, métriques, statistiques, tickets)
+WSGI_BRIDGE_THREADS = int(os.getenv("WSGI_BRIDGE_THREADS", "8"))
+
+SSE_HEADERS = {"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "upgrade", "proxy-authenticate",
+              "proxy-authorization", "te", "trailers"}
+
+incoming_queue = AsyncKeyedWorkQueue(
+    ahandle_incoming_message,
+    name="whatsapp",
+    workers=WHATSAPP_ASYNC_CONCURRENCY,
+    max_pending=int(os.getenv("WHATSAPP_QUEUE_MAX", "1000")),
+    merge=merge_messages,
+    debounce=WHATSAPP_DEBOUNCE_SECONDS,
+)
+metrics.gauge("whatsapp_incoming_queue_depth", incoming_queue.depth)
+
+_bridge = ThreadPoolExecutor(max_workers=WSGI_BRIDGE_THREADS, thread_name_prefix="wsgi-bridge")
+
+
+async def _json_body(request: web.Request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid JSON")
+
+
+async def _agent_reply(session, user_input: str, callbacks: list = None) -> str:
+    agent_executor = get_agent_executor(memory=session.memory, stream=bool(callbacks))
+    response = await agent_executor.ainvoke({"input": user_input}, config={"callbacks": callbacks or []})
+    await run_blocking(save_session, session)
+    return response["output"]
+
+
+async def achat_turn(session_id: str, user_input: str, callbacks: list = None) -> dict:
+    """Variante asyncio de app.chat_turn."""
+    # Stockage de sessions (SQLite, Redis) et file de tâches : accès bloquants, faits hors de la boucle
+    session = await run_blocking(open_session, f"web:{session_id}")
+    local_result = await run_blocking(answer_without_agent, session, user_input)
+    if local_result is not None:
+        return local_result
+    return await run_blocking(build_chat_result, session, await _agent_reply(session, user_input, callbacks))
+
+
+async def chat(request: web.Request) -> web.StreamResponse:
+    """Même contrat que /api/chat de app.py ; l'agent est attendu sans occuper de thread."""
+    data = await _json_body(request)
+    history = data.get("history", [])
+    session_id = data.get("session_id", "default_web_session")
+
+    if not history:
+        return web.json_response({"status": "error", "response": "L'historique de conversation est vide"}, status=400)
+
+    try:
+        user_input = history[-1].get("content")
+        if not user_input:
+            return web.json_response({"status": "error", "response": "Message utilisateur vide"}, status=400)
+
+        admit_turn(f"web:{session_id}")
+        turns = get_async_session_turns()
+        if not data.get("stream"):
+            return web.json_response(await turns.run(f"web:{session_id}", user_input,
+                                                     lambda text: achat_turn(session_id, text)))
+
+        response = web.StreamResponse(headers=SSE_HEADERS)
+        await response.prepare(request)
+        await _stream_turn(response, session_id, user_input)
+        await response.write_eof()
+        return response
+
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Overloaded as e:
+        result = busy_result(e)
+        return web.json_response(result, status=429, headers={"Retry-After": str(result["retry_after"])})
+    except Exception:
+        traceback.print_exc()
+        return web.json_response({"status": "error", "response": "Une erreur interne est survenue."}, status=500)
+
+
+async def _stream_turn(response: web.StreamResponse, session_id: str, user_input: str):
+    """
+    Tour diffusé en SSE ; en-têtes déjà envoyés : une erreur devient un événement `error`.
+    Le tour entier (verrou de la session, agent, prise de rendez-vous) s'exécute dans la tâche de
+    astream_reply : si le client se déconnecte, il va quand même jusqu'au bout.
+    """
+    async def turn(callbacks):
+        async with get_async_session_turns().lock(f"web:{session_id}"):
+            return await achat_turn(session_id, user_input, callbacks)
+
+    try:
+        async for event in astream_reply(turn, CONFIRM_SENTINEL):
+            await response.write(sse_chat_event(event).encode())
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Overloaded as e:
+        await response.write(sse_event("error", busy_result(e)).encode())
+    except Exception:
+        traceback.print_exc()
+        await response.write(sse_event("error", {"status": "error", "response": "Une erreur interne est survenue."}).encode())
+
+
+async def whatsapp_webhook(request: web.Request) -> web.Response:
+    """Notifications Meta : les messages sont déposés dans la file asynchrone, traités hors requête."""
+    data = await _json_body(request)
+    try:
+        enqueue_notification(data, incoming_queue)
+        return web.json_response({"status": "success"})
+    except QueueFull as e:
+        print(f"[WEBHOOK_POST] Queue full: '{e}'")
+        return web.json_response({"status": "error", "message": "Service busy"}, status=503)
+    except Exception as e:
+        print(f"[WEBHOOK_POST] Error: '{str(e)}'\n{traceback.format_exc()}")
+        return web.json_response({"status": "error", "message": "Internal server error"}, status=500)
+
+
+async def whatsapp_queue_stats(request: web.Request) -> web.Response:
+    return web.json_response(incoming_queue.stats())
+
+
+async def confirmation_events(request: web.Request) -> web.StreamResponse:
+    """Flux SSE de la confirmation d'un rendez-vous (voir app.py), attendu sans thread."""
+    job_id = request.match_info["job_id"]
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return web.json_response({"status": "error", "message": "Confirmation introuvable"}, status=404)
+
+    response = web.StreamResponse(headers=SSE_HEADERS)
+    await response.prepare(request)
+    await response.write(b"retry: 2000\n\n")
+    job = await queue.wait_async(job_id, timeout=CONFIRMATION_STREAM_TIMEOUT)
+    if job["state"] == "done":
+        await response.write(sse_event("confirmed", job["result"]).encode())
+    elif job["state"] == "failed":
+        await response.write(sse_event("failed", {"error": job["error"]}).encode())
+    else:
+        await response.write(sse_event("pending", {"state": job["state"]}).encode())
+    await response.write_eof()
+    return response
+
+
+def _wsgi_environ(request: web.Request, body: bytes) -> dict:
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(request.rel_url.raw_path, encoding="latin-1"),
+        "QUERY_STRING": request.rel_url.raw_query_string,
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": request.url.host or "localhost",
+        "SERVER_PORT": str(request.url.port or ""),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ: dict):
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = status, headers
+
+    iterable = flask_module.app.wsgi_app(environ, start_response)
+    try:
+        body = b"".join(iterable)
+    finally:
+        if hasattr(iterable, "close"):
+            iterable.close()
+    return started["status"], started["headers"], body
+
+
+async def flask_bridge(request: web.Request) -> web.Response:
+    """Routes non réécrites en asyncio : la réponse Flask est calculée sur le pool du pont."""
+    environ = _wsgi_environ(request, await request.read())
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(_bridge, _call_wsgi, environ)
+    response = web.Response(status=int(status.split(" ", 1)[0]), body=body)
+    for name, value in headers:
+        if name.lower() not in HOP_BY_HOP and name.lower() != "content-length":
+            response.headers.add(name, value)
+    return response
+
+
+def create_app() -> web.Application:
+    application = web.Application(client_max_size=4 * 1024 * 1024)
+    tracing.init_aiohttp(application, skip_routes=("flask",))
+    application.router.add_post("/api/chat", chat)
+    application.router.add_post("/whatsapp/webhook", whatsapp_webhook)
+    application.router.add_get("/whatsapp/queue", whatsapp_queue_stats)
+    application.router.add_get("/api/confirmations/{job_id}/events", confirmation_events)
+    application.router.add_route("*", "/{tail:.*}", flask_bridge, name="flask")
+    return application
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(app, port=int(os.environ.get("PORT", 5000)))
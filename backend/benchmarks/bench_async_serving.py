@@ -0,0 +1,67 @@
+"""
+Benchmark : service synchrone (app.py, pool de threads comme gunicorn gthread) contre service
+asynchrone (async_app.py, boucle asyncio comme aiohttp.GunicornWebWorker), sur le même test de
+charge hors ligne (benchmarks.loadtest) et dans un processus neuf pour chaque mode.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_async_serving --patients 100 --threads 8 --think 1
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROWS = [
+    ("débit (tours/s)", lambda r: r["throughput"]["turns_per_s"]),
+    ("web p50 (ms)", lambda r: r["latency"].get("web", {}).get("p50_ms")),
+    ("web p95 (ms)", lambda r: r["latency"].get("web", {}).get("p95_ms")),
+    ("web ttft p95 (ms)", lambda r: r["latency"].get("web_ttft", {}).get("p95_ms")),
+    ("whatsapp p50 (ms)", lambda r: r["latency"].get("whatsapp", {}).get("p50_ms")),
+    ("whatsapp ack p95 (ms)", lambda r: r["latency"].get("whatsapp_ack", {}).get("p95_ms")),
+    ("erreurs", lambda r: sum(r["errors"].values())),
+    ("RSS fin (Mo)", lambda r: r["memory_mb"]["rss_end"]),
+    ("threads", lambda r: r["threads"]),
+]
+
+
+def run_mode(server: str, args) -> dict:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output = f.name
+    command = [
+        sys.executable, "-m", "benchmarks.loadtest", "--server", server, "--threads", str(args.threads),
+        "--web", str(args.patients), "--whatsapp", str(args.patients), "--stream",
+        "--think", str(args.think), "--ramp-up", str(args.ramp_up),
+        "--llm-latency", str(args.llm_latency), "--seed", str(args.seed), "--output", output,
+    ]
+    print(f"[{server}] {' '.join(command[2:])}", flush=True)
+    proc = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(proc.stdout[-2000:], proc.stderr[-2000:])
+        raise SystemExit(f"Le test de charge en mode {server} a échoué.")
+    with open(output) as f:
+        report = json.load(f)
+    os.unlink(output)
+    return report
+
+
+def main(args):
+    reports = {server: run_mode(server, args) for server in ("sync", "async")}
+    print(f"\n{args.patients} patients web + {args.patients} WhatsApp, {args.threads} threads en mode sync")
+    print(f"{'mesure':>22} | {'sync':>10} | {'async':>10}")
+    for name, read in ROWS:
+        values = [read(reports[server]) for server in ("sync", "async")]
+        print(f"{name:>22} | " + " | ".join(f"{v if v is not None else '-':>10}" for v in values))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100, help="Patients simultanés par canal")
+    parser.add_argument("--threads", type=int, default=8, help="Threads du serveur synchrone")
+    parser.add_argument("--think", type=float, default=1.0)
+    parser.add_argument("--ramp-up", type=float, default=2.0)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    main(parser.parse_args())
@@ -0,0 +1,55 @@
+"""
+Benchmark : tokens de prompt envoyés à chaque tour, selon le mode de mémoire.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_memory_tokens --turns 60
+"""
+import argparse
+import itertools
+
+from langchain.memory import ConversationBufferMemory
+
+from conversation_memory import TokenBudgetMemory, count_message_tokens, estimate_tokens
+from lead_graph import BASE_SYSTEM_PROMPT
+
+# Conversation type d'un patient (répétée pour simuler une longue conversation)
+PATIENT_TURNS = [
+    ("Bonjour, je voudrais prendre un rendez-vous", "Bonjour ! Avec plaisir. Quel type de soin souhaitez-vous ?"),
+    ("Un détartrage s'il vous plaît", "Très bien, un détartrage. Quelle date vous conviendrait ?"),
+    ("Mardi prochain si possible", "Mardi prochain, c'est noté. À quelle heure souhaitez-vous venir ?"),
+    ("Vers 10h30", "Parfait. Puis-je avoir votre nom complet ?"),
+    ("Je m'appelle Awa Diop", "Merci Awa. Quelle est votre adresse e-mail ?"),
+    ("awa.diop@example.com", "Et votre numéro de téléphone ?"),
+    ("77 123 45 67", "Merci. Avez-vous d'autres questions avant la confirmation ?"),
+    ("Quels sont vos horaires le samedi ?", "Le samedi, la clinique est ouverte de 9h à 12h."),
+    ("Et où se trouve la clinique exactement ?", "La clinique se trouve Avenue Cheikh Anta Diop, à Dakar."),
+    ("Est-ce que le détartrage fait mal ?", "Le détartrage est généralement indolore ; une légère sensibilité est possible."),
+]
+
+
+def run(turns: int):
+    memories = {
+        "buffer": ConversationBufferMemory(memory_key="chat_history", return_messages=True),
+        "budget": TokenBudgetMemory(memory_key="chat_history", return_messages=True),
+    }
+    system_tokens = estimate_tokens(BASE_SYSTEM_PROMPT)
+    totals = {name: 0 for name in memories}
+    print(f"{'tour':>5} | {'buffer':>8} | {'budget':>8}")
+    for turn, (user, ai) in zip(range(1, turns + 1), itertools.cycle(PATIENT_TURNS)):
+        row = {}
+        for name, memory in memories.items():
+            history = memory.load_memory_variables({})["chat_history"]
+            row[name] = system_tokens + count_message_tokens(history) + estimate_tokens(user)
+            totals[name] += row[name]
+            memory.save_context({"input": user}, {"output": ai})
+        if turn == 1 or turn % 5 == 0:
+            print(f"{turn:>5} | {row['buffer']:>8} | {row['budget']:>8}")
+    print(f"Total sur {turns} tours : buffer={totals['buffer']} budget={totals['budget']} "
+          f"({100 * (1 - totals['budget'] / totals['buffer']):.0f}% de tokens en moins)")
+    print(f"Informations repliées dans le résumé : {memories['budget'].slots}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=60)
+    run(parser.parse_args().turns)
@@ -0,0 +1,85 @@
+"""
+Benchmark : coût de l'extraction des champs du ticket au tour de confirmation,
+relecture complète de l'historique (extract_user_data_from_messages) ou SlotTracker.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_slot_tracker --conversations 200 --lengths 10 40 120
+"""
+import argparse
+import random
+import time
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from slot_extraction import SlotTracker, extract_user_data_from_messages
+
+# Corpus de conversations de patients de la clinique
+NAMES = ["Awa Diop", "Moussa Ndiaye", "Fatou Sarr", "Cheikh Fall", "Aminata Ba", "Ibrahima Sow"]
+SERVICES = ["un détartrage", "une extraction", "un blanchiment", "une carie à soigner", "une prothèse", "l'orthodontie"]
+DAYS = ["demain", "lundi prochain", "mercredi", "samedi prochain", "25/11/2026", "après-demain"]
+HOURS = ["9h", "10h30", "11h", "14h15", "16h", "17h45"]
+SMALL_TALK = [
+    ("Quels sont vos horaires ?", "La clinique est ouverte du lundi au vendredi de 8h30 à 18h, et le samedi de 9h à 12h."),
+    ("Où se trouve la clinique ?", "La clinique se trouve à Dakar, Avenue Cheikh Anta Diop."),
+    ("Est-ce que ça fait mal ?", "Le soin est généralement indolore ; une légère sensibilité est possible."),
+    ("Vous acceptez les assurances ?", "Oui, nous travaillons avec la plupart des assurances santé."),
+    ("Combien de temps dure le rendez-vous ?", "Comptez environ une heure."),
+]
+
+
+def conversation(rng: random.Random, length: int) -> list:
+    """Conversation d'environ `length` messages se terminant par la confirmation."""
+    name = rng.choice(NAMES)
+    email = name.lower().replace(" ", ".") + "@example.com"
+    collect = [
+        (f"Bonjour, je voudrais {rng.choice(SERVICES)}", "Bien sûr. Quelle date vous conviendrait ?"),
+        (f"{rng.choice(DAYS)} si possible", "C'est noté. À quelle heure ?"),
+        (f"Vers {rng.choice(HOURS)}", "Parfait. Quel est votre nom ?"),
+        (f"Je m'appelle {name}", "Merci. Votre adresse e-mail ?"),
+        (email, "Et votre numéro de téléphone ?"),
+        (f"77 {rng.randint(100, 999)} {rng.randint(10, 99)} {rng.randint(10, 99)}", "Merci, je prépare le récapitulatif."),
+    ]
+    turns = list(collect)
+    while len(turns) * 2 < length - 2:
+        turns.insert(rng.randint(1, len(turns)), rng.choice(SMALL_TALK))
+    turns.append(("oui", "[CONFIRM_APPOINTMENT]"))
+    messages = []
+    for user, ai in turns:
+        messages += [HumanMessage(content=user), AIMessage(content=ai)]
+    return messages
+
+
+def run(conversations: int, lengths: list):
+    rng = random.Random(42)
+    print(f"{'messages':>9} | {'relecture (ms)':>14} | {'tracker (ms)':>12} | {'suivi/message (µs)':>18}")
+    for length in lengths:
+        corpus = [conversation(rng, length) for _ in range(conversations)]
+        rescan = tracker_read = tracker_observe = 0.0
+        observed = 0
+        for messages in corpus:
+            # Avant : toutes les extractions sur tout l'historique, au tour de confirmation
+            t0 = time.perf_counter()
+            expected = extract_user_data_from_messages(messages)
+            rescan += time.perf_counter() - t0
+
+            # Après : chaque message est analysé à son arrivée, la confirmation lit l'état
+            tracker = SlotTracker()
+            t0 = time.perf_counter()
+            for message in messages:
+                tracker.observe(message.content)
+            tracker_observe += time.perf_counter() - t0
+            observed += len(messages)
+            t0 = time.perf_counter()
+            slots = dict(tracker.slots)
+            tracker_read += time.perf_counter() - t0
+            assert slots == expected, (slots, expected)
+        print(f"{len(corpus[0]):>9} | {1000 * rescan / conversations:>14.3f} | {1000 * tracker_read / conversations:>12.4f} | "
+              f"{1e6 * tracker_observe / observed:>18.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 40, 120])
+    args = parser.parse_args()
+    run(args.conversations, args.lengths)
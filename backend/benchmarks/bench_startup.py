@@ -0,0 +1,76 @@
+"""
+Benchmark : démarrage à froid de l'application (temps d'import de `app`, modules les plus
+coûteux d'après `python -X importtime`, phases de démarrage et préchauffage).
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_startup --top 15
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Processus enfant : import à froid de app, puis rapport de startup.py une fois le préchauffage terminé
+CHILD = """
+import json, time
+t0 = time.perf_counter()
+import app, startup
+imported = time.perf_counter() - t0
+startup.wait_warmup(60)
+print("STARTUP_REPORT " + json.dumps({"import_s": imported, **startup.report()}))
+"""
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def child(env: dict, importtime: bool) -> subprocess.CompletedProcess:
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run([sys.executable, *flags, "-c", CHILD], env=env, capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(top: int, warmup: bool):
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    env = {
+        **os.environ,
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "LLM_CACHE_DB": os.path.join(workdir, "llm_cache.db"),
+        "CALENDAR_MIRROR_DB": os.path.join(workdir, "calendar_mirror.db"),
+    }
+    # Détail des imports sans préchauffage (ses imports en arrière-plan se mêleraient à ceux de app)
+    proc = child({**env, "WARMUP_ON_START": "false"}, importtime=True)
+    modules = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    proc = child({**env, "WARMUP_ON_START": "true" if warmup else "false"}, importtime=False)
+    shutil.rmtree(workdir, ignore_errors=True)
+    report = next((json.loads(line.split(" ", 1)[1]) for line in proc.stdout.splitlines()
+                   if line.startswith("STARTUP_REPORT ")), None)
+    if report is None:
+        print(proc.stderr[-2000:])
+        raise SystemExit("Le processus enfant n'a pas produit de rapport de démarrage.")
+
+    print(f"Import de app : {1000 * report['import_s']:.0f} ms")
+    print("\nImports directs de app (cumulé) :")
+    for name, _, _, cumulative in sorted((m for m in modules if m[1] == 1), key=lambda m: -m[3])[:top]:
+        print(f"{name:>40} | {cumulative / 1000:>8.1f} ms")
+    print("\nModules les plus coûteux (temps propre) :")
+    for name, _, self_us, _ in sorted(modules, key=lambda m: -m[2])[:top]:
+        print(f"{name:>40} | {self_us / 1000:>8.1f} ms")
+    print(f"\nPhases de démarrage (préchauffage : {report['warmup']}) :")
+    for p in report["phases"]:
+        print(f"{p['phase']:>40} | {1000 * p['seconds']:>8.1f} ms | début {1000 * p['start_s']:>7.0f} ms | {p['thread']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-warmup", action="store_true", help="Désactive le préchauffage (WARMUP_ON_START=false)")
+    args = parser.parse_args()
+    run(args.top, not args.no_warmup)
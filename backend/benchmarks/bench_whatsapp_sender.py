@@ -0,0 +1,52 @@
+"""
+Benchmark : envoi de réponses WhatsApp avec `requests.post` nu ou avec WhatsAppSender.
+
+Usage (depuis backend/) :
+    python -m benchmarks.bench_whatsapp_sender --messages 200 --latency 0.005
+"""
+import argparse
+import time
+
+import requests
+
+from benchmarks.stubs import GraphApiStub
+from whatsapp_sender import WhatsAppSender
+
+
+def bare_post(base_url: str, to_number: str, text: str):
+    # Comportement historique : une nouvelle connexion par message, sans réessai
+    url = f"{base_url}/PHONE_ID/messages"
+    headers = {"Authorization": "Bearer TOKEN", "Content-Type": "application/json"}
+    payload = {"messaging_product": "whatsapp", "to": to_number, "type": "text", "text": {"body": text}}
+    try:
+        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as err:
+        return {"error": str(err)}
+
+
+def run(messages: int, latency: float, fail_every: int):
+    for name in ("requests.post", "WhatsAppSender"):
+        stub = GraphApiStub(latency=latency, fail_every=fail_every).start()
+        sender = WhatsAppSender("TOKEN", "PHONE_ID", base_url=stub.base_url, rate_per_second=0)
+        t0 = time.perf_counter()
+        if name == "WhatsAppSender":
+            results = sender.send_many("221770000000", [f"message {i}" for i in range(messages)])
+        else:
+            results = [bare_post(stub.base_url, "221770000000", f"message {i}") for i in range(messages)]
+        elapsed = time.perf_counter() - t0
+        errors = sum(1 for r in results if "error" in r)
+        print(f"{name:>15} : {messages} messages en {elapsed:.2f}s "
+              f"({1000 * elapsed / messages:.2f} ms/message), {len(stub.connections)} connexions, "
+              f"{stub.requests} requêtes, {errors} échecs")
+        stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005, help="Latence simulée de l'API Graph (s)")
+    parser.add_argument("--fail-every", type=int, default=20, help="Un 429 toutes les N requêtes (0 : aucun)")
+    args = parser.parse_args()
+    run(args.messages, args.latency, args.fail_every)
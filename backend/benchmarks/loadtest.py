@@ -0,0 +1,448 @@
+"""
+Test de charge hors ligne : l'application complète, servie dans ce processus, avec des
+remplaçants locaux pour Groq, Google Calendar, Supabase, le serveur SMTP et l'API Graph.
+`--server sync` sert app.py avec un pool de `--threads` threads (comme gunicorn gthread),
+`--server async` sert async_app.py sur une boucle asyncio (comme aiohttp.GunicornWebWorker).
+
+N patients simulés mènent en parallèle une prise de rendez-vous complète sur `/api/chat`
+(widget web) et M sur `/whatsapp/webhook`. Le rapport donne les latences p50/p95/p99 par
+canal, le débit, la mémoire du processus et l'activité des services simulés ; `--output`
+l'écrit en JSON pour comparer les changements de performance à une référence.
+
+Usage (depuis backend/) :
+    python -m benchmarks.loadtest --web 20 --whatsapp 20 --llm-latency 0.3 --stream
+    python -m benchmarks.loadtest --web 100 --whatsapp 100 --server async --think 1
+    python -m benchmarks.loadtest --web 20 --whatsapp 20 --stream --llm-slow-rate 0.05 [--no-fallback]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+import requests
+
+from benchmarks.stubs import CalendarStub, FakeChatGroq, GraphApiStub, SmtpStub, SupabaseStub
+
+SERVICES = ["un détartrage", "une extraction", "un blanchiment", "une carie à soigner", "une prothèse", "l'orthodontie"]
+FIRST_NAMES = ["Awa", "Moussa", "Fatou", "Cheikh", "Aminata", "Ibrahima", "Khady", "Ousmane"]
+LAST_NAMES = ["Diop", "Ndiaye", "Sarr", "Fall", "Ba", "Sow", "Faye", "Gueye"]
+HOURS = ["9h", "10h30", "11h", "15h15", "16h", "17h45"]
+FAQ_QUESTIONS = ["Quels sont vos horaires ?", "Où se trouve la clinique ?", "Quel est votre numéro de téléphone ?"]
+TURN_TIMEOUT = 60
+BUSY_RETRIES = 5
+
+
+def patient_script(rng: random.Random, index: int) -> list:
+    """Messages d'un patient : collecte des informations, une question fréquente parfois, puis confirmation."""
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    turns = [
+        f"Bonjour, je voudrais {rng.choice(SERVICES)}",
+        f"Le {rng.randint(13, 28)}/11/2026 si possible",
+        f"Vers {rng.choice(HOURS)}",
+        f"Je m'appelle {first} {last}",
+        f"{first.lower()}.{last.lower()}.{index}@example.com",
+        f"77 {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+    ]
+    if rng.random() < 0.5:
+        turns.insert(rng.randint(1, len(turns) - 1), rng.choice(FAQ_QUESTIONS))
+    turns.append("oui")
+    return turns
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize(values: list) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(1000 * percentile(values, 0.50), 1),
+        "p95_ms": round(1000 * percentile(values, 0.95), 1),
+        "p99_ms": round(1000 * percentile(values, 0.99), 1),
+        "max_ms": round(1000 * max(values), 1) if values else 0.0,
+    }
+
+
+def rss_mb() -> float:
+    """Mémoire résidente actuelle du processus (serveur et clients simulés)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class Results:
+    """Latences et erreurs collectées par les patients (sûr entre threads)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def error(self, name: str):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def read_sse(response):
+    """Itère sur les événements (nom, données) d'une réponse Server-Sent Events."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[6:].strip()
+        elif line.startswith("data:"):
+            data.append(line[5:].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data)) if data else None
+            event, data = None, []
+
+
+def post_turn(http: requests.Session, base_url: str, payload: dict, t0: float, results: Results) -> dict:
+    """Un tour de chat ; retourne la réponse finale (JSON ou dernier événement SSE)."""
+    response = http.post(f"{base_url}/api/chat", json=payload, stream=payload["stream"], timeout=TURN_TIMEOUT)
+    if response.status_code != 429:
+        response.raise_for_status()
+    if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+        first_token = True
+        for event, data in read_sse(response):
+            if event == "token" and first_token:
+                first_token = False
+                results.record("web_ttft", time.perf_counter() - t0)
+            elif event in ("done", "error"):
+                if first_token and "retry_after" not in data:  # Voie rapide ou FAQ : réponse complète d'un bloc
+                    results.record("web_ttft", time.perf_counter() - t0)
+                return data
+        return None
+    if payload["stream"] and response.status_code != 429:  # Voie rapide ou FAQ : réponse complète d'un bloc
+        results.record("web_ttft", time.perf_counter() - t0)
+    return response.json()
+
+
+def web_patient(base_url: str, script: list, stream: bool, think: float, results: Results):
+    session_id = uuid.uuid4().hex
+    history = []
+    job_id = None
+    with requests.Session() as http:
+        for message in script:
+            history.append({"role": "user", "content": message})
+            t0 = time.perf_counter()
+            try:
+                for _ in range(BUSY_RETRIES):
+                    body = post_turn(http, base_url, {"history": history, "session_id": session_id, "stream": stream},
+                                     t0, results)
+                    if not body or "retry_after" not in body:
+                        break
+                    # Contrôle d'admission (HTTP 429 ou événement SSE) : le widget réessaie plus tard
+                    results.error("web_busy")
+                    time.sleep(body["retry_after"])
+                if not body or body.get("status") != "success":
+                    raise RuntimeError(body)
+            except Exception:
+                results.error("web")
+                return
+            results.record("web", time.perf_counter() - t0)
+            history.append({"role": "assistant", "content": body["response"]})
+            job_id = body.get("job_id") or job_id
+            if think:
+                time.sleep(think)
+
+        # Confirmation du rendez-vous, attendue comme le widget (flux SSE de la tâche)
+        if job_id is None:
+            results.error("booking")
+            return
+        try:
+            while True:
+                response = http.get(f"{base_url}/api/confirmations/{job_id}/events", stream=True, timeout=TURN_TIMEOUT)
+                event = next((event for event, _ in read_sse(response)), None)
+                if event != "pending":
+                    break
+            if event != "confirmed":
+                raise RuntimeError(event)
+            results.record("booking", time.perf_counter() - t0)
+        except Exception:
+            results.error("booking")
+
+
+def whatsapp_patient(base_url: str, phone: str, replies: queue.Queue, script: list, think: float, results: Results):
+    with requests.Session() as http:
+        for message in script:
+            payload = {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {"messages": [
+                {"from": phone, "id": f"wamid.{uuid.uuid4().hex}", "type": "text", "text": {"body": message}},
+            ]}}]}]}
+            t0 = time.perf_counter()
+            try:
+                response = http.post(f"{base_url}/whatsapp/webhook", json=payload, timeout=TURN_TIMEOUT)
+                response.raise_for_status()
+                results.record("whatsapp_ack", time.perf_counter() - t0)
+                replied_at = replies.get(timeout=TURN_TIMEOUT)  # Réponse reçue par l'API Graph simulée
+            except Exception:
+                results.error("whatsapp")
+                return
+            results.record("whatsapp", replied_at - t0)
+            if think:
+                time.sleep(think)
+
+
+def configure_environment(workdir: str, smtp: SmtpStub, graph: GraphApiStub):
+    """Bases locales dans un répertoire temporaire et services externes redirigés vers les stubs."""
+    os.environ.update({
+        "JOBS_DB_PATH": os.path.join(workdir, "jobs.db"),
+        "LLM_CACHE_DB": os.path.join(workdir, "llm_cache.db"),
+        "CALENDAR_MIRROR_DB": os.path.join(workdir, "calendar_mirror.db"),
+        "SESSION_SQLITE_PATH": os.path.join(workdir, "sessions.db"),
+        "TICKET_JOURNAL_PATH": os.path.join(workdir, "tickets_journal.db"),
+        "SMTP_HOST": smtp.host,
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_STARTTLS": "false",
+        "SENDER_EMAIL": "clinique@example.com",
+        "SENDER_APP_PASSWORD": "stub",
+        "WHATSAPP_API_BASE": graph.base_url,
+        "WHATSAPP_TOKEN": "TOKEN",
+        "WHATSAPP_PHONE_ID": "PHONE_ID",
+        "SUPABASE_HEALTH_CHECK_INTERVAL": "0",
+        "WARMUP_ON_START": "false",  # Les modèles sont remplacés juste après l'import
+    })
+
+
+def serve_sync(flask_app, threads: int):
+    """
+    Sert l'application Flask avec au plus `threads` requêtes en cours, comme un worker gunicorn
+    gthread. Les connexions sont fermées après chaque réponse (HTTP/1.0) : un thread n'est
+    occupé que pendant le traitement d'une requête, pas par une connexion inactive.
+    """
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        def __init__(self, *server_args):
+            super().__init__(*server_args)
+            self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="gthread")
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._process, request, client_address)
+
+        def _process(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer("127.0.0.1", 0, flask_app)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+
+def serve_async(aiohttp_app):
+    """Sert l'application aiohttp sur une boucle d'événements dédiée, dans un thread."""
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(aiohttp_app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    def shutdown():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+
+    return f"http://127.0.0.1:{port}", shutdown
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = Results()
+    replies = {}
+
+    def on_whatsapp_reply(payload):
+        if payload.get("text", {}).get("body") == BUSY_REPLY:
+            results.error("whatsapp_busy")
+        recipient = replies.get(payload.get("to"))
+        if recipient is not None:
+            recipient.put(time.perf_counter())
+
+    calendar = CalendarStub(latency=args.calendar_latency)
+    supabase = SupabaseStub(latency=args.supabase_latency)
+    smtp = SmtpStub(latency=args.smtp_latency).start()
+    graph = GraphApiStub(latency=args.graph_latency, on_message=on_whatsapp_reply).start()
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    configure_environment(workdir, smtp, graph)
+
+    log = sys.stdout if args.verbose else open(os.devnull, "w")
+    with redirect_stdout(log):
+        if not args.verbose:
+            logging.disable(logging.INFO)
+        # Import après la configuration : les modules lisent leurs variables d'environnement au chargement
+        import app as app_module
+        import lead_graph
+        import metrics
+        import supabase_client
+        from admission import BUSY_REPLY
+        from jobs import get_job_queue
+        from resilient_llm import ResilientChatModel
+        from ticket_writer import get_ticket_writer
+
+        # Modèle principal avec traîne de latence / pannes simulées, doublé du modèle de secours comme en production
+        lead_graph.llm = ResilientChatModel(
+            primary=FakeChatGroq(latency=args.llm_latency, token_delay=args.token_delay, tokens=args.tokens,
+                                 slow_rate=args.llm_slow_rate, slow_latency=args.llm_slow_latency,
+                                 error_rate=args.llm_error_rate),
+            fallback=None if args.no_fallback else FakeChatGroq(model_name="fake-groq-fallback", latency=args.llm_latency,
+                                                                token_delay=args.token_delay, tokens=args.tokens),
+        )
+        lead_graph.llama_guard = FakeChatGroq(model_name="fake-llama-guard", latency=args.llm_latency,
+                                              token_delay=0.0, tokens=1, reply="safe")
+        lead_graph._compiled_agent = None
+        lead_graph.get_calendar_service = calendar.get_service
+        lead_graph.get_calendar_pool = lambda *args: calendar
+        supabase_client._pool = supabase
+
+        if args.server == "async":
+            import async_app
+            base_url, shutdown = serve_async(async_app.app)
+        else:
+            base_url, shutdown = serve_sync(app_module.app, args.threads)
+
+        patients = []
+        for i in range(args.web):
+            patients.append(threading.Thread(target=web_patient, args=(
+                base_url, patient_script(rng, i), args.stream, args.think, results)))
+        for i in range(args.whatsapp):
+            phone = f"22177{i:07d}"
+            replies[phone] = queue.Queue()
+            patients.append(threading.Thread(target=whatsapp_patient, args=(
+                base_url, phone, replies[phone], patient_script(rng, args.web + i), args.think, results)))
+        rng.shuffle(patients)
+
+        rss_start = rss_mb()
+        t0 = time.perf_counter()
+        for i, patient in enumerate(patients):
+            patient.start()
+            if args.ramp_up and i < len(patients) - 1:
+                time.sleep(args.ramp_up / len(patients))
+        for patient in patients:
+            patient.join()
+        elapsed = time.perf_counter() - t0
+
+        # Fin des traitements de fond : rendez-vous, insertion des tickets, puis e-mails de confirmation
+        deadline = time.monotonic() + TURN_TIMEOUT
+        while any(get_job_queue().stats()["states"][state] for state in ("queued", "running")) \
+                and time.monotonic() < deadline:
+            time.sleep(0.05)
+        while get_ticket_writer().pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        while metrics.counter("email_sent_total").value + metrics.counter("email_failed_total").value \
+                < metrics.counter("email_queued_total").value and time.monotonic() < deadline:
+            time.sleep(0.05)
+        rss_end = rss_mb()
+        threads_end = threading.active_count()
+        shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    turns = sum(len(results.latencies.get(name, [])) for name in ("web", "whatsapp"))
+    bookings = len(results.latencies.get("booking", []))
+    dialogue = metrics.snapshot("dialogue_turns_total").get("dialogue_turns_total", {})
+    report = {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 2),
+        "throughput": {"turns_per_s": round(turns / elapsed, 2), "bookings_per_s": round(bookings / elapsed, 3)},
+        "latency": {name: summarize(values) for name, values in sorted(results.latencies.items())},
+        "errors": results.errors,
+        "memory_mb": {"rss_start": round(rss_start, 1), "rss_end": round(rss_end, 1), "peak": round(peak_rss_mb(), 1)},
+        "threads": threads_end,
+        "server": {
+            "dialogue_turns": {key.split("=", 1)[1]: value for key, value in dialogue.items()},
+            "spans_p95_ms": {key.split("=", 1)[1]: round(1000 * hist["p95"], 1) for key, hist in
+                             metrics.snapshot("span_seconds").get("span_seconds", {}).items()},
+            "llm_hedging": {name: sum(values.values()) for name, values in metrics.snapshot("llm_").items()
+                            if name in ("llm_hedged_total", "llm_hedge_wins_total", "llm_hedge_skipped_total",
+                                        "llm_failovers_total", "llm_model_errors_total")},
+        },
+        "stubs": {
+            "supabase_tickets": len(supabase.tables["tickets"]),
+            "supabase_requests": supabase.requests,
+            "calendar_events": len(calendar.created),
+            "emails": len(smtp.messages),
+            "smtp_connections": smtp.connections,
+            "whatsapp_messages": len(graph.messages),
+        },
+    }
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nRapport JSON écrit dans {args.output}")
+
+
+def print_report(report: dict):
+    print(f"\n{report['config']['web']} patients web, {report['config']['whatsapp']} patients WhatsApp, "
+          f"serveur {report['config']['server']}, {report['elapsed_s']}s")
+    print(f"{'mesure':>14} | {'n':>5} | {'p50 (ms)':>9} | {'p95 (ms)':>9} | {'p99 (ms)':>9} | {'max (ms)':>9}")
+    for name, stats in report["latency"].items():
+        print(f"{name:>14} | {stats['count']:>5} | {stats['p50_ms']:>9.1f} | {stats['p95_ms']:>9.1f} | "
+              f"{stats['p99_ms']:>9.1f} | {stats['max_ms']:>9.1f}")
+    print(f"Débit : {report['throughput']['turns_per_s']} tours/s, {report['throughput']['bookings_per_s']} réservations/s")
+    print(f"Erreurs : {report['errors'] or 'aucune'}")
+    memory = report["memory_mb"]
+    print(f"Mémoire (Mo) : RSS {memory['rss_start']} -> {memory['rss_end']}, pic {memory['peak']}")
+    print(f"Threads du processus en fin de test : {report['threads']}")
+    print(f"Tours de dialogue : {report['server']['dialogue_turns']}")
+    print(f"Spans p95 (ms) : {report['server']['spans_p95_ms']}")
+    print(f"Requêtes de secours : {report['server']['llm_hedging'] or 'aucune'}")
+    print(f"Services simulés : {report['stubs']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--web", type=int, default=10, help="Patients simultanés sur /api/chat")
+    parser.add_argument("--whatsapp", type=int, default=10, help="Patients simultanés sur /whatsapp/webhook")
+    parser.add_argument("--stream", action="store_true", help="Réponses web en streaming (SSE), comme le widget")
+    parser.add_argument("--server", choices=["sync", "async"], default="sync",
+                        help="app.py sur un pool de threads (gthread) ou async_app.py sur une boucle asyncio")
+    parser.add_argument("--threads", type=int, default=8, help="Threads du serveur en mode sync (--threads de gunicorn)")
+    parser.add_argument("--think", type=float, default=0.0, help="Pause du patient entre deux messages (s)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Durée d'arrivée de tous les patients (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Délai avant le premier token (s)")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Délai entre deux tokens (s)")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens par réponse du modèle")
+    parser.add_argument("--llm-slow-rate", type=float, default=0.0, help="Fraction d'appels lents du modèle principal")
+    parser.add_argument("--llm-slow-latency", type=float, default=5.0, help="Délai avant le premier token des appels lents (s)")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Fraction d'appels en échec du modèle principal")
+    parser.add_argument("--no-fallback", action="store_true", help="Sans modèle de secours (ni couverture ni bascule)")
+    parser.add_argument("--calendar-latency", type=float, default=0.15)
+    parser.add_argument("--supabase-latency", type=float, default=0.05)
+    parser.add_argument("--smtp-latency", type=float, default=0.1)
+    parser.add_argument("--graph-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Fichier JSON du rapport (référence de comparaison)")
+    parser.add_argument("--verbose", action="store_true", help="Affiche les logs de l'application")
+    run(parser.parse_args())
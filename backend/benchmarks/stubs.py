@@ -0,0 +1,444 @@
+"""Serveurs locaux simulant les services externes, pour les benchmarks."""
+import asyncio
+import itertools
+import json
+import random
+import socketserver
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import httplib2
+from dateutil.parser import isoparse
+from googleapiclient.errors import HttpError
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class GraphApiStub:
+    """
+    Faux endpoint `/{phone_id}/messages` de l'API Graph WhatsApp (HTTP/1.1 keep-alive).
+    `latency` simule le temps de réponse ; `fail_every` renvoie un 429 toutes les N requêtes ;
+    `on_message(payload)` est appelé à chaque message accepté.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, on_message=None):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.on_message = on_message
+        self.requests = 0
+        self.connections = set()
+        self.messages = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests += 1
+                    stub.connections.add(self.client_address)
+                    failing = stub.fail_every and stub.requests % stub.fail_every == 0
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if failing:
+                    return self._reply(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0"})
+                payload = json.loads(body)
+                with stub._lock:
+                    stub.messages.append(payload)
+                if stub.on_message is not None:
+                    stub.on_message(payload)
+                self._reply(200, {"messages": [{"id": f"wamid.{stub.requests}"}]})
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# Réponse type de l'assistant (mots répétés jusqu'au nombre de tokens voulu)
+ASSISTANT_REPLY = (
+    "Très bien, c'est noté. Pour finaliser votre demande, pourriez-vous me préciser "
+    "l'information suivante afin que je puisse vérifier les disponibilités de la clinique ?"
+)
+
+
+class FakeChatGroq(BaseChatModel):
+    """
+    Remplaçant de ChatGroq : attend `latency` secondes avant le premier token, puis
+    produit `tokens` tokens espacés de `token_delay` (en streaming comme en appel simple).
+    Une fraction `slow_rate` des appels attend `slow_latency` au lieu de `latency` (traîne de
+    latence) ; une fraction `error_rate` échoue avant le premier token (panne).
+    """
+
+    model_name: str = "fake-groq"
+    latency: float = 0.3
+    token_delay: float = 0.01
+    tokens: int = 40
+    reply: str = ASSISTANT_REPLY
+    slow_rate: float = 0.0
+    slow_latency: float = 0.0
+    error_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-groq"
+
+    def bind_tools(self, tools, **kwargs):
+        return self  # Le faux modèle ne demande jamais d'outil : l'agent répond directement
+
+    def _tokens(self) -> list:
+        words = self.reply.split()
+        return [("" if i == 0 else " ") + words[i % len(words)] for i in range(max(1, self.tokens))]
+
+    def _first_token_latency(self) -> float:
+        draw = random.random()
+        if draw < self.error_rate:
+            raise ConnectionError(f"{self.model_name} indisponible")
+        return self.slow_latency if draw < self.error_rate + self.slow_rate else self.latency
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tokens = self._tokens()
+        time.sleep(self._first_token_latency() + self.token_delay * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._first_token_latency())
+        for i, token in enumerate(self._tokens()):
+            if i:
+                time.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        tokens = self._tokens()
+        await asyncio.sleep(self._first_token_latency() + self.token_delay * (len(tokens) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._first_token_latency())
+        for i, token in enumerate(self._tokens()):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+class _StubRequest:
+    """Requête différée, exécutée par `.execute()` comme celles des clients Google et Supabase."""
+
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self):
+        return self._run()
+
+
+class CalendarStub:
+    """
+    Faux Google Calendar (events.list / events.insert / events.get), interchangeable avec
+    CalendarServicePool : `get_service()` et `execute(operation, request)`. `latency` simule le
+    temps de réponse. Comme Google, un insert avec un `id` déjà utilisé est refusé (409).
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.created = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def get_service(self):
+        return self
+
+    def events(self):
+        return self
+
+    def list(self, calendarId=None, timeMin=None, timeMax=None, syncToken=None, **params):
+        def run():
+            if syncToken:
+                return {"items": [], "nextSyncToken": syncToken}  # Les créations sont écrites dans le miroir
+            with self._lock:
+                items = list(self.created.values())
+            if timeMin and timeMax:
+                start, end = isoparse(timeMin), isoparse(timeMax)
+                items = [e for e in items if isoparse(e["start"]["dateTime"]) < end and isoparse(e["end"]["dateTime"]) > start]
+            return {"items": items, "nextSyncToken": "stub-sync-token"}
+        return _StubRequest(run)
+
+    def insert(self, calendarId=None, body=None):
+        def run():
+            event_id = body.get("id") or f"evt{next(self._ids)}"
+            event = {**body, "id": event_id, "status": "confirmed",
+                     "htmlLink": f"https://calendar.example/event?eid={event_id}"}
+            with self._lock:
+                if event_id in self.created:
+                    raise HttpError(httplib2.Response({"status": 409}), b'{"error": {"message": "duplicate"}}')
+                self.created[event_id] = event
+            return event
+        return _StubRequest(run)
+
+    def get(self, calendarId=None, eventId=None):
+        def run():
+            with self._lock:
+                if eventId not in self.created:
+                    raise HttpError(httplib2.Response({"status": 404}), b'{"error": {"message": "not found"}}')
+                return self.created[eventId]
+        return _StubRequest(run)
+
+    def execute(self, operation: str, request):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return request.execute()
+
+
+class _StubQuery:
+    def __init__(self, run, filters=None):
+        self._run = run
+        self._filters = filters or []
+        self._limit = None
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gte(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def execute(self):
+        rows = [row for row in self._run() if all(f(row) for f in self._filters)]
+        return SimpleNamespace(data=rows[:self._limit] if self._limit is not None else rows)
+
+
+class SupabaseStub:
+    """
+    Faux pool Supabase (même interface `execute(table, operation, build)` que SupabasePool) :
+    tables en mémoire, `insert`, `upsert` et `select` avec filtres `eq` / `gte` / `limit`.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.tables = defaultdict(list)
+        self._lock = threading.Lock()
+        self.healthy = True
+
+    def _table(self, name: str):
+        stub = self
+
+        class Table:
+            def insert(self, data):
+                def run():
+                    rows = data if isinstance(data, list) else [data]
+                    with stub._lock:
+                        stub.tables[name].extend(dict(row) for row in rows)
+                    return rows
+                return _StubQuery(run)
+
+            def upsert(self, data, on_conflict: str, ignore_duplicates: bool = False):
+                def run():
+                    rows = data if isinstance(data, list) else [data]
+                    with stub._lock:
+                        existing = {row.get(on_conflict): row for row in stub.tables[name]}
+                        for row in rows:
+                            if row[on_conflict] not in existing:
+                                stub.tables[name].append(dict(row))
+                            elif not ignore_duplicates:
+                                existing[row[on_conflict]].update(row)
+                    return rows
+                return _StubQuery(run)
+
+            def select(self, *columns):
+                def run():
+                    with stub._lock:
+                        return list(stub.tables[name])
+                return _StubQuery(run)
+
+        return Table()
+
+    def execute(self, table: str, operation: str, build):
+        query = build(self._table(table))
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return query.execute()
+
+    def stats(self) -> dict:
+        return {"healthy": True, "requests": self.requests}
+
+
+class SmtpStub:
+    """
+    Serveur SMTP minimal (EHLO, AUTH PLAIN, MAIL / RCPT / DATA, NOOP, QUIT), sans TLS.
+    `latency` simule le temps d'acceptation d'un message.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.connections = 0
+        self.messages = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line: str):
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                with stub._lock:
+                    stub.connections += 1
+                self.reply("220 stub ESMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors="replace").strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.reply("250-stub")
+                        self.reply("250 AUTH PLAIN")
+                    elif command.startswith("AUTH"):
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        data = []
+                        for data_line in iter(self.rfile.readline, b""):
+                            if data_line in (b".\r\n", b".\n"):
+                                break
+                            data.append(data_line)
+                        if stub.latency:
+                            time.sleep(stub.latency)
+                        with stub._lock:
+                            stub.messages.append(b"".join(data))
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("250 OK")  # MAIL, RCPT, NOOP, RSET
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class RedisStub:
+    """
+    Serveur Redis minimal (RESP) : AUTH, SELECT, GET, SET (avec PX), DEL, PING.
+    `password` : AUTH exigé avant toute autre commande. Une base de clés par numéro (SELECT).
+    """
+
+    def __init__(self, password: str = None):
+        self.password = password
+        self.connections = 0
+        self.databases = defaultdict(dict)  # n° de base -> clé -> (valeur, expiration ou None)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, data: bytes):
+                self.wfile.write(data)
+
+            def read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                args = []
+                for _ in range(int(line[1:-2])):
+                    length = int(self.rfile.readline()[1:-2])
+                    args.append(self.rfile.read(length + 2)[:-2])
+                return args
+
+            def handle(self):
+                with stub._lock:
+                    stub.connections += 1
+                authenticated, db = stub.password is None, 0
+                while True:
+                    args = self.read_command()
+                    if args is None:
+                        return
+                    name = args[0].decode().upper()
+                    if name == "AUTH":
+                        authenticated = args[1].decode() == stub.password
+                        self.reply(b"+OK\r\n" if authenticated else b"-WRONGPASS invalid password\r\n")
+                        continue
+                    if not authenticated:
+                        self.reply(b"-NOAUTH Authentication required.\r\n")
+                        continue
+                    with stub._lock:
+                        keys = stub.databases[db]
+                        if name == "SELECT":
+                            db = int(args[1])
+                            self.reply(b"+OK\r\n")
+                        elif name == "SET":
+                            expires = None
+                            if len(args) >= 5 and args[3].upper() == b"PX":
+                                expires = time.monotonic() + int(args[4]) / 1000
+                            keys[args[1]] = (args[2], expires)
+                            self.reply(b"+OK\r\n")
+                        elif name == "GET":
+                            value, expires = keys.get(args[1], (None, None))
+                            if value is None or (expires is not None and expires < time.monotonic()):
+                                self.reply(b"$-1\r\n")
+                            else:
+                                self.reply(b"$%d\r\n%s\r\n" % (len(value), value))
+                        elif name == "DEL":
+                            self.reply(b":%d\r\n" % int(keys.pop(args[1], None) is not None))
+                        elif name == "PING":
+                            self.reply(b"+PONG\r\n")
+                        else:
+                            self.reply(b"-ERR unknown command\r\n")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
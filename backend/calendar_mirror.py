@@ -0,0 +1,267 @@
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from dateutil.parser import isoparse
+from googleapiclient.errors import HttpError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Intervalle entre deux synchronisations incrémentales (secondes)
+SYNC_INTERVAL = int(os.getenv("CALENDAR_MIRROR_SYNC_INTERVAL", "60"))
+MIRROR_DB_PATH = os.getenv("CALENDAR_MIRROR_DB", os.path.join(os.path.dirname(__file__), ".calendar_mirror.db"))
+# Après un échec de synchronisation, pas de nouvel essai avant ce délai (doublé à chaque échec, borné)
+SYNC_RETRY_BASE = float(os.getenv("CALENDAR_MIRROR_RETRY_BASE", "5"))
+SYNC_RETRY_MAX = float(os.getenv("CALENDAR_MIRROR_RETRY_MAX", "300"))
+# La synchronisation complète ne remonte pas au-delà de cette marge dans le passé (heures)
+FULL_SYNC_PAST_HOURS = float(os.getenv("CALENDAR_MIRROR_PAST_HOURS", "24"))
+
+
+def _event_bounds(event: dict):
+    """Retourne (début, fin) en timestamps UTC, ou None si l'événement n'a pas d'horaires."""
+    start, end = event.get("start") or {}, event.get("end") or {}
+    if "dateTime" in start and "dateTime" in end:
+        return isoparse(start["dateTime"]).timestamp(), isoparse(end["dateTime"]).timestamp()
+    if "date" in start and "date" in end:
+        # Événement sur la journée entière : minuit UTC (fuseau de Dakar)
+        to_ts = lambda d: datetime.fromisoformat(d).replace(tzinfo=timezone.utc).timestamp()
+        return to_ts(start["date"]), to_ts(end["date"])
+    return None
+
+
+class IntervalIndex:
+    """
+    Index en mémoire des créneaux occupés, trié par début.
+    Une requête de chevauchement coûte O(log n + k) grâce à la durée maximale connue.
+    """
+
+    def __init__(self):
+        self._starts = []   # Débuts triés
+        self._entries = []  # (début, fin, id) dans le même ordre
+        self._by_id = {}
+        self._max_duration = 0.0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, event_id: str, start: float, end: float):
+        self.remove(event_id)
+        i = bisect.bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._entries.insert(i, (start, end, event_id))
+        self._by_id[event_id] = (start, end)
+        self._max_duration = max(self._max_duration, end - start)
+
+    def remove(self, event_id: str):
+        bounds = self._by_id.pop(event_id, None)
+        if bounds is None:
+            return
+        i = bisect.bisect_left(self._starts, bounds[0])
+        while self._entries[i][2] != event_id:
+            i += 1
+        del self._starts[i]
+        del self._entries[i]
+
+    def overlaps(self, start: float, end: float) -> bool:
+        """True si un événement chevauche l'intervalle [start, end[."""
+        lo = bisect.bisect_left(self._starts, start - self._max_duration)
+        hi = bisect.bisect_left(self._starts, end)
+        for i in range(lo, hi):
+            if self._entries[i][1] > start:
+                return True
+        return False
+
+
+class CalendarMirror:
+    """
+    Miroir local (SQLite + index en mémoire) d'un agenda Google Calendar.
+
+    Le miroir est tenu à jour par synchronisations incrémentales (syncToken) et
+    par écriture directe des événements créés par l'application. La synchronisation
+    complète part de maintenant moins FULL_SYNC_PAST_HOURS. Après un échec, la
+    synchronisation n'est retentée qu'après un backoff exponentiel ; d'ici là, un miroir
+    jamais synchronisé lève une erreur (l'appelant interroge l'agenda directement).
+    `service_factory` est un callable retournant un service Calendar (ou un faux service en test).
+    """
+
+    def __init__(self, service_factory, calendar_id: str, db_path: str = MIRROR_DB_PATH,
+                 sync_interval: int = SYNC_INTERVAL, execute=None):
+        self.service_factory = service_factory
+        self.calendar_id = calendar_id
+        self.sync_interval = sync_interval
+        self._execute = execute or (lambda operation, request: request.execute())
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._index = IntervalIndex()
+        self._index_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._sync_token = None
+        self._last_sync = 0.0
+        self._failures = 0
+        self._retry_at = 0.0  # Pas de synchronisation avant cette échéance (après un échec)
+        self._background_sync = None
+        self._init_db()
+        self._load()
+
+    # --- Stockage SQLite ---
+    def _init_db(self):
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "calendar_id TEXT, id TEXT, start_ts REAL, end_ts REAL, body TEXT, "
+                "PRIMARY KEY (calendar_id, id))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sync_state ("
+                "calendar_id TEXT PRIMARY KEY, sync_token TEXT, synced_at REAL)"
+            )
+
+    def _load(self):
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, start_ts, end_ts FROM events WHERE calendar_id = ?", (self.calendar_id,)
+            ).fetchall()
+            state = self._db.execute(
+                "SELECT sync_token, synced_at FROM sync_state WHERE calendar_id = ?", (self.calendar_id,)
+            ).fetchone()
+        with self._index_lock:
+            for event_id, start, end in rows:
+                self._index.add(event_id, start, end)
+        if state:
+            # Le jeton est repris tel quel ; la prochaine synchro sera incrémentale.
+            self._sync_token = state[0]
+        logger.info(f"[CALENDAR_MIRROR] {len(rows)} événements chargés depuis le miroir local.")
+
+    def _apply(self, events: list, full: bool):
+        """Applique une page d'événements (ajouts, modifications, annulations)."""
+        upserts, deletes = [], []
+        for event in events:
+            event_id = event.get("id")
+            if not event_id:
+                continue
+            bounds = None if event.get("status") == "cancelled" else _event_bounds(event)
+            if bounds is None:
+                deletes.append(event_id)
+            else:
+                upserts.append((event_id, bounds[0], bounds[1], event))
+        with self._db_lock, self._db:
+            if full:
+                self._db.execute("DELETE FROM events WHERE calendar_id = ?", (self.calendar_id,))
+            self._db.executemany(
+                "DELETE FROM events WHERE calendar_id = ? AND id = ?",
+                [(self.calendar_id, event_id) for event_id in deletes],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO events (calendar_id, id, start_ts, end_ts, body) VALUES (?, ?, ?, ?, ?)",
+                [(self.calendar_id, eid, start, end, json.dumps(body)) for eid, start, end, body in upserts],
+            )
+        with self._index_lock:
+            if full:
+                self._index = IntervalIndex()
+            for event_id in deletes:
+                self._index.remove(event_id)
+            for event_id, start, end, _ in upserts:
+                self._index.add(event_id, start, end)
+
+    def _save_sync_token(self, token: str):
+        with self._db_lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_state (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)",
+                (self.calendar_id, token, time.time()),
+            )
+
+    # --- Synchronisation ---
+    def sync(self):
+        """Synchronisation incrémentale (ou complète si aucun jeton valide)."""
+        with self._sync_lock, metrics.timed("calendar_mirror_sync_seconds"):
+            full = self._sync_token is None
+            try:
+                try:
+                    self._sync_pages(full)
+                except HttpError as e:
+                    if e.resp.status != 410:
+                        raise
+                    # Jeton expiré : on repart d'une synchronisation complète.
+                    logger.warning("[CALENDAR_MIRROR] syncToken expiré (410), synchronisation complète.")
+                    self._sync_token = None
+                    full = True
+                    self._sync_pages(full)
+            except Exception:
+                self._failures += 1
+                self._retry_at = time.monotonic() + min(SYNC_RETRY_MAX, SYNC_RETRY_BASE * 2 ** (self._failures - 1))
+                metrics.counter("calendar_mirror_sync_failures_total").inc()
+                raise
+            self._failures = 0
+            self._last_sync = time.monotonic()
+            logger.info(f"[CALENDAR_MIRROR] Synchronisation {'complète' if full else 'incrémentale'} terminée "
+                        f"({len(self._index)} événements).")
+
+    def _sync_pages(self, full: bool):
+        service = self.service_factory()
+        if service is None:
+            raise RuntimeError("Service Calendar indisponible")
+        page_token, first_page = None, True
+        while True:
+            params = {"calendarId": self.calendar_id, "singleEvents": True, "showDeleted": True}
+            if page_token:
+                params["pageToken"] = page_token
+            if full:
+                # Sans borne, les événements récurrents sont développés sur tout leur historique
+                params["timeMin"] = (datetime.now(timezone.utc) - timedelta(hours=FULL_SYNC_PAST_HOURS)).isoformat()
+            else:
+                params["syncToken"] = self._sync_token
+            response = self._execute("events.list", service.events().list(**params))
+            self._apply(response.get("items", []), full=full and first_page)
+            first_page = False
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        self._sync_token = response.get("nextSyncToken")
+        if self._sync_token:
+            self._save_sync_token(self._sync_token)
+
+    def _ensure_fresh(self):
+        """
+        Synchronise en ligne au premier appel, puis en arrière-plan lorsque le miroir vieillit.
+        Pendant le backoff qui suit un échec, aucune synchronisation n'est tentée.
+        """
+        if self._last_sync == 0.0:
+            if time.monotonic() < self._retry_at:
+                raise RuntimeError("Miroir jamais synchronisé (dernière tentative en échec)")
+            self.sync()
+            return
+        if time.monotonic() - self._last_sync < self.sync_interval or time.monotonic() < self._retry_at:
+            return
+        if self._background_sync is not None and self._background_sync.is_alive():
+            return
+        self._background_sync = threading.Thread(target=self._safe_sync, name="calendar-mirror-sync", daemon=True)
+        self._background_sync.start()
+
+    def _safe_sync(self):
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"[CALENDAR_MIRROR] Échec de la synchronisation en arrière-plan : {e}")
+
+    # --- API publique ---
+    def check_availability(self, start_dt: datetime, end_dt: datetime) -> bool:
+        """True si aucun événement du miroir ne chevauche le créneau."""
+        self._ensure_fresh()
+        t0 = time.perf_counter()
+        with self._index_lock:
+            busy = self._index.overlaps(start_dt.timestamp(), end_dt.timestamp())
+        metrics.histogram("calendar_mirror_lookup_seconds").observe(time.perf_counter() - t0)
+        return not busy
+
+    def record_event(self, event: dict):
+        """Écriture directe d'un événement créé par l'application."""
+        if event and event.get("id"):
+            self._apply([event], full=False)
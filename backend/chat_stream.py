@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CHAT_STREAM_WORKERS = int(os.getenv("CHAT_STREAM_WORKERS", "16"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_tasks = set()  # Tâches asyncio en cours (référence gardée jusqu'à leur fin)
+
+
+class SentinelHoldback:
+    """
+    Filtre le texte diffusé pour qu'un marqueur réservé au serveur (ex. [CONFIRM_APPOINTMENT])
+    ne soit jamais affiché : la fin du texte qui pourrait être le début du marqueur est
+    retenue jusqu'à ce qu'elle soit levée, et plus rien n'est émis une fois le marqueur vu.
+    """
+
+    def __init__(self, sentinel: str):
+        self.sentinel = sentinel
+        self.matched = False
+        self._held = ""
+
+    def feed(self, text: str) -> str:
+        if self.matched:
+            return ""
+        self._held += text
+        if self.sentinel in self._held:
+            self.matched = True
+            self._held = ""
+            return ""
+        # Plus long suffixe pouvant encore devenir le marqueur
+        keep = 0
+        for size in range(min(len(self._held), len(self.sentinel) - 1), 0, -1):
+            if self.sentinel.startswith(self._held[-size:]):
+                keep = size
+                break
+        emitted, self._held = self._held[:len(self._held) - keep], self._held[len(self._held) - keep:]
+        return emitted
+
+    def flush(self) -> str:
+        emitted, self._held = ("" if self.matched else self._held), ""
+        return emitted
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Callback LangChain qui transmet chaque token généré par le LLM à une file."""
+
+    def __init__(self, tokens: queue.Queue):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.tokens.put(("token", token))
+
+
+class AsyncTokenQueueHandler(AsyncCallbackHandler):
+    """Variante asyncio de TokenQueueHandler (file asyncio.Queue)."""
+
+    def __init__(self, tokens: asyncio.Queue):
+        self.tokens = tokens
+
+    async def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            self.tokens.put_nowait(("token", token))
+
+
+class _ReplyEvents:
+    """Convertit les éléments de la file (token, done, error) en événements diffusés, avec les métriques."""
+
+    def __init__(self, sentinel: str):
+        self.holdback = SentinelHoldback(sentinel)
+        self.t0 = time.perf_counter()
+        self.ttft = None
+
+    def process(self, kind: str, value) -> list:
+        if kind == "token":
+            text = self.holdback.feed(value)
+            if not text:
+                return []
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self.t0
+                metrics.histogram("chat_ttft_seconds").observe(self.ttft)
+            return [("token", text)]
+        if kind == "error":
+            metrics.counter("chat_stream_errors_total").inc()
+            return [("error", value)]
+        rest = self.holdback.flush()
+        metrics.histogram("chat_stream_seconds").observe(time.perf_counter() - self.t0)
+        return ([("token", rest)] if rest else []) + [("done", {"output": value, "ttft": self.ttft})]
+
+
+def stream_reply(run, sentinel: str):
+    """
+    Exécute `run(callbacks)` (tour de l'agent, retourne son résultat) dans un worker et
+    génère les événements ("token", texte) au fil de la génération, puis
+    ("done", {"output": résultat, "ttft": secondes}) ou ("error", exception).
+    Le worker va jusqu'au bout même si le générateur est abandonné (client déconnecté).
+    Le temps jusqu'au premier token affiché est mesuré (chat_ttft_seconds).
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=CHAT_STREAM_WORKERS, thread_name_prefix="chat-stream")
+
+    tokens = queue.Queue()
+    events = _ReplyEvents(sentinel)
+
+    def job():
+        try:
+            tokens.put(("done", run([TokenQueueHandler(tokens)])))
+        except Exception as e:
+            tokens.put(("error", e))
+
+    _executor.submit(contextvars.copy_context().run, job)  # Garde la trace de la requête
+    while True:
+        kind, value = tokens.get()
+        yield from events.process(kind, value)
+        if kind != "token":
+            return
+
+
+async def astream_reply(arun, sentinel: str):
+    """
+    Variante asyncio de stream_reply : `arun(callbacks)` est une coroutine, exécutée dans une
+    tâche de la boucle d'événements (aucun thread n'est occupé pendant l'appel au modèle).
+    """
+    tokens = asyncio.Queue()
+    events = _ReplyEvents(sentinel)
+
+    async def job():
+        try:
+            tokens.put_nowait(("done", await arun([AsyncTokenQueueHandler(tokens)])))
+        except Exception as e:
+            tokens.put_nowait(("error", e))
+
+    # La tâche va jusqu'au bout même si le client se déconnecte (la session est sauvegardée)
+    task = asyncio.ensure_future(job())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    while True:
+        kind, value = await tokens.get()
+        for event in events.process(kind, value):
+            yield event
+        if kind != "token":
+            return
@@ -0,0 +1,128 @@
+import os
+from typing import List
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, messages_from_dict, messages_to_dict
+from pydantic import Field
+
+from slot_extraction import SLOT_KEYS, extract_user_data_from_messages
+
+# --- Configuration ---
+# MEMORY_MODE : "budget" (fenêtre glissante + résumé) ou "buffer" (transcription complète)
+MEMORY_MODE = os.getenv("MEMORY_MODE", "budget").lower()
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "8"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+# Nombre de messages du patient conservés (tronqués) dans le résumé
+MEMORY_SUMMARY_NOTES = int(os.getenv("MEMORY_SUMMARY_NOTES", "4"))
+
+SLOT_LABELS = {
+    "name": "nom",
+    "email": "email",
+    "phone": "téléphone",
+    "service_type": "type de soin",
+    "proposed_date": "date souhaitée",
+    "proposed_time": "heure souhaitée",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation rapide du nombre de tokens (~4 caractères par token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def count_message_tokens(messages: List[BaseMessage]) -> int:
+    # +4 tokens par message pour le rôle et les séparateurs
+    return sum(estimate_tokens(str(m.content)) + 4 for m in messages)
+
+
+class TokenBudgetMemory(ConversationBufferMemory):
+    """
+    Mémoire conversationnelle à budget de tokens.
+
+    Les derniers échanges sont conservés mot pour mot (au plus `max_turns`, dans la
+    limite de `max_tokens`). Les échanges plus anciens sont repliés dans un résumé
+    compact contenant les informations du ticket déjà collectées (voir TicketData)
+    et les derniers messages du patient, tronqués.
+    """
+
+    max_turns: int = MEMORY_MAX_TURNS
+    max_tokens: int = MEMORY_TOKEN_BUDGET
+    slots: dict = Field(default_factory=dict)
+    notes: list = Field(default_factory=list)
+    folded_messages: int = 0
+
+    @property
+    def summary(self) -> str:
+        if not self.folded_messages:
+            return ""
+        lines = [f"Résumé des {self.folded_messages} messages précédents de la conversation :"]
+        collected = [f"{SLOT_LABELS[k]} = {self.slots[k]}" for k in SLOT_KEYS if self.slots.get(k)]
+        if collected:
+            lines.append("- Informations déjà collectées : " + " ; ".join(collected))
+        if self.notes:
+            lines.append("- Derniers messages du patient : " + " ; ".join(f"« {n} »" for n in self.notes))
+        return "\n".join(lines)
+
+    @property
+    def buffer_as_messages(self) -> List[BaseMessage]:
+        summary = self.summary
+        messages = self.chat_memory.messages
+        return [SystemMessage(content=summary)] + messages if summary else messages
+
+    def save_context(self, inputs, outputs) -> None:
+        super().save_context(inputs, outputs)
+        self.prune()
+
+    def prune(self):
+        """Replie les échanges les plus anciens tant que la fenêtre dépasse le budget."""
+        messages = list(self.chat_memory.messages)
+        folded = []
+        while len(messages) > 2:
+            turns = sum(1 for m in messages if isinstance(m, HumanMessage))
+            tokens = count_message_tokens(messages) + estimate_tokens(self.summary)
+            if turns <= self.max_turns and tokens <= self.max_tokens:
+                break
+            # Un échange = un message humain et les réponses qui le suivent
+            folded.append(messages.pop(0))
+            while messages and not isinstance(messages[0], HumanMessage):
+                folded.append(messages.pop(0))
+        if folded:
+            self._fold(folded)
+            self.chat_memory.messages = messages
+
+    def _fold(self, folded: List[BaseMessage]):
+        # Champs tirés des seuls messages du patient (comme SlotTracker)
+        patient_messages = [message for message in folded if isinstance(message, HumanMessage)]
+        for key, value in extract_user_data_from_messages(patient_messages).items():
+            if value:
+                self.slots[key] = value
+        for message in folded:
+            if isinstance(message, HumanMessage) and message.content != "start":
+                self.notes.append(str(message.content)[:80])
+        self.notes = self.notes[-MEMORY_SUMMARY_NOTES:]
+        self.folded_messages += len(folded)
+
+
+def new_memory():
+    """Crée la mémoire d'une nouvelle conversation selon MEMORY_MODE."""
+    if MEMORY_MODE == "buffer":
+        return ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+    return TokenBudgetMemory(memory_key="chat_history", return_messages=True)
+
+
+def memory_to_state(memory) -> dict:
+    state = {"messages": messages_to_dict(memory.chat_memory.messages)}
+    if isinstance(memory, TokenBudgetMemory):
+        state["summary"] = {"slots": memory.slots, "notes": memory.notes, "folded_messages": memory.folded_messages}
+    return state
+
+
+def memory_from_state(state: dict):
+    memory = new_memory()
+    memory.chat_memory.messages = messages_from_dict(state.get("messages", []))
+    summary = state.get("summary")
+    if summary and isinstance(memory, TokenBudgetMemory):
+        memory.slots = summary.get("slots", {})
+        memory.notes = summary.get("notes", [])
+        memory.folded_messages = summary.get("folded_messages", 0)
+    return memory
@@ -0,0 +1,277 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import smtplib
+import sqlite3
+import threading
+import time
+
+import metrics
+import tracing
+from jobs import owner_alive, process_owner
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
+# Au-delà de cette inactivité (secondes), la connexion est vérifiée (NOOP) avant réutilisation
+SMTP_IDLE_CHECK = float(os.getenv("SMTP_IDLE_CHECK", "30"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+EMAIL_BACKOFF_BASE = float(os.getenv("EMAIL_BACKOFF_BASE", "2"))
+EMAIL_BACKOFF_MAX = float(os.getenv("EMAIL_BACKOFF_MAX", "300"))
+EMAIL_OUTBOX_PATH = os.getenv("EMAIL_OUTBOX_PATH", os.path.join(os.path.dirname(__file__), ".email_outbox.db"))
+# Durée de conservation (secondes) de l'état des e-mails envoyés ou abandonnés
+EMAIL_STATUS_RETENTION = float(os.getenv("EMAIL_STATUS_RETENTION", str(7 * 24 * 3600)))
+
+EMAIL_FINAL_STATES = ("sent", "failed")
+
+
+class EmailDispatcher:
+    """
+    File d'envoi des e-mails sur une connexion SMTP authentifiée et réutilisée.
+
+    Chaque message est d'abord inscrit dans une boîte d'envoi SQLite locale (un message par
+    ticket), puis un thread unique l'envoie avec les autres messages en attente sur la même
+    connexion. Une connexion inactive est vérifiée avant réutilisation et rouverte si elle a été
+    coupée. Les échecs sont réessayés avec un backoff exponentiel. Au démarrage, les messages
+    non envoyés d'un processus arrêté sont repris. L'état de livraison de chaque ticket
+    (queued/retrying/sent/failed) reste en base EMAIL_STATUS_RETENTION secondes et est
+    consultable via `delivery_status`.
+    """
+
+    def __init__(self, username: str, password: str, host: str = SMTP_HOST, port: int = SMTP_PORT,
+                 starttls: bool = SMTP_STARTTLS, batch_size: int = EMAIL_BATCH_SIZE,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, db_path: str = EMAIL_OUTBOX_PATH):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.db_path = db_path
+        self._queue = queue.Queue()
+        self._retries = []  # tas de (échéance, n°, message)
+        self._counter = itertools.count()
+        self._local = threading.local()
+        self._smtp = None
+        self._last_used = 0.0
+        self._thread = None
+        self._start_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS email_outbox ("
+                "ticket_id TEXT PRIMARY KEY, from_addr TEXT NOT NULL, recipients TEXT NOT NULL, message TEXT, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, owner TEXT, trace_id TEXT, "
+                "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS email_outbox_status ON email_outbox (status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- API publique ---
+    def enqueue(self, ticket_id: str, from_addr: str, recipients: list, message: str) -> bool:
+        """
+        Inscrit le message dans la boîte d'envoi et le met en file ; retourne immédiatement.
+        Un seul message par ticket : retourne False (rien n'est envoyé) si ce ticket a déjà le sien,
+        par exemple quand une tâche de rendez-vous interrompue est reprise.
+        """
+        self.start()  # Reprise de la boîte d'envoi avant cette inscription
+        now = time.time()
+        trace_id = tracing.current_trace_id()
+        conn = self._conn()
+        with conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO email_outbox (ticket_id, from_addr, recipients, message, status, owner, trace_id, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (ticket_id, from_addr, json.dumps(recipients), message, process_owner(), trace_id, now, now),
+            ).rowcount
+        if not inserted:
+            metrics.counter("email_duplicates_total").inc()
+            logger.info(f"[EMAIL-SMTP] E-mail déjà en file ou envoyé pour le ticket {ticket_id} ; ignoré.")
+            return False
+        self._queue.put({"ticket_id": ticket_id, "from": from_addr, "to": recipients, "message": message, "attempts": 0,
+                         "trace_id": trace_id})
+        metrics.counter("email_queued_total").inc()
+        return True
+
+    def delivery_status(self, ticket_id: str) -> dict:
+        """État de livraison de l'e-mail du ticket : status (queued/retrying/sent/failed/unknown), attempts, error."""
+        row = self._conn().execute(
+            "SELECT status, attempts, error, updated_at FROM email_outbox WHERE ticket_id = ?", (ticket_id,)
+        ).fetchone()
+        if row is None:
+            return {"status": "unknown"}
+        return {"status": row[0], "attempts": row[1], "error": row[2], "updated_at": row[3]}
+
+    def pending(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM email_outbox WHERE status NOT IN ('sent', 'failed')").fetchone()[0]
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM email_outbox GROUP BY status").fetchall()
+        return {
+            "states": dict(rows),
+            "local_queue_depth": self._queue.qsize(),
+            "retrying": len(self._retries),
+            "metrics": metrics.snapshot("email"),
+        }
+
+    # --- Démarrage et reprise ---
+    def start(self):
+        """Démarre le thread d'envoi (une seule fois) et reprend les messages non envoyés."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._resume()
+                self._thread = threading.Thread(target=self._run, name="email-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _resume(self):
+        conn = self._conn()
+        me = process_owner()
+        with conn:
+            conn.execute("DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                         (time.time() - EMAIL_STATUS_RETENTION,))
+        resumed = 0
+        for ticket_id, from_addr, recipients, message, attempts, owner, trace_id in conn.execute(
+                "SELECT ticket_id, from_addr, recipients, message, attempts, owner, trace_id FROM email_outbox "
+                "WHERE status NOT IN ('sent', 'failed') ORDER BY created_at").fetchall():
+            # Message d'un autre worker vivant : il l'envoie lui-même
+            if owner and owner != me and owner_alive(owner):
+                continue
+            with conn:
+                claimed = conn.execute("UPDATE email_outbox SET owner = ? WHERE ticket_id = ? AND owner IS ?",
+                                       (me, ticket_id, owner)).rowcount
+            if claimed:
+                self._queue.put({"ticket_id": ticket_id, "from": from_addr, "to": json.loads(recipients),
+                                 "message": message, "attempts": attempts, "trace_id": trace_id})
+                resumed += 1
+        if resumed:
+            metrics.counter("email_replayed_total").inc(resumed)
+            logger.info(f"[EMAIL-SMTP] {resumed} e-mail(s) non envoyé(s) repris de la boîte d'envoi au démarrage.")
+
+    # --- Connexion SMTP ---
+    def _connect(self):
+        with metrics.timed("smtp_connect_seconds"):
+            server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+            server.ehlo()
+            if self.starttls:
+                server.starttls()  # Sécurise la connexion
+                server.ehlo()
+            if self.password and server.has_extn("auth"):
+                server.login(self.username, self.password)
+        self._smtp = server
+        logger.info(f"[EMAIL-SMTP] Connexion SMTP ouverte vers {self.host}:{self.port}")
+
+    def _disconnect(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+        self._smtp = None
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None and time.monotonic() - self._last_used > SMTP_IDLE_CHECK:
+            try:
+                if self._smtp.noop()[0] != 250:
+                    self._disconnect()
+            except (smtplib.SMTPException, OSError):
+                self._disconnect()
+        if self._smtp is None:
+            self._connect()
+        return self._smtp
+
+    # --- Envoi ---
+    def _next_batch(self) -> list:
+        """Attend au moins un message prêt puis complète le lot sans attendre."""
+        batch = []
+        while self._retries and self._retries[0][0] <= time.monotonic() and len(batch) < self.batch_size:
+            batch.append(heapq.heappop(self._retries)[2])
+        timeout = None
+        if not batch and self._retries:
+            timeout = max(0.0, self._retries[0][0] - time.monotonic())
+        if not batch:
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            for item in batch:
+                with tracing.trace(item.get("trace_id")), tracing.span("smtp:send"):
+                    self._send(item)
+
+    def _send(self, item: dict):
+        ticket_id = item["ticket_id"]
+        item["attempts"] += 1
+        t0 = time.perf_counter()
+        try:
+            self._connection().sendmail(item["from"], item["to"], item["message"])
+            self._last_used = time.monotonic()
+            metrics.histogram("smtp_send_seconds").observe(time.perf_counter() - t0)
+            metrics.counter("email_sent_total").inc()
+            self._set_status(ticket_id, "sent", attempts=item["attempts"])
+            logger.info(f"Email SMTP envoyé avec succès pour le ticket {ticket_id}")
+        except Exception as e:
+            self._disconnect()
+            if isinstance(e, smtplib.SMTPAuthenticationError):
+                logger.error("[EMAIL-SMTP] Échec de l'authentification. Vérifiez SENDER_EMAIL et SENDER_APP_PASSWORD.")
+            if item["attempts"] >= self.max_attempts:
+                metrics.counter("email_failed_total").inc()
+                self._set_status(ticket_id, "failed", attempts=item["attempts"], error=str(e))
+                logger.error(f"[EMAIL-SMTP] Abandon de l'envoi pour le ticket {ticket_id} après {item['attempts']} tentatives : {e}")
+                return
+            delay = min(EMAIL_BACKOFF_MAX, EMAIL_BACKOFF_BASE ** item["attempts"])
+            metrics.counter("email_retries_total").inc()
+            self._set_status(ticket_id, "retrying", attempts=item["attempts"], error=str(e))
+            logger.warning(f"[EMAIL-SMTP] Erreur lors de l'envoi pour le ticket {ticket_id}, nouvel essai dans {delay:.0f}s : {e}")
+            heapq.heappush(self._retries, (time.monotonic() + delay, next(self._counter), item))
+
+    def _set_status(self, ticket_id: str, status: str, attempts: int, error: str = None):
+        conn = self._conn()
+        with conn:
+            # Le contenu (données du patient) n'est plus conservé une fois l'envoi terminé
+            conn.execute(
+                "UPDATE email_outbox SET status = ?, attempts = ?, error = ?, updated_at = ?, "
+                "message = CASE WHEN ? THEN NULL ELSE message END WHERE ticket_id = ?",
+                (status, attempts, error, time.time(), status in EMAIL_FINAL_STATES, ticket_id),
+            )
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_email_dispatcher(username: str, password: str) -> EmailDispatcher:
+    """Retourne le répartiteur d'e-mails partagé par le processus."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EmailDispatcher(username, password)
+    return _dispatcher
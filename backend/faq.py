@@ -0,0 +1,173 @@
+import logging
+import math
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Optional
+
+import metrics
+from moderation import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Score minimal (part du message couverte par une question connue) pour répondre sans l'agent
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.6"))
+# Au-delà de ce nombre de mots, le message est laissé à l'agent (demande composée)
+FAQ_MAX_WORDS = int(os.getenv("FAQ_MAX_WORDS", "16"))
+# N-grammes communs minimum avec l'intention, sauf si le message contient un de ses mots-clés
+FAQ_MIN_MATCHES = int(os.getenv("FAQ_MIN_MATCHES", "2"))
+
+# --- Informations de la clinique (reprises dans le prompt système) ---
+CLINIC_ADDRESS = "Avenue Cheikh Anta Diop, Dakar"
+CLINIC_PHONE = "+221 77 510 02 06"
+CLINIC_HOURS = "Lundi à Vendredi (9h-13h / 15h-18h30), Samedi (9h-12h)"
+
+# Intention -> (formulations connues, réponse)
+FAQ_ENTRIES = {
+    "hours": (
+        [
+            "quels sont vos horaires", "horaires d'ouverture", "vous etes ouverts quand",
+            "a quelle heure ouvrez vous", "a quelle heure fermez vous", "quand est ce que vous ouvrez",
+            "etes vous ouverts le samedi", "vous ouvrez le samedi", "etes vous ouverts le dimanche",
+            "heures d'ouverture de la clinique", "la clinique ouvre a quelle heure",
+            "la clinique ferme a quelle heure", "jours d'ouverture",
+        ],
+        "La clinique est ouverte du lundi au vendredi de 9h à 13h et de 15h à 18h30, "
+        "et le samedi de 9h à 12h.",
+    ),
+    "address": (
+        [
+            "quelle est votre adresse", "ou se trouve la clinique", "ou etes vous situes",
+            "adresse de la clinique", "ou est la clinique", "comment venir a la clinique",
+            "vous etes ou", "c'est ou la clinique", "localisation de la clinique", "vous etes situes ou",
+        ],
+        f"La Clinique Dentaire St Dominique se trouve {CLINIC_ADDRESS}.",
+    ),
+    "phone": (
+        [
+            "quel est votre numero de telephone", "numero de la clinique", "comment vous appeler",
+            "je peux vous appeler", "votre telephone", "numero de telephone de la clinique",
+            "comment joindre la clinique", "contact telephonique", "quel numero appeler",
+        ],
+        f"Vous pouvez joindre la clinique au {CLINIC_PHONE}.",
+    ),
+}
+
+# Mots-clés suffisant seuls à poser la question (« horaires ? ») ; un autre mot isolé
+# (« samedi », « numero », « clinique ») est plutôt une réponse du patient
+FAQ_KEYWORDS = {
+    "hours": {"horaires", "horaire"},
+    "address": {"adresse"},
+    "phone": {"telephone"},
+}
+
+# Mots vides : ignorés à l'indexation et dans les messages
+STOPWORDS = {
+    "le", "la", "les", "l", "de", "du", "des", "d", "un", "une", "et", "a", "au", "aux", "en",
+    "est", "sont", "ce", "c", "ca", "je", "j", "vous", "votre", "vos", "nous", "on", "il", "s",
+    "quel", "quels", "quelle", "quelles", "qu", "que", "svp", "stp", "merci", "bonjour", "bonsoir",
+    "salut", "pour", "sur", "me", "m", "moi", "pouvez", "peux", "dire", "s'il", "plait", "donner",
+}
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list:
+    return [w for w in _WORD.findall(normalize_text(text)) if w not in STOPWORDS]
+
+
+def ngrams(words: list) -> set:
+    """Unigrammes et bigrammes des mots (hors mots vides)."""
+    grams = set(words)
+    grams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return grams
+
+
+class FaqIndex:
+    """
+    Index inversé n-gramme -> intentions, pondéré par IDF.
+
+    Le score d'une intention est la part (pondérée) des n-grammes du message qui
+    figurent dans ses formulations connues : un message qui ajoute une autre demande
+    (ex. prendre rendez-vous) obtient un score faible et est laissé à l'agent. Un message
+    n'est rattaché à une intention que s'il partage avec elle au moins FAQ_MIN_MATCHES
+    n-grammes ou contient un de ses mots-clés, et si aucune autre intention n'est à égalité.
+    """
+
+    def __init__(self, entries: dict = FAQ_ENTRIES, threshold: float = FAQ_THRESHOLD, keywords: dict = FAQ_KEYWORDS):
+        self.threshold = threshold
+        self.answers = {intent: answer for intent, (_, answer) in entries.items()}
+        self.keywords = {intent: set(keywords.get(intent, ())) for intent in entries}
+        grams_by_intent = {intent: set().union(*(ngrams(tokenize(q)) for q in questions))
+                           for intent, (questions, _) in entries.items()}
+        document_frequency = defaultdict(int)
+        for grams in grams_by_intent.values():
+            for gram in grams:
+                document_frequency[gram] += 1
+        total = len(grams_by_intent)
+        self.weights = {gram: math.log(1 + total / df) for gram, df in document_frequency.items()}
+        # Poids d'un n-gramme inconnu : celui d'un n-gramme propre à une seule intention
+        self.unknown_weight = math.log(1 + total)
+        self.index = defaultdict(set)
+        for intent, grams in grams_by_intent.items():
+            for gram in grams:
+                self.index[gram].add(intent)
+
+    def score(self, text: str) -> tuple:
+        """
+        Retourne (intention, score) de la meilleure correspondance, ou (None, 0.0) : aucune
+        correspondance, intentions à égalité, ou un seul mot commun qui n'est pas un mot-clé.
+        """
+        words = tokenize(text)
+        if not words or len(words) > FAQ_MAX_WORDS:
+            return None, 0.0
+        grams = ngrams(words)
+        total = sum(self.weights.get(g, self.unknown_weight) for g in grams)
+        scores = defaultdict(float)
+        matches = defaultdict(int)
+        for gram in grams:
+            for intent in self.index.get(gram, ()):
+                scores[intent] += self.weights[gram]
+                matches[intent] += 1
+        if not scores:
+            return None, 0.0
+        intent, *others = sorted(scores, key=scores.get, reverse=True)
+        if others and math.isclose(scores[others[0]], scores[intent]):
+            return None, 0.0  # Ex. « clinique » : présent dans toutes les intentions
+        if matches[intent] < FAQ_MIN_MATCHES and not self.keywords[intent] & set(words):
+            return None, 0.0
+        return intent, scores[intent] / total
+
+    def answer(self, text: str) -> Optional[str]:
+        """Réponse directe si le message est une question fréquente (score >= seuil), sinon None."""
+        t0 = time.perf_counter()
+        intent, score = self.score(text)
+        metrics.histogram("faq_lookup_seconds").observe(time.perf_counter() - t0)
+        if intent is None or score < self.threshold:
+            metrics.counter("faq_lookups_total", result="miss").inc()
+            return None
+        metrics.counter("faq_lookups_total", result="hit").inc()
+        metrics.counter("faq_hits_total", intent=intent).inc()
+        logger.info(f"[FAQ] Réponse directe ({intent}, score {score:.2f}) : '{text}'")
+        return self.answers[intent]
+
+
+_index = FaqIndex()
+
+
+def answer(text: str) -> Optional[str]:
+    return _index.answer(text)
+
+
+def stats() -> dict:
+    hits = metrics.counter("faq_lookups_total", result="hit").value
+    misses = metrics.counter("faq_lookups_total", result="miss").value
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "by_intent": {intent: metrics.counter("faq_hits_total", intent=intent).value for intent in _index.answers},
+        "lookup_seconds": metrics.histogram("faq_lookup_seconds").snapshot(),
+    }
@@ -0,0 +1,124 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Marge avant expiration à partir de laquelle le token est renouvelé (secondes)
+TOKEN_REFRESH_MARGIN = int(os.getenv("CALENDAR_TOKEN_REFRESH_MARGIN", "300"))
+# Timeout des transports HTTP (secondes)
+HTTP_TIMEOUT = int(os.getenv("CALENDAR_HTTP_TIMEOUT", "15"))
+
+
+class CalendarServicePool:
+    """
+    Couche de service Google Calendar de longue durée.
+
+    - Les credentials du compte de service sont chargés une seule fois et le token
+      n'est renouvelé qu'à l'approche de son expiration.
+    - Le document de découverte est lu une seule fois depuis la copie statique
+      fournie avec google-api-python-client (pas d'appel réseau de découverte).
+    - httplib2 n'étant pas thread-safe, chaque thread possède son propre transport
+      et son propre objet service.
+    """
+
+    def __init__(self, service_account_file: str, scopes: list, refresh_margin: int = TOKEN_REFRESH_MARGIN,
+                 http_timeout: int = HTTP_TIMEOUT):
+        self.service_account_file = service_account_file
+        self.scopes = scopes
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.http_timeout = http_timeout
+        self._credentials = None
+        self._discovery_doc = None
+        self._setup_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._local = threading.local()
+
+    # --- Initialisation (une fois par processus) ---
+    def _ensure_setup(self):
+        if self._credentials is not None:
+            return
+        with self._setup_lock:
+            if self._credentials is not None:
+                return
+            # Imports lourds (client Google, découverte) différés à la première utilisation
+            from google.oauth2.service_account import Credentials
+            from googleapiclient.discovery_cache import get_static_doc
+            with metrics.timed("calendar_setup_seconds", phase="credentials"):
+                credentials = Credentials.from_service_account_file(self.service_account_file, scopes=self.scopes)
+            with metrics.timed("calendar_setup_seconds", phase="discovery"):
+                doc = get_static_doc("calendar", "v3")
+                self._discovery_doc = json.loads(doc) if doc else None
+            if self._discovery_doc is None:
+                logger.warning("[CALENDAR_POOL] Document de découverte statique introuvable, repli sur build().")
+            self._credentials = credentials
+            logger.info("[CALENDAR_POOL] Credentials et document de découverte chargés.")
+
+    def _ensure_fresh_token(self):
+        """Renouvelle le token partagé uniquement s'il expire bientôt."""
+        credentials = self._credentials
+        expiry = credentials.expiry
+        if credentials.token and expiry and expiry - self.refresh_margin > datetime.now(timezone.utc).replace(tzinfo=None):
+            return
+        with self._refresh_lock:
+            expiry = credentials.expiry
+            if credentials.token and expiry and expiry - self.refresh_margin > datetime.now(timezone.utc).replace(tzinfo=None):
+                return
+            import google_auth_httplib2
+            import httplib2
+            with metrics.timed("calendar_setup_seconds", phase="token_refresh"):
+                credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=self.http_timeout)))
+            logger.info(f"[CALENDAR_POOL] Token renouvelé, expiration : {credentials.expiry}")
+
+    # --- Accès au service (un par thread) ---
+    def get_service(self):
+        """Retourne le service Calendar du thread courant, avec un token valide."""
+        self._ensure_setup()
+        self._ensure_fresh_token()
+        service = getattr(self._local, "service", None)
+        if service is None:
+            import google_auth_httplib2
+            import httplib2
+            from googleapiclient.discovery import build, build_from_document
+            with metrics.timed("calendar_setup_seconds", phase="thread_service"):
+                http = google_auth_httplib2.AuthorizedHttp(self._credentials, http=httplib2.Http(timeout=self.http_timeout))
+                if self._discovery_doc is not None:
+                    service = build_from_document(self._discovery_doc, http=http)
+                else:
+                    service = build('calendar', 'v3', http=http, cache_discovery=False)
+            self._local.service = service
+            logger.info(f"[CALENDAR_POOL] Service créé pour le thread {threading.current_thread().name}")
+        return service
+
+    def execute(self, operation: str, request):
+        """Exécute une requête Calendar en mesurant sa latence."""
+        t0 = time.perf_counter()
+        try:
+            with tracing.span(f"calendar:{operation}"):
+                return request.execute()
+        finally:
+            metrics.histogram("calendar_call_seconds", operation=operation).observe(time.perf_counter() - t0)
+
+    def stats(self) -> dict:
+        """Latences d'initialisation et d'appels de la couche Calendar."""
+        return metrics.snapshot("calendar_")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_calendar_pool(service_account_file: str, scopes: list) -> CalendarServicePool:
+    """Retourne la couche de service Calendar partagée par le processus."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CalendarServicePool(service_account_file, scopes)
+    return _pool
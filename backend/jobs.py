@@ -0,0 +1,315 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Optional
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(os.path.dirname(__file__), ".jobs.db"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Intervalle de relecture de la base pendant une attente (tâche exécutée par un autre processus)
+JOB_WAIT_POLL = float(os.getenv("JOB_WAIT_POLL", "0.5"))
+
+JOB_STATES = ("queued", "running", "done", "failed")
+FINAL_STATES = ("done", "failed")
+
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def current_job_id() -> Optional[str]:
+    """Identifiant de la tâche en cours d'exécution dans ce worker (None hors d'une tâche)."""
+    return _current_job.get()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+_BOOT_ID = _read_boot_id()
+
+
+def _process_start_time(pid: int) -> str:
+    """Démarrage du processus en tics depuis le boot (Linux) ; vide si /proc est indisponible."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return ""
+
+
+def process_owner(pid: int = None) -> str:
+    """
+    Identifiant du processus `pid` (le processus courant par défaut) : pid, démarrage de la machine
+    et démarrage du processus. Contrairement au pid seul, il ne désigne pas un autre processus
+    après un redémarrage (conteneur qui reprend le même pid, machine redémarrée).
+    """
+    pid = pid or os.getpid()
+    return f"{pid}:{_BOOT_ID}:{_process_start_time(pid)}"
+
+
+def owner_alive(owner: str) -> bool:
+    """True si le processus identifié par `owner` (voir process_owner) existe encore."""
+    try:
+        pid = int(owner.split(":", 1)[0])
+    except ValueError:
+        return False
+    return _pid_alive(pid) and process_owner(pid) == owner
+
+
+class JobQueue:
+    """
+    Exécution des tâches de fond sur un pool fixe de workers.
+
+    Chaque tâche est d'abord enregistrée dans SQLite (état queued/running/done/failed),
+    puis traitée par un worker. Au démarrage, les tâches non terminées (en file, ou
+    en cours dans un processus qui n'existe plus) sont reprises.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = workers
+        self._handlers = {}
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._completions = deque(maxlen=10000)  # horodatages des fins de tâche (débit)
+        self._finished = threading.Condition()  # notifié à chaque fin de tâche (abonnés en attente)
+        self._async_waiters = set()  # (boucle, asyncio.Event) des abonnés asyncio (mode async_app)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, state TEXT NOT NULL, "
+                "result TEXT, error TEXT, owner TEXT, trace_id TEXT, "
+                "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- API publique ---
+    def register(self, kind: str, handler):
+        """
+        Associe un type de tâche à sa fonction : handler(payload: dict) -> résultat (sérialisable).
+        Une tâche interrompue est rejouée depuis le début : le handler doit être idempotent
+        (il peut s'appuyer sur current_job_id(), stable d'une exécution à l'autre).
+        """
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, payload: dict) -> str:
+        """Enregistre une tâche et retourne son identifiant."""
+        if kind not in self._handlers:
+            raise ValueError(f"Type de tâche inconnu : {kind}")
+        job_id = f"JOB-{uuid.uuid4().hex[:12].upper()}"
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, state, created_at, trace_id) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False), time.time(), tracing.current_trace_id()),
+            )
+        metrics.counter("jobs_submitted_total", kind=kind).inc()
+        self.start()
+        self._queue.put(job_id)
+        logger.info(f"[JOBS] Tâche {job_id} ({kind}) en file.")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self._conn().execute(
+            "SELECT id, kind, state, result, error, created_at, started_at, finished_at FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0], "kind": row[1], "state": row[2],
+            "result": json.loads(row[3]) if row[3] else None, "error": row[4],
+            "created_at": row[5], "started_at": row[6], "finished_at": row[7],
+        }
+
+    def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """
+        Attend la fin de la tâche (done/failed) au plus `timeout` secondes et retourne son état.
+        Réveil immédiat si la tâche s'exécute dans ce processus ; sinon la base est relue
+        toutes les JOB_WAIT_POLL secondes (tâche prise par un autre worker gunicorn).
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["state"] in FINAL_STATES or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, JOB_WAIT_POLL))
+
+    async def wait_async(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Variante asyncio de wait() : l'attente n'occupe aucun thread."""
+        deadline = time.monotonic() + timeout
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._finished:
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                waiter[1].clear()
+                job = self.get(job_id)
+                remaining = deadline - time.monotonic()
+                if job is None or job["state"] in FINAL_STATES or remaining <= 0:
+                    return job
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(remaining, JOB_WAIT_POLL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._finished:
+                self._async_waiters.discard(waiter)
+
+    # --- Démarrage et reprise ---
+    def start(self):
+        """Démarre les workers (une seule fois) et reprend les tâches non terminées."""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._resume()
+
+    def _resume(self):
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT id, state, owner FROM jobs WHERE state IN ('queued', 'running')").fetchall()
+        resumed = []
+        me = process_owner()
+        for job_id, state, owner in rows:
+            if state == "running":
+                if owner != me and owner_alive(owner):
+                    continue  # Tâche en cours dans un autre worker vivant
+                with conn:
+                    conn.execute("UPDATE jobs SET state = 'queued', owner = NULL WHERE id = ? AND state = 'running'",
+                                 (job_id,))
+            resumed.append(job_id)
+        for job_id in resumed:
+            self._queue.put(job_id)
+        if resumed:
+            logger.info(f"[JOBS] {len(resumed)} tâche(s) non terminée(s) reprise(s) au démarrage.")
+
+    # --- Workers ---
+    def _claim(self, job_id: str):
+        """Passe la tâche à l'état running si elle est encore en file ; retourne (kind, payload, created_at, trace_id)."""
+        conn = self._conn()
+        with conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET state = 'running', owner = ?, started_at = ? WHERE id = ? AND state = 'queued'",
+                (process_owner(), time.time(), job_id),
+            ).rowcount
+        if not claimed:
+            return None
+        return conn.execute("SELECT kind, payload, created_at, trace_id FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _finish(self, job_id: str, state: str, result=None, error: str = None):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (state, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), job_id),
+            )
+        with self._finished:
+            self._finished.notify_all()
+            for loop, event in self._async_waiters:
+                loop.call_soon_threadsafe(event.set)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            claimed = self._claim(job_id)
+            if claimed is None:
+                continue  # Déjà prise par un autre worker
+            kind, payload, created_at, trace_id = claimed
+            with tracing.trace(trace_id or job_id), tracing.span(f"job:{kind}"):
+                self._run(job_id, kind, payload, created_at)
+
+    def _run(self, job_id: str, kind: str, payload: str, created_at: float):
+        metrics.histogram("job_queue_latency_seconds", kind=kind).observe(max(0.0, time.time() - created_at))
+        t0 = time.perf_counter()
+        token = _current_job.set(job_id)
+        try:
+            result = self._handlers[kind](json.loads(payload))
+            self._finish(job_id, "done", result=result)
+            metrics.counter("jobs_completed_total", kind=kind, state="done").inc()
+            logger.info(f"[JOBS] Tâche {job_id} ({kind}) terminée.")
+        except Exception as e:
+            self._finish(job_id, "failed", error=str(e))
+            metrics.counter("jobs_completed_total", kind=kind, state="failed").inc()
+            logger.exception(f"[JOBS] Échec de la tâche {job_id} ({kind}) : {e}")
+        finally:
+            _current_job.reset(token)
+            metrics.histogram("job_run_seconds", kind=kind).observe(time.perf_counter() - t0)
+            self._completions.append(time.time())
+
+    # --- Observabilité ---
+    def pending(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def stats(self) -> dict:
+        rows = self._conn().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {state: 0 for state in JOB_STATES}
+        counts.update(dict(rows))
+        window = 60.0
+        recent = sum(1 for t in list(self._completions) if t > time.time() - window)
+        return {
+            "states": counts,
+            "workers": self.workers,
+            "local_queue_depth": self._queue.qsize(),
+            "throughput_per_second": round(recent / window, 3),
+            "queue_latency_seconds": metrics.snapshot("job_queue_latency_seconds"),
+            "run_seconds": metrics.snapshot("job_run_seconds"),
+        }
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Retourne la file de tâches partagée par le processus."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
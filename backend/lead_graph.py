@@ -1,29 +1,38 @@
-from typing import Optional
-from langchain_groq import ChatGroq
+from typing import TYPE_CHECKING, Optional
 from pydantic import BaseModel, Field
 import os
 import logging
-import langchain
 from datetime import datetime, timedelta, timezone
-from supabase import create_client, Client
+from supabase_client import get_supabase_pool
 from langchain_core.tools import tool
-from langchain.agents import AgentExecutor, create_tool_calling_agent
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage
-from langchain_community.cache import SQLiteCache
-from langchain.memory import ConversationBufferMemory
+from langchain_core.globals import set_llm_cache
+from llm_cache import HardenedSQLiteCache
 from dateutil.parser import parse as parse_datetime, parserinfo
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from google_calendar import get_calendar_pool
+from calendar_mirror import CalendarMirror
+import moderation
+import metrics
+from admission import Overloaded, llm_gate
+from resilient_llm import ResilientChatModel
+import tracing
+from faq import CLINIC_ADDRESS, CLINIC_PHONE, CLINIC_HOURS
 import traceback
-import smtplib
+from email_dispatcher import get_email_dispatcher
+from jobs import current_job_id, get_job_queue
+from ticket_writer import get_ticket_writer
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+import hashlib
 import re
 import time
 import threading
 
+if TYPE_CHECKING:
+    from langchain.agents import AgentExecutor
+    from supabase import Client
+
 # Définition du fuseau horaire du Sénégal (UTC+0)
 SENEGAL_TIMEZONE = timezone(timedelta(hours=0))
 
@@ -38,38 +47,72 @@ class FrenchParserInfo(parserinfo):
 SERVICE_ACCOUNT_FILE = os.path.join(os.path.dirname(__file__), 'service_account.json')
 SCOPES = ['https://www.googleapis.com/auth/calendar']
 CALENDAR_ID = os.getenv('GOOGLE_CALENDAR_ID', 'primary') 
+# Miroir local de l'agenda : les vérifications de disponibilité sont servies localement
+CALENDAR_MIRROR_ENABLED = os.getenv('CALENDAR_MIRROR_ENABLED', 'true').lower() == 'true'
 
 def get_calendar_service():
-    """Crée et retourne un service Google Calendar authentifié."""
+    """Retourne le service Google Calendar authentifié du thread courant (mis en cache)."""
     try:
-        logger.info(f"Tentative de chargement des credentials depuis : {SERVICE_ACCOUNT_FILE}")
         if not os.path.exists(SERVICE_ACCOUNT_FILE):
-            logger.error("Fichier service_account.json INTROUVABLE à l'emplacement attendu.")
+            logger.error(f"Fichier service_account.json INTROUVABLE à l'emplacement attendu : {SERVICE_ACCOUNT_FILE}")
             return None
-        
-        creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        
-        if creds and creds.valid:
-            logger.info("Credentials Google chargés et valides.")
-        else:
-            # Cette situation est souvent normale pour les comptes de service.
-            logger.info("La propriété 'valid' des credentials est False. Ceci est souvent normal pour les comptes de service qui rafraîchissent les tokens à la volée.")
-
-        service = build('calendar', 'v3', credentials=creds)
-        logger.info("Service Google Calendar créé avec succès.")
-        return service
+        return get_calendar_pool(SERVICE_ACCOUNT_FILE, SCOPES).get_service()
     except Exception as e:
         logger.error(f"Erreur critique lors de la création du service Calendar : {e}")
         logger.error(traceback.format_exc()) # Affiche la pile d'appel complète de l'erreur
         return None
 
+_calendar_mirror = None
+_calendar_mirror_lock = threading.Lock()
+
+def get_calendar_mirror() -> Optional[CalendarMirror]:
+    """Retourne le miroir local de l'agenda (créé au premier appel), ou None s'il est désactivé."""
+    global _calendar_mirror
+    if not CALENDAR_MIRROR_ENABLED:
+        return None
+    if _calendar_mirror is None:
+        with _calendar_mirror_lock:
+            if _calendar_mirror is None:
+                _calendar_mirror = CalendarMirror(
+                    get_calendar_service,
+                    CALENDAR_ID,
+                    execute=get_calendar_pool(SERVICE_ACCOUNT_FILE, SCOPES).execute,
+                )
+    return _calendar_mirror
+
+def warm_up_calendar():
+    """Préchauffage : credentials, document de découverte et token Calendar, puis synchronisation du miroir."""
+    if get_calendar_service() is None:
+        return
+    mirror = get_calendar_mirror()
+    if mirror is not None:
+        mirror.sync()
+
 def check_availability(start_dt: datetime, end_dt: datetime) -> bool:
+    mirror = get_calendar_mirror()
+    if mirror is not None:
+        try:
+            return mirror.check_availability(start_dt, end_dt)
+        except Exception as e:
+            logger.error(f"[CALENDAR_MIRROR] Miroir indisponible, interrogation directe de l'agenda : {e}")
     service = get_calendar_service()
     if not service: return False
-    events = service.events().list(calendarId=CALENDAR_ID, timeMin=start_dt.isoformat(), timeMax=end_dt.isoformat(), singleEvents=True).execute().get('items', [])
+    request = service.events().list(calendarId=CALENDAR_ID, timeMin=start_dt.isoformat(), timeMax=end_dt.isoformat(), singleEvents=True)
+    events = get_calendar_pool(SERVICE_ACCOUNT_FILE, SCOPES).execute("events.list", request).get('items', [])
     return not bool(events)
 
-def create_event(start_dt: datetime, end_dt: datetime, summary: str, client_email: str) -> dict:
+def appointment_event_id(job_id: str) -> str:
+    """
+    Identifiant d'événement Calendar dérivé de la tâche de rendez-vous : rejouer son events.insert
+    (tâche reprise après l'arrêt du processus) reçoit un 409 au lieu de réserver le créneau deux fois.
+    """
+    # Identifiants d'événement Google : caractères base32hex (a-v, 0-9), 5 à 1024 caractères
+    return "rdv" + hashlib.sha1(job_id.encode()).hexdigest()
+
+def new_ticket_id() -> str:
+    return f"TICKET-{os.urandom(4).hex().upper()}"
+
+def create_event(start_dt: datetime, end_dt: datetime, summary: str, client_email: str, event_id: str = None) -> dict:
     service = get_calendar_service()
     if not service: return {"error": "Service Calendar indisponible"}
     
@@ -91,13 +134,27 @@ def create_event(start_dt: datetime, end_dt: datetime, summary: str, client_emai
         'visibility': 'public',
         'transparency': 'opaque'
     }
+    if event_id:
+        event['id'] = event_id
     
     try:
         t0 = time.time()
-        result = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+        pool = get_calendar_pool(SERVICE_ACCOUNT_FILE, SCOPES)
+        try:
+            result = pool.execute("events.insert", service.events().insert(calendarId=CALENDAR_ID, body=event))
+        except HttpError as e:
+            if not event_id or e.resp.status != 409:
+                raise
+            # Tâche reprise : l'événement a déjà été créé par la tentative interrompue
+            logger.info(f"[CALENDAR] Événement {event_id} déjà créé, réutilisé.")
+            result = pool.execute("events.get", service.events().get(calendarId=CALENDAR_ID, eventId=event_id))
         logger.info(f"[PERF] Google Calendar event creation took {time.time() - t0:.2f} seconds")
         logger.info(f"[CALENDAR_SUCCESS] Événement créé avec succès. ID: {result.get('id')}")
         logger.info(f"[CALENDAR_SUCCESS] Lien: {result.get('htmlLink')}")
+        # Écriture directe dans le miroir : le créneau est vu occupé immédiatement
+        mirror = get_calendar_mirror()
+        if mirror is not None:
+            mirror.record_event(result)
         return result
     except Exception as e:
         logger.error(f"[CALENDAR_ERROR] Erreur lors de la création de l'événement: {e}")
@@ -107,7 +164,7 @@ def create_event(start_dt: datetime, end_dt: datetime, summary: str, client_emai
 
 # --- NOUVEL ENVOI D'EMAIL AVEC SMTPLIB (GMAIL) ---
 def send_ticket_email(ticket_data: dict, to_email: str):
-    """Envoie un e-mail de confirmation via SMTP (conçu pour Gmail)."""
+    """Met en file l'e-mail de confirmation, envoyé via SMTP (conçu pour Gmail)."""
     sender_email = os.getenv("SENDER_EMAIL")
     sender_password = os.getenv("SENDER_APP_PASSWORD")
     manager_email = os.getenv("MANAGER_EMAIL")
@@ -179,19 +236,12 @@ def send_ticket_email(ticket_data: dict, to_email: str):
     
     message.attach(MIMEText(body_html, "html"))
 
-    # Connexion au serveur SMTP et envoi
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()  # Sécurise la connexion
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, recipients, message.as_string())
-            logger.info(f"Email SMTP envoyé avec succès pour le ticket {ticket_data.get('ticket_id')}")
-    except smtplib.SMTPAuthenticationError:
-        logger.error("[EMAIL-SMTP] Échec de l'authentification. Vérifiez SENDER_EMAIL et SENDER_APP_PASSWORD.")
-        raise
-    except Exception as e:
-        logger.error(f"[EMAIL-SMTP] Erreur lors de l'envoi : {e}")
-        raise
+    # Mise en file : l'envoi se fait sur une connexion SMTP réutilisée (voir email_dispatcher.py)
+    # Un seul e-mail par ticket : une tâche de rendez-vous reprise ne l'envoie pas deux fois
+    if get_email_dispatcher(sender_email, sender_password).enqueue(
+        ticket_data.get('ticket_id'), sender_email, recipients, message.as_string()
+    ):
+        logger.info(f"Email mis en file d'envoi pour le ticket {ticket_data.get('ticket_id')}")
 
 # --- Fin de la section email ---
 
@@ -200,21 +250,28 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Configuration du cache Langchain
-langchain.llm_cache = SQLiteCache(database_path=os.path.join(os.path.dirname(__file__), ".langchain.db"))
-
-def get_supabase_client() -> Optional[Client]:
-    """Crée un client Supabase."""
+# (WAL, taille bornée avec éviction LRU, expiration des réponses : le prompt contient la date du jour)
+# Seuls les appels non diffusés y passent, c.-à-d. Llama Guard : l'agent appelle son modèle en streaming
+# Le cache, les modèles et l'agent sont créés au premier usage (ou par le préchauffage, voir startup.py)
+_lazy_init_lock = threading.RLock()
+llm_response_cache = None
+
+def get_llm_response_cache() -> HardenedSQLiteCache:
+    """Retourne le cache des réponses LLM, installé comme cache global de LangChain à sa création."""
+    global llm_response_cache
+    if llm_response_cache is None:
+        with _lazy_init_lock:
+            if llm_response_cache is None:
+                cache = HardenedSQLiteCache()
+                set_llm_cache(cache)
+                llm_response_cache = cache
+    return llm_response_cache
+
+def get_supabase_client() -> Optional["Client"]:
+    """Retourne le client Supabase partagé par le processus."""
     try:
-        supabase_url = os.getenv('SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_KEY')
-        
-        if not supabase_url or not supabase_key:
-            logger.error("SUPABASE_URL ou SUPABASE_KEY non configurés")
-            return None
-            
-        client = create_client(supabase_url, supabase_key)
-        logger.info("Client Supabase créé avec succès")
-        return client
+        pool = get_supabase_pool()
+        return pool.client() if pool else None
     except Exception as e:
         logger.error(f"Erreur lors de la création du client Supabase: {str(e)}")
         return None
@@ -235,9 +292,15 @@ class TicketData(BaseModel):
     issue_type: Optional[str] = Field(None, description="Type de problème (si support)")
     description: Optional[str] = Field(None, description="Description du problème (si support)")
     google_event_link: Optional[str] = Field(None, description="Lien de l'événement Google Calendar si un RDV a été créé")
+    ticket_id: Optional[str] = Field(None, description="Identifiant attribué à l'enregistrement du ticket")
 
 # --- Traitement asynchrone du rendez-vous (à placer après TicketData) ---
-def process_appointment_backend(ticket_data: TicketData):
+def process_appointment_backend(ticket_data: TicketData, event_id: str = None):
+    """
+    Crée l'événement Calendar puis le ticket. Rejouable : avec `event_id` et un ticket_id déjà
+    attribué (voir submit_appointment), une reprise ne crée ni second événement, ni second ticket,
+    ni second e-mail.
+    """
     try:
         # 1. Créer l'événement Google Calendar
         start_time_str = f"{ticket_data.proposed_date} {ticket_data.proposed_time}"
@@ -246,7 +309,8 @@ def process_appointment_backend(ticket_data: TicketData):
             start_time_str=start_time_str,
             summary=summary,
             client_email=ticket_data.email,
-            duration_minutes=60
+            duration_minutes=60,
+            event_id=event_id,
         )
 
         google_event_link = None
@@ -255,19 +319,47 @@ def process_appointment_backend(ticket_data: TicketData):
         ticket_data.google_event_link = google_event_link
 
         # 2. Créer le ticket
-        save_ticket(ticket_data)
+        result = save_ticket(ticket_data)
+        if result != PROCESSING_REPLY:
+            raise RuntimeError(result)
+        return {
+            "ticket_id": ticket_data.ticket_id,
+            "service_type": ticket_data.service_type,
+            "date": ticket_data.proposed_date,
+            "time": ticket_data.proposed_time,
+            "google_event_link": google_event_link,
+        }
     except Exception as e:
         logger.error(f"[BACKEND] Erreur lors du traitement asynchrone du rendez-vous : {e}")
+        raise  # La tâche est marquée en échec dans la file
+
+
+def _run_appointment_job(payload: dict) -> dict:
+    return process_appointment_backend(TicketData(**payload), event_id=appointment_event_id(current_job_id()))
+
+
+get_job_queue().register("appointment", _run_appointment_job)
+
+
+def submit_appointment(ticket_data: TicketData) -> str:
+    """Met le traitement du rendez-vous en file (tâche persistée) et retourne l'identifiant de la tâche."""
+    # Attribué une fois, avec la tâche : une tâche reprise réutilise le même ticket
+    ticket_data.ticket_id = ticket_data.ticket_id or new_ticket_id()
+    return get_job_queue().submit("appointment", ticket_data.model_dump())
 
 
 def save_ticket(ticket_data: TicketData) -> str:
-    """Sauvegarde un ticket dans Supabase, envoie un email de confirmation, et retourne son ID."""
+    """
+    Enregistre un ticket (journal local, puis insertion groupée dans Supabase, voir ticket_writer.py),
+    envoie un email de confirmation, et retourne sans attendre l'insertion. Un ticket_id déjà
+    attribué est conservé : le réenregistrer n'insère pas de doublon et ne renvoie pas l'e-mail.
+    """
     try:
-        client = get_supabase_client()
-        if not client:
+        pool = get_supabase_pool()
+        if not pool:
             return "Erreur : client Supabase introuvable."
 
-        ticket_id = f"TICKET-{os.urandom(4).hex().upper()}"
+        ticket_id = ticket_data.ticket_id or new_ticket_id()
         data = {
             "ticket_id": ticket_id,
             "type": ticket_data.type,
@@ -284,8 +376,9 @@ def save_ticket(ticket_data: TicketData) -> str:
         }
 
         t0 = time.time()
-        client.table("tickets").insert(data).execute()
-        logger.info(f"[PERF] Supabase insert took {time.time() - t0:.2f} seconds")
+        get_ticket_writer().submit(data)
+        logger.info(f"[PERF] Ticket journaling took {time.time() - t0:.2f} seconds")
+        ticket_data.ticket_id = ticket_id
         
         # --- ENVOI DE L'EMAIL DE CONFIRMATION ---
         email_notification_message = ""
@@ -294,89 +387,132 @@ def save_ticket(ticket_data: TicketData) -> str:
             logger.info(f"[EMAIL] Variables d'environnement - SENDER_EMAIL: {os.getenv('SENDER_EMAIL') is not None}, SENDER_APP_PASSWORD: {os.getenv('SENDER_APP_PASSWORD') is not None}")
             t1 = time.time()
             send_ticket_email(data, ticket_data.email)
-            logger.info(f"[PERF] Email sending took {time.time() - t1:.2f} seconds")
-            logger.info(f"[EMAIL] Email envoyé avec succès pour le ticket {ticket_id} à {ticket_data.email}")
+            logger.info(f"[PERF] Email queueing took {time.time() - t1:.2f} seconds")
+            logger.info(f"[EMAIL] Email mis en file pour le ticket {ticket_id} à {ticket_data.email}")
             email_notification_message = " Un e-mail de confirmation vous a été envoyé."
         except Exception as email_error:
             logger.error(f"[EMAIL] Erreur lors de la tentative d'envoi d'email: {email_error}")
             logger.error(f"[EMAIL] Traceback complet: {traceback.format_exc()}")
             email_notification_message = " L'envoi de l'e-mail de confirmation a échoué."
 
-        return "Votre demande est en cours de traitement. Vous recevrez une confirmation par e-mail sous peu."
+        return PROCESSING_REPLY
 
     except Exception as e:
+        # Les erreurs d'insertion Supabase (RLS, schéma) sont journalisées par ticket_writer
         logger.error(f"Erreur lors de l'enregistrement du ticket : {str(e)}")
-        error_str = str(e)
-        if 'violates row-level security policy' in error_str:
-            logger.error("--- ERREUR DE POLITIQUE SUPABASE (RLS) ---")
-            logger.error("La table 'tickets' bloque l'écriture. Allez sur Supabase > Policies et créez une politique d'INSERT pour la table 'tickets'.")
-            return "ERREUR: Le ticket n'a pas pu être sauvegardé à cause d'un problème de permissions dans la base de données."
-        
-        if "Could not find the 'google_event_link' column" in error_str:
-            logger.error("--- ERREUR DE SCHEMA SUPABASE ---")
-            logger.error("La colonne 'google_event_link' est manquante dans la table 'tickets'. Veuillez l'ajouter (type: text).")
-            return "ERREUR: Le ticket n'a pas pu être sauvegardé car la base de données n'est pas à jour. La colonne 'google_event_link' est manquante."
-
         return "ERREUR: Une erreur interne est survenue lors de la création du ticket. Le ticket n'a PAS été créé."
 
 # --- MODÈLES LLM ---
 
-# Modèle principal pour la conversation
-llm = ChatGroq(model="qwen/qwen3-32b", temperature=0, groq_api_key=os.getenv("GROQ_API_KEY") or "...", timeout=30)
-logger.info(f"LLM conversationnel initialisé : {llm.model_name}")
+llm = None  # Modèle principal pour la conversation
+llama_guard = None  # Modèle de garde pour la modération de contenu
+
+# Modèle de secours de la conversation (requêtes de couverture, bascule en panne) ; vide : aucun
+GROQ_FALLBACK_MODEL = os.getenv("GROQ_FALLBACK_MODEL", "llama-3.3-70b-versatile")
+
+def _chat_groq(model: str):
+    from langchain_groq import ChatGroq  # Import lourd (groq, httpx), différé au premier usage
+    return ChatGroq(model=model, temperature=0, groq_api_key=os.getenv("GROQ_API_KEY") or "...", timeout=30)
+
+def get_llm():
+    """Retourne le modèle conversationnel (créé au premier appel), doublé du modèle de secours."""
+    global llm
+    get_llm_response_cache()  # Le cache doit être en place avant le premier appel au modèle
+    if llm is None:
+        with _lazy_init_lock:
+            if llm is None:
+                fallback = _chat_groq(GROQ_FALLBACK_MODEL) if GROQ_FALLBACK_MODEL else None
+                llm = ResilientChatModel(primary=_chat_groq("qwen/qwen3-32b"), fallback=fallback)
+                logger.info(f"LLM conversationnel initialisé : {llm.model_name} (secours : {GROQ_FALLBACK_MODEL or 'aucun'})")
+    return llm
+
+def get_llama_guard():
+    """Retourne le modèle de modération (créé au premier appel)."""
+    global llama_guard
+    get_llm_response_cache()
+    if llama_guard is None:
+        with _lazy_init_lock:
+            if llama_guard is None:
+                llama_guard = _chat_groq("meta-llama/llama-guard-4-12b")
+                logger.info(f"LLM de modération initialisé : {llama_guard.model_name}")
+    return llama_guard
+
+def _llama_guard_prompt(text_to_moderate: str) -> str:
+    # Prompt de classification simple pour Llama Guard
+    return f"""
+    Task: Check if the user message is safe to process for a customer service agent.
+    The agent's task is to book appointments for a dental clinic.
+    Unsafe content includes self-harm, hate speech, violence, and sexually explicit material.
+    A simple question, even if out of scope, is safe.
+
+    <begin>
+    {text_to_moderate}
+    <end>
+
+    Is the above message safe or unsafe? Answer with a single word.
+    """
 
-# Modèle de garde pour la modération de contenu
-llama_guard = ChatGroq(model="meta-llama/llama-guard-4-12b", temperature=0, groq_api_key=os.getenv("GROQ_API_KEY") or "...", timeout=30)
-logger.info(f"LLM de modération initialisé : {llama_guard.model_name}")
+def _llama_guard_is_safe(text_to_moderate: str, response) -> bool:
+    # Llama Guard est entraîné à répondre par "safe" ou "unsafe".
+    # On vérifie la présence du mot "unsafe" dans la réponse.
+    answer = response.content.strip().lower()
+    logger.info(f"[MODERATION] Texte: '{text_to_moderate[:50]}...' -> Réponse Guard: '{answer}'")
+    return "unsafe" not in answer
+
+def _llama_guard_verdict(text_to_moderate: str) -> bool:
+    """Interroge Llama Guard et retourne True si le texte est jugé sûr."""
+    # Place dans la limite d'appels simultanés aux modèles Groq (voir admission.py)
+    with llm_gate.slot():
+        response = get_llama_guard().invoke(_llama_guard_prompt(text_to_moderate))
+    return _llama_guard_is_safe(text_to_moderate, response)
+
+async def _allama_guard_verdict(text_to_moderate: str) -> bool:
+    async with llm_gate.aslot():
+        response = await get_llama_guard().ainvoke(_llama_guard_prompt(text_to_moderate))
+    return _llama_guard_is_safe(text_to_moderate, response)
 
 def moderate_content(text_to_moderate: str) -> bool:
     """
     Vérifie si un texte est sûr en utilisant Llama Guard.
+    Les cas évidents sont tranchés localement et les verdicts sont mis en cache (voir moderation.py).
     Retourne True si le texte est sûr, False sinon.
     """
     if not text_to_moderate:
         return True # Considérer une chaîne vide comme sûre
 
     try:
-        # Prompt de classification simple pour Llama Guard
-        prompt = f"""
-        Task: Check if the user message is safe to process for a customer service agent.
-        The agent's task is to book appointments for a dental clinic.
-        Unsafe content includes self-harm, hate speech, violence, and sexually explicit material.
-        A simple question, even if out of scope, is safe.
-
-        <begin>
-        {text_to_moderate}
-        <end>
-
-        Is the above message safe or unsafe? Answer with a single word.
-        """
-        
-        response = llama_guard.invoke(prompt)
-        
-        # Llama Guard est entraîné à répondre par "safe" ou "unsafe".
-        # On vérifie la présence du mot "unsafe" dans la réponse.
-        answer = response.content.strip().lower()
-        logger.info(f"[MODERATION] Texte: '{text_to_moderate[:50]}...' -> Réponse Guard: '{answer}'")
-        
-        if "unsafe" in answer:
-            return False # Le contenu est jugé dangereux
-        
-        return True # Le contenu est sûr
-        
+        with tracing.span("moderation"):
+            return moderation.check(text_to_moderate, _llama_guard_verdict)
+    except Overloaded:
+        raise  # Surcharge : le message n'est pas jugé, l'appelant répond « réessayez »
     except Exception as e:
         logger.error(f"[MODERATION] Erreur lors de la modération du contenu : {e}")
         return False # Par précaution, considérer comme non sûr en cas d'erreur
 
+async def amoderate_content(text_to_moderate: str) -> bool:
+    """Variante asyncio de moderate_content (mode async_app)."""
+    if not text_to_moderate:
+        return True
+
+    try:
+        with tracing.span("moderation"):
+            return await moderation.acheck(text_to_moderate, _allama_guard_verdict)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"[MODERATION] Erreur lors de la modération du contenu : {e}")
+        return False
+
 # --- OUTILS DE L'AGENT ---
-def create_calendar_event_backend(start_time_str: str, summary: str, client_email: str, duration_minutes: int = 60) -> str:
+def create_calendar_event_backend(start_time_str: str, summary: str, client_email: str, duration_minutes: int = 60,
+                                  event_id: str = None) -> str:
     try:
         time_str_for_parsing = start_time_str.replace('h', ':')
         start_time = parse_datetime(time_str_for_parsing, parserinfo=FrenchParserInfo())
         if start_time.tzinfo is None:
             start_time = start_time.replace(tzinfo=SENEGAL_TIMEZONE)
         end_time = start_time + timedelta(minutes=duration_minutes)
-        event = create_event(start_time, end_time, summary, client_email)
+        event = create_event(start_time, end_time, summary, client_email, event_id=event_id)
         if "error" in event:
             return f"Échec de la création de l'événement: {event['error']}"
         else:
@@ -506,7 +642,7 @@ def create_ticket(
         description=description,
         google_event_link=google_event_link,
     )
-    print(f"[TOOL CALLED] Ticket : {ticket_data.model_dump(exclude_none=True)}")
+    logger.debug(f"[CREATE_TICKET] Champs fournis : {sorted(ticket_data.model_dump(exclude_none=True))}")
     result = save_ticket(ticket_data)
     logger.info(f"[CREATE_TICKET] Résultat de création du ticket : {result}")
     return result
@@ -515,7 +651,7 @@ def create_ticket(
 tools = [create_ticket, check_calendar_availability, create_calendar_event]
 
 # Nouveau prompt système qui explique le workflow
-BASE_SYSTEM_PROMPT = """
+BASE_SYSTEM_PROMPT = f"""
 Vous êtes l'assistant conversationnel de la Clinique Dentaire St Dominique à Dakar.
 
 ### 🎯 Objectif :
@@ -554,20 +690,26 @@ Aider les patients à prendre rendez-vous ou poser des questions, **en évitant
 
 ### 🦷 Contexte clinique :
 
-- Adresse : Avenue Cheikh Anta Diop, Dakar.
-- Téléphone : +221 77 510 02 06
-- Horaires : Lundi à Vendredi (9h-13h / 15h-18h30), Samedi (9h-12h)
+- Adresse : {CLINIC_ADDRESS}.
+- Téléphone : {CLINIC_PHONE}
+- Horaires : {CLINIC_HOURS}
 
 """
 
 
-# Création de l'agent et de l'exécuteur (simplifié)
-def get_agent_executor(memory) -> AgentExecutor:
+# --- Agent compilé une seule fois par processus ---
+# Le prompt, l'agent et l'exécuteur sont partagés entre toutes les conversations.
+# Ils ne sont reconstruits que lorsque la date injectée dans le prompt système change.
+_compiled_agent_lock = threading.Lock()
+_compiled_agent = None  # Tuple (date du prompt, {diffusé ? : AgentExecutor sans mémoire})
+
+def _build_agent_executors(current_date: str) -> dict:
     """
-    Crée et retourne une instance de l'exécuteur d'agent.
+    Construit les exécuteurs d'agent (sans mémoire) pour la date donnée, autour du même agent.
+    Diffusé (stream_runnable=True) : le modèle est appelé en streaming pour les jetons SSE, ce
+    que le cache LangChain ne sert pas. Non diffusé : appel invoke, servi par le cache des réponses.
     """
-    # Ajout de la date du jour dynamiquement dans le prompt système avec le fuseau horaire du Sénégal
-    current_date = datetime.now(SENEGAL_TIMEZONE).strftime('%A %d %B %Y')
+    from langchain.agents import AgentExecutor, create_tool_calling_agent  # Import lourd, différé
     system_prompt = f"""
     Nous sommes le {current_date}.
     {BASE_SYSTEM_PROMPT}
@@ -578,47 +720,102 @@ def get_agent_executor(memory) -> AgentExecutor:
         ("human", "{input}"),
         ("placeholder", "{agent_scratchpad}"),
     ])
-    
-    agent = create_tool_calling_agent(llm, tools, prompt)
-    
-    # Intégration de la mémoire directement dans l'exécuteur
-    agent_executor = AgentExecutor(
-        agent=agent, 
-        tools=tools, 
-        memory=memory, 
-        verbose=True
-    )
-    return agent_executor
+
+    agent = create_tool_calling_agent(get_llm(), tools, prompt)
+
+    # Pas de mémoire ici : elle est liée à chaque appel par SessionAgentExecutor
+    return {stream: AgentExecutor(agent=agent, tools=tools, verbose=True, stream_runnable=stream)
+            for stream in (True, False)}
+
+def get_compiled_agent(stream: bool = True) -> "AgentExecutor":
+    """
+    Retourne l'exécuteur d'agent partagé par le processus, diffusé (SSE) ou non (servi par le cache).
+    Il est reconstruit uniquement au changement de date (fuseau horaire du Sénégal).
+    """
+    global _compiled_agent
+    current_date = datetime.now(SENEGAL_TIMEZONE).strftime('%A %d %B %Y')
+    compiled = _compiled_agent
+    if compiled is not None and compiled[0] == current_date:
+        return compiled[1][stream]
+
+    with _compiled_agent_lock:
+        if _compiled_agent is None or _compiled_agent[0] != current_date:
+            t0 = time.time()
+            _compiled_agent = (current_date, _build_agent_executors(current_date))
+            logger.info(f"[AGENT] Agent compilé pour le {current_date} en {time.time() - t0:.3f} secondes")
+        return _compiled_agent[1][stream]
+
+class SessionAgentExecutor:
+    """
+    Lie la mémoire d'une session à l'agent partagé le temps d'un appel.
+    Reproduit le comportement de AgentExecutor(memory=...) : l'historique est chargé
+    avant l'appel et le nouvel échange est sauvegardé après.
+    """
+
+    def __init__(self, executor: "AgentExecutor", memory):
+        self.executor = executor
+        self.memory = memory
+
+    def invoke(self, inputs: dict, config=None) -> dict:
+        memory_variables = self.memory.load_memory_variables(inputs) if self.memory is not None else {}
+        # Spans des appels LLM et des outils, rattachés à la trace de la requête
+        config = dict(config or {})
+        config["callbacks"] = list(config.get("callbacks") or []) + [tracing.SpanCallbackHandler()]
+        # Un tour d'agent occupe une place dans la limite d'appels simultanés aux modèles Groq
+        with llm_gate.slot(), tracing.span("agent"):
+            result = self.executor.invoke({**inputs, **memory_variables}, config=config)
+        if self.memory is not None:
+            self.memory.save_context(inputs, {"output": result["output"]})
+        return result
+
+    async def ainvoke(self, inputs: dict, config=None) -> dict:
+        """Variante asyncio de invoke : l'appel au modèle ne bloque pas la boucle d'événements."""
+        memory_variables = self.memory.load_memory_variables(inputs) if self.memory is not None else {}
+        config = dict(config or {})
+        config["callbacks"] = list(config.get("callbacks") or []) + [tracing.SpanCallbackHandler()]
+        async with llm_gate.aslot():
+            with tracing.span("agent"):
+                result = await self.executor.ainvoke({**inputs, **memory_variables}, config=config)
+        if self.memory is not None:
+            self.memory.save_context(inputs, {"output": result["output"]})
+        return result
+
+def get_agent_executor(memory, stream: bool = False) -> SessionAgentExecutor:
+    """
+    Retourne l'agent partagé, lié à la mémoire de la session.
+    `stream` : les jetons sont diffusés (SSE) ; sinon la réponse peut venir du cache des réponses LLM.
+    """
+    return SessionAgentExecutor(get_compiled_agent(stream), memory)
+
+CONFIRM_SENTINEL = "[CONFIRM_APPOINTMENT]"
+PROCESSING_REPLY = "Votre demande est en cours de traitement. Vous recevrez une confirmation par e-mail sous peu."
+TICKET_FIELDS = ["name", "email", "phone", "service_type", "proposed_date", "proposed_time"]
+CONFIRMATION_WORDS = {"oui", "confirmer", "ok", "yes", "je confirme", "oui je confirme", "d'accord", "oui d'accord"}
 
 def handle_appointment_dialogue(message, user_data):
     """
     Gère le dialogue de prise de rendez-vous avec confirmation utilisateur.
-    user_data : dict contenant les infos collectées (nom, email, téléphone, soin, date, heure, confirmation_pending)
+    user_data : dict contenant les infos collectées (nom, email, téléphone, soin, date, heure, confirmation_pending,
+                recap_fields : infos du dernier récapitulatif)
     message : message texte reçu de l'utilisateur
-    Retourne la réponse à afficher à l'utilisateur.
+    Retourne la réponse à afficher à l'utilisateur, ou None si le message doit être traité par l'agent.
     """
+    fields = {k: user_data.get(k) for k in TICKET_FIELDS}
     # 1. Si on attend la confirmation
     if user_data.get("confirmation_pending"):
-        if message.strip().lower() in ["oui", "confirmer", "ok", "yes"]:
+        if moderation.normalize_text(message) in CONFIRMATION_WORDS:
             # Lancer le traitement asynchrone
-            ticket_data = TicketData(
-                type="appointment",
-                name=user_data["name"],
-                email=user_data["email"],
-                phone=user_data["phone"],
-                service_type=user_data["service_type"],
-                proposed_date=user_data["proposed_date"],
-                proposed_time=user_data["proposed_time"]
-            )
-            threading.Thread(target=process_appointment_backend, args=(ticket_data,)).start()
+            ticket_data = TicketData(type="appointment", **fields)
+            user_data["job_id"] = submit_appointment(ticket_data)
             user_data["confirmation_pending"] = False
-            # Ici, il faudrait sauvegarder user_data dans la session ou la base si besoin
-            return "Votre demande est en cours de traitement. Vous recevrez une confirmation par e-mail sous peu."
-        else:
-            return "Merci de répondre par 'oui' ou 'confirmer' pour valider votre rendez-vous."
-    # 2. Si on a toutes les infos mais pas encore demandé la confirmation
-    infos_ok = all(user_data.get(k) for k in ["name", "email", "phone", "service_type", "proposed_date", "proposed_time"])
-    if infos_ok and not user_data.get("confirmation_pending"):
+            return PROCESSING_REPLY
+        # Autre réponse : l'agent reprend la main (question, correction...)
+        user_data["confirmation_pending"] = False
+        if fields == user_data.get("recap_fields"):
+            return None
+    # 2. Si on a toutes les infos et qu'elles n'ont pas encore été récapitulées
+    infos_ok = all(fields.values())
+    if infos_ok and fields != user_data.get("recap_fields"):
         recap = (
             f"Merci, voici le récapitulatif de votre demande :\n"
             f"- Nom : {user_data['name']}\n"
@@ -630,34 +827,56 @@ def handle_appointment_dialogue(message, user_data):
             "**Merci de confirmer pour continuer (répondez par 'oui' ou 'confirmer').**"
         )
         user_data["confirmation_pending"] = True
-        # Ici, il faudrait sauvegarder user_data dans la session ou la base si besoin
+        user_data["recap_fields"] = fields
         return recap
-    # 3. Sinon, poursuis la collecte des infos (à intégrer dans ta logique principale)
-    return None  # Signifie qu'il faut continuer la collecte
-
-# --- Exemple d'intégration backend pour un traitement asynchrone instantané ---
-# (À adapter à Flask, FastAPI, Django, etc.)
-#
-# def handle_confirmed_appointment(user_data):
-#     """
-#     Fonction à appeler dès que l'utilisateur a confirmé son rendez-vous.
-#     user_data : dict contenant toutes les infos nécessaires (nom, email, téléphone, soin, date, heure)
-#     """
-#     from threading import Thread
-#     ticket_data = TicketData(
-#         type="appointment",
-#         name=user_data["name"],
-#         email=user_data["email"],
-#         phone=user_data["phone"],
-#         service_type=user_data["service_type"],
-#         proposed_date=user_data["proposed_date"],
-#         proposed_time=user_data["proposed_time"]
-#     )
-#     Thread(target=process_appointment_backend, args=(ticket_data,)).start()
-#     # Répondre immédiatement à l'utilisateur :
-#     return "Votre demande est en cours de traitement. Vous recevrez une confirmation par e-mail sous peu."
-#
-# --- Fin de l'exemple ---
+    # 3. Sinon, l'agent poursuit la collecte des infos
+    return None
+
+def extract_user_data_from_session(session) -> dict:
+    """Infos du ticket de la session : champs suivis message par message, complétés par le résumé de la mémoire."""
+    user_data = dict(session.slots)
+    # Les informations des échanges déjà résumés par la mémoire complètent l'extraction
+    for key, value in getattr(session.memory, "slots", {}).items():
+        if value and not user_data.get(key):
+            user_data[key] = value
+    return user_data
+
+def booking_in_progress(session) -> bool:
+    """Rendez-vous en cours de collecte : une partie seulement des champs du ticket est connue."""
+    user_data = extract_user_data_from_session(session)
+    known = [bool(user_data.get(k)) for k in TICKET_FIELDS]
+    return any(known) and not all(known)
+
+def answer_appointment_turn(session, message: str) -> Optional[dict]:
+    """
+    Voie rapide sans appel LLM : récapitulatif et confirmation du rendez-vous.
+    Retourne {"response", "job_id"} si le tour a été traité localement (l'échange est ajouté
+    à la mémoire, la session reste à sauvegarder), ou None pour laisser répondre l'agent.
+    """
+    t0 = time.perf_counter()
+    session.slot_tracker.observe(message)  # Le message courant compte déjà pour les champs
+    state = session.data.setdefault("dialogue", {})
+    user_data = {**extract_user_data_from_session(session), **state}
+    reply = handle_appointment_dialogue(message, user_data)
+    job_id = user_data.pop("job_id", None)
+    state.update({k: user_data[k] for k in ("confirmation_pending", "recap_fields") if k in user_data})
+    if reply is None:
+        metrics.counter("dialogue_turns_total", path="llm").inc()
+        return None
+    session.memory.save_context({"input": message}, {"output": reply})
+    metrics.counter("dialogue_turns_total", path="confirmation" if job_id else "recap").inc()
+    metrics.histogram("dialogue_local_seconds").observe(time.perf_counter() - t0)
+    return {"response": reply, "job_id": job_id}
+
+def confirm_appointment(session) -> str:
+    """Confirmation annoncée par l'agent ([CONFIRM_APPOINTMENT]) : lance le traitement et retourne l'id de la tâche."""
+    user_data = extract_user_data_from_session(session)
+    logger.debug(f"[DIALOGUE] Champs confirmés : {sorted(k for k in TICKET_FIELDS if user_data.get(k))}")
+    ticket_data = TicketData(type="appointment", **{k: user_data[k] for k in TICKET_FIELDS})
+    # Ces infos sont confirmées : pas de nouveau récapitulatif tant qu'elles ne changent pas
+    session.data.setdefault("dialogue", {}).update(
+        confirmation_pending=False, recap_fields={k: user_data[k] for k in TICKET_FIELDS})
+    return submit_appointment(ticket_data)
 
 if __name__ == "__main__":
     print("Testing lead_graph.py components with new ticket logic...")
@@ -691,6 +910,7 @@ if __name__ == "__main__":
     # Test de la création d'agent
     print("\n--- Agent Executor Creation Test ---")
     try:
+        from langchain.memory import ConversationBufferMemory
         test_memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
         test_executor = get_agent_executor(test_memory)
         print("Agent executor created successfully.")
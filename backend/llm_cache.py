@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", os.path.join(os.path.dirname(__file__), ".llm_cache.db"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+# Le prompt système contient la date du jour : les réponses ne sont pas gardées au-delà
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(6 * 3600)))
+# Une éviction (TTL puis LRU) est lancée toutes les N écritures
+LLM_CACHE_EVICT_EVERY = int(os.getenv("LLM_CACHE_EVICT_EVERY", "100"))
+# Précision de la date de dernier accès : évite une écriture à chaque lecture
+LLM_CACHE_TOUCH_INTERVAL = 60
+
+# Champs des messages sans effet sur la réponse (identifiants de run, métadonnées d'usage...)
+_VOLATILE_FIELDS = {"id", "response_metadata", "usage_metadata"}
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items() if k not in _VOLATILE_FIELDS}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return _SPACES.sub(" ", value).strip()
+    return value
+
+
+def cache_key(prompt: str, llm_string: str) -> str:
+    """Clé stable : prompt sérialisé sans champs volatils ni différences d'espacement."""
+    try:
+        prompt = json.dumps(_normalize(json.loads(prompt)), sort_keys=True, ensure_ascii=False)
+    except ValueError:
+        prompt = _SPACES.sub(" ", prompt).strip()  # Prompt texte (LLM non conversationnel)
+    return hashlib.sha256(f"{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+
+class HardenedSQLiteCache(BaseCache):
+    """
+    Cache des réponses LLM dans SQLite, partagé par les workers gunicorn.
+
+    LangChain ne consulte le cache que pour les appels non diffusés (invoke/generate) : les
+    verdicts de Llama Guard et les tours d'agent sans SSE (WhatsApp, /api/chat), dont l'exécuteur
+    est construit avec stream_runnable=False. Les tours diffusés (jetons SSE) n'y passent pas.
+
+    Mode WAL (lectures concurrentes sans blocage des écritures), une connexion par
+    thread, expiration par TTL et taille bornée avec éviction des entrées les moins
+    récemment lues. Succès, échecs et latence sont suivis dans `metrics`.
+    """
+
+    def __init__(self, database_path: str = LLM_CACHE_DB, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl: int = LLM_CACHE_TTL):
+        self.database_path = database_path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.database_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        t0 = time.perf_counter()
+        key = cache_key(prompt, llm_string)
+        conn = self._conn()
+        try:
+            row = conn.execute("SELECT response, created_at, accessed_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None:
+                metrics.counter("llm_cache_requests_total", result="miss").inc()
+                return None
+            response, created_at, accessed_at = row
+            if created_at < now - self.ttl:
+                with conn:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                metrics.counter("llm_cache_requests_total", result="expired").inc()
+                return None
+            if accessed_at < now - LLM_CACHE_TOUCH_INTERVAL:
+                with conn:
+                    conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            generations = [loads(item) for item in json.loads(response)]
+            metrics.counter("llm_cache_requests_total", result="hit").inc()
+            return generations
+        except (sqlite3.Error, ValueError) as e:
+            # Le cache ne doit jamais faire échouer l'appel au modèle
+            metrics.counter("llm_cache_errors_total").inc()
+            logger.warning(f"[LLM_CACHE] Lecture impossible : {e}")
+            return None
+        finally:
+            metrics.histogram("llm_cache_lookup_seconds").observe(time.perf_counter() - t0)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        now = time.time()
+        response = json.dumps([dumps(generation) for generation in return_val])
+        conn = self._conn()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (cache_key(prompt, llm_string), response, now, now),
+                )
+            with self._writes_lock:
+                self._writes += 1
+                evict = self._writes % LLM_CACHE_EVICT_EVERY == 0
+            if evict:
+                self.evict()
+        except sqlite3.Error as e:
+            metrics.counter("llm_cache_errors_total").inc()
+            logger.warning(f"[LLM_CACHE] Écriture impossible : {e}")
+
+    def evict(self) -> int:
+        """Supprime les entrées expirées puis les moins récemment lues au-delà de max_entries."""
+        conn = self._conn()
+        with conn:
+            expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+            overflow = conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        if expired or overflow:
+            metrics.counter("llm_cache_evictions_total", reason="ttl").inc(expired)
+            metrics.counter("llm_cache_evictions_total", reason="lru").inc(overflow)
+            logger.info(f"[LLM_CACHE] Éviction : {expired} expirée(s), {overflow} au-delà de la limite")
+        return expired + overflow
+
+    def clear(self, **kwargs: Any) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        counts = {result: metrics.counter("llm_cache_requests_total", result=result).value
+                  for result in ("hit", "miss", "expired")}
+        total = sum(counts.values())
+        entries = self._conn().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "scope": "moderation+agent",  # Tours d'agent diffusés (SSE) hors cache
+            **counts,
+            "hit_rate": round(counts["hit"] / total, 4) if total else 0.0,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "lookup_seconds": metrics.histogram("llm_cache_lookup_seconds").snapshot(),
+        }
@@ -0,0 +1,262 @@
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """La file a atteint sa capacité maximale."""
+
+
+class KeyedWorkQueue:
+    """
+    File de travail bornée traitée par un pool fixe de workers.
+
+    Les éléments d'une même clé (ex. un numéro de téléphone) sont traités un par un,
+    dans leur ordre d'arrivée ; des clés différentes sont traitées en parallèle.
+    Les éléments déjà vus (même identifiant) sont ignorés.
+    Avec `merge`, les éléments en attente d'une clé sont fusionnés (`merge(liste d'éléments)`)
+    et traités en une fois, après `debounce` secondes sans nouvel élément pour cette clé ;
+    pendant ce délai la clé attend dans un échéancier, sans occuper de worker.
+    """
+
+    def __init__(self, handler, name: str, workers: int = 4, max_pending: int = 1000,
+                 dedup_size: int = 10000, dedup_ttl: int = 3600, merge=None, debounce: float = 0.0):
+        self.handler = handler
+        self.name = name
+        self.merge = merge
+        self.debounce = debounce
+        self.workers = workers
+        self.max_pending = max_pending
+        self.dedup_size = dedup_size
+        self.dedup_ttl = dedup_ttl
+        self._cond = threading.Condition()
+        self._pending = {}      # clé -> deque[(horodatage d'arrivée, élément, trace)]
+        self._ready = deque()   # clés ayant du travail et aucun worker actif
+        self._waiting = []      # tas de (échéance, clé) : clés en attente de `debounce` s sans nouvel élément
+        self._active = set()    # clés en cours de traitement
+        self._seen = OrderedDict()  # identifiant -> horodatage
+        self._size = 0
+        self._threads = []
+
+    # --- Dépôt ---
+    def submit(self, key: str, item, item_id: str = None) -> bool:
+        """Ajoute un élément ; retourne False s'il s'agit d'un doublon. Lève QueueFull si la file est pleine."""
+        with self._cond:
+            self._start_workers()
+            if not self._enqueue(key, item, item_id):
+                return False
+            self._cond.notify()
+        return True
+
+    def _enqueue(self, key: str, item, item_id: str = None) -> bool:
+        """Dédoublonne et range l'élément dans la file de sa clé (verrou détenu)."""
+        if item_id is not None and self._is_duplicate(item_id):
+            metrics.counter("queue_duplicates_total", queue=self.name).inc()
+            logger.info(f"[QUEUE:{self.name}] Doublon ignoré : {item_id}")
+            return False
+        if self._size >= self.max_pending:
+            metrics.counter("queue_rejected_total", queue=self.name).inc()
+            raise QueueFull(f"File '{self.name}' pleine ({self._size} éléments)")
+        if item_id is not None:
+            self._seen[item_id] = time.time()
+        items = self._pending.setdefault(key, deque())
+        items.append((time.monotonic(), item, tracing.current_trace_id()))
+        self._size += 1
+        if key not in self._active and len(items) == 1:
+            self._schedule(key)
+        return True
+
+    def _schedule(self, key: str):
+        """Rend la clé prête, ou la met en attente de `debounce` s sans nouvel élément (verrou détenu)."""
+        if self.merge is not None and self.debounce > 0:
+            heapq.heappush(self._waiting, (self._pending[key][-1][0] + self.debounce, key))
+        else:
+            self._ready.append(key)
+
+    def _promote(self) -> float:
+        """
+        Passe dans `_ready` les clés en attente restées calmes `debounce` secondes (verrou détenu) ;
+        retourne le délai avant la prochaine échéance, ou None s'il n'y en a pas.
+        """
+        now = time.monotonic()
+        while self._waiting and self._waiting[0][0] <= now:
+            _, key = heapq.heappop(self._waiting)
+            quiet_at = self._pending[key][-1][0] + self.debounce
+            if quiet_at > now:
+                heapq.heappush(self._waiting, (quiet_at, key))  # Nouvel élément entre-temps
+            else:
+                self._ready.append(key)
+        return self._waiting[0][0] - now if self._waiting else None
+
+    def _is_duplicate(self, item_id: str) -> bool:
+        limit = time.time() - self.dedup_ttl
+        while self._seen and (len(self._seen) > self.dedup_size or next(iter(self._seen.values())) < limit):
+            self._seen.popitem(last=False)
+        return item_id in self._seen
+
+    # --- Workers ---
+    def _start_workers(self):
+        # Démarrage paresseux : les threads sont créés dans le worker gunicorn, après le fork
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        """Attend une clé prête et retourne (clé, horodatage d'arrivée, élément, trace)."""
+        with self._cond:
+            while True:
+                next_due = self._promote()
+                if self._ready:
+                    break
+                self._cond.wait(next_due)
+            key = self._ready.popleft()
+            self._active.add(key)
+            return (key, *self._pop(key))
+
+    def _quiet_delay(self, key: str) -> float:
+        """Temps restant avant `debounce` secondes sans nouvel élément pour la clé."""
+        with self._cond:
+            return self._pending[key][-1][0] + self.debounce - time.monotonic()
+
+    def _pop(self, key: str):
+        """Retire l'élément suivant de la clé, ou tous ses éléments fusionnés (verrou détenu)."""
+        items = self._pending[key]
+        if self.merge is None:
+            self._size -= 1
+            return items.popleft()
+        batch = list(items)
+        items.clear()
+        self._size -= len(batch)
+        if len(batch) > 1:
+            metrics.counter("queue_coalesced_total", queue=self.name).inc(len(batch) - 1)
+        return batch[0][0], self.merge([entry[1] for entry in batch]), batch[0][2]
+
+    def _release(self, key: str):
+        with self._cond:
+            self._active.discard(key)
+            if self._pending.get(key):
+                self._schedule(key)
+                self._cond.notify()
+            else:
+                self._pending.pop(key, None)
+
+    def _work(self):
+        while True:
+            key, enqueued_at, item, trace_id = self._take()
+            metrics.histogram("queue_wait_seconds", queue=self.name).observe(time.monotonic() - enqueued_at)
+            try:
+                # Le traitement reste rattaché à la trace de la requête qui a déposé l'élément
+                with tracing.trace(trace_id), tracing.span(f"queue:{self.name}"), \
+                        metrics.timed("queue_processing_seconds", queue=self.name):
+                    self.handler(key, item)
+                metrics.counter("queue_processed_total", queue=self.name).inc()
+            except Exception as e:
+                metrics.counter("queue_failed_total", queue=self.name).inc()
+                logger.exception(f"[QUEUE:{self.name}] Erreur lors du traitement pour {key} : {e}")
+            finally:
+                self._release(key)
+
+    # --- Observabilité ---
+    def depth(self) -> int:
+        return self._size
+
+    def stats(self) -> dict:
+        with self._cond:
+            depth, active = self._size, len(self._active)
+        return {
+            "depth": depth,
+            "active_keys": active,
+            "debouncing_keys": len(self._waiting),
+            "workers": self.workers,
+            "processed": metrics.counter("queue_processed_total", queue=self.name).value,
+            "failed": metrics.counter("queue_failed_total", queue=self.name).value,
+            "duplicates": metrics.counter("queue_duplicates_total", queue=self.name).value,
+            "coalesced": metrics.counter("queue_coalesced_total", queue=self.name).value,
+            "rejected": metrics.counter("queue_rejected_total", queue=self.name).value,
+            "wait_seconds": metrics.histogram("queue_wait_seconds", queue=self.name).snapshot(),
+        }
+
+
+class AsyncKeyedWorkQueue(KeyedWorkQueue):
+    """
+    Variante asyncio de KeyedWorkQueue (mode async_app) : `handler(key, item)` est une coroutine
+    et chaque clé active est vidée par une tâche de la boucle d'événements, sans thread.
+    Mêmes garanties d'ordre par clé, de dédoublonnage et de borne ; au plus `workers`
+    éléments sont traités simultanément. submit() doit être appelé depuis la boucle.
+    """
+
+    def __init__(self, handler, name: str, workers: int = 256, **kwargs):
+        super().__init__(handler, name, workers=workers, **kwargs)
+        self._slots = None  # asyncio.Semaphore, créé dans la boucle au premier dépôt
+        self._tasks = set()
+
+    def submit(self, key: str, item, item_id: str = None) -> bool:
+        with self._cond:
+            if not self._enqueue(key, item, item_id):
+                return False
+        self._spawn_ready()
+        return True
+
+    def _schedule(self, key: str):
+        # Échéance sur la boucle (minuterie) plutôt que dans le tas des workers
+        if self.merge is not None and self.debounce > 0:
+            delay = self._pending[key][-1][0] + self.debounce - time.monotonic()
+            asyncio.get_running_loop().call_later(max(0.0, delay), self._on_quiet, key)
+        else:
+            self._ready.append(key)
+
+    def _on_quiet(self, key: str):
+        with self._cond:
+            if (delay := self._quiet_delay(key)) > 0:
+                asyncio.get_running_loop().call_later(delay, self._on_quiet, key)  # Nouvel élément entre-temps
+                return
+            self._ready.append(key)
+        self._spawn_ready()
+
+    def _spawn_ready(self):
+        """Lance une tâche de vidage par clé prête (aucune tâche n'existe déjà pour ces clés)."""
+        with self._cond:
+            keys = list(self._ready)
+            self._ready.clear()
+            self._active.update(keys)
+        if keys and self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        for key in keys:
+            task = asyncio.ensure_future(self._drain(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: str):
+        async with self._slots:
+            while True:
+                with self._cond:
+                    if not self._pending.get(key):
+                        self._pending.pop(key, None)
+                        self._active.discard(key)
+                        return
+                    if self.merge is not None and self._quiet_delay(key) > 0:
+                        # Éléments arrivés pendant le traitement : la clé rend son créneau et attend d'être calme
+                        self._active.discard(key)
+                        self._schedule(key)
+                        return
+                    enqueued_at, item, trace_id = self._pop(key)
+                metrics.histogram("queue_wait_seconds", queue=self.name).observe(time.monotonic() - enqueued_at)
+                try:
+                    with tracing.trace(trace_id), tracing.span(f"queue:{self.name}"), \
+                            metrics.timed("queue_processing_seconds", queue=self.name):
+                        await self.handler(key, item)
+                    metrics.counter("queue_processed_total", queue=self.name).inc()
+                except Exception as e:
+                    metrics.counter("queue_failed_total", queue=self.name).inc()
+                    logger.exception(f"[QUEUE:{self.name}] Erreur lors du traitement pour {key} : {e}")
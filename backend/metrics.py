@@ -0,0 +1,182 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# --- Métriques de performance en mémoire (par processus) ---
+# Histogrammes de latence et compteurs, identifiés par un nom et des labels.
+
+# Bornes des buckets en secondes (de 1 ms à 30 s)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+class LatencyHistogram:
+    """Histogramme cumulatif de latences (en secondes), sûr entre threads."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)  # Dernier bucket : +Inf
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimation d'un quantile à partir des buckets (borne supérieure du bucket)."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            target = q * self.count
+            seen = 0
+            for i, count in enumerate(self._counts):
+                seen += count
+                if seen >= target:
+                    return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            count, total, maximum = self.count, self.sum, self.max
+        return {
+            "count": count,
+            "sum": round(total, 6),
+            "avg": round(total / count, 6) if count else 0.0,
+            "max": round(maximum, 6),
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+        }
+
+
+class Counter:
+    """Compteur monotone, sûr entre threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+def histogram(name: str, **labels) -> LatencyHistogram:
+    """Retourne (en le créant au besoin) l'histogramme `name` pour ces labels."""
+    key = _key(name, labels)
+    hist = _histograms.get(key)
+    if hist is None:
+        with _registry_lock:
+            hist = _histograms.setdefault(key, LatencyHistogram())
+    return hist
+
+
+def counter(name: str, **labels) -> Counter:
+    """Retourne (en le créant au besoin) le compteur `name` pour ces labels."""
+    key = _key(name, labels)
+    c = _counters.get(key)
+    if c is None:
+        with _registry_lock:
+            c = _counters.setdefault(key, Counter())
+    return c
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Mesure la durée du bloc et l'enregistre dans l'histogramme `name`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram(name, **labels).observe(time.perf_counter() - t0)
+
+
+def snapshot(prefix: str = "") -> dict:
+    """Retourne l'état de toutes les métriques dont le nom commence par `prefix`."""
+    with _registry_lock:
+        histograms = list(_histograms.items())
+        counters = list(_counters.items())
+    result = {}
+    for (name, labels), hist in histograms:
+        if name.startswith(prefix):
+            result.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = hist.snapshot()
+    for (name, labels), c in counters:
+        if name.startswith(prefix):
+            result.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = c.value
+    return result
+
+
+# --- Jauges (valeurs lues au moment de l'export) ---
+def gauge(name: str, read, **labels):
+    """Déclare une jauge dont la valeur est donnée par `read()` à chaque export."""
+    with _registry_lock:
+        _gauges[_key(name, labels)] = read
+
+
+# --- Export au format texte Prometheus ---
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()) -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in tuple(labels) + tuple(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render_prometheus() -> str:
+    """Toutes les métriques au format d'exposition texte de Prometheus (version 0.0.4)."""
+    with _registry_lock:
+        histograms = sorted(_histograms.items(), key=lambda item: item[0])
+        counters = sorted(_counters.items(), key=lambda item: item[0])
+        gauges = sorted(_gauges.items(), key=lambda item: item[0])
+    lines = []
+    declared = set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), hist in histograms:
+        declare(name, "histogram")
+        with hist._lock:
+            counts, count, total = list(hist._counts), hist.count, hist.sum
+        cumulative = 0
+        for bound, bucket_count in zip([str(b) for b in hist.buckets] + ["+Inf"], counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+    for (name, labels), c in counters:
+        declare(name, "counter")
+        lines.append(f"{name}{_labels(labels)} {c.value}")
+    for (name, labels), read in gauges:
+        try:
+            value = read()
+        except Exception:
+            continue
+        declare(name, "gauge")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
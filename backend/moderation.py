@@ -0,0 +1,187 @@
+import contextvars
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+MODERATION_CACHE_SIZE = int(os.getenv("MODERATION_CACHE_SIZE", "5000"))
+MODERATION_CACHE_TTL = int(os.getenv("MODERATION_CACHE_TTL", str(24 * 3600)))
+# Modération du message entrant en parallèle de l'appel à l'agent (WhatsApp)
+MODERATION_PARALLEL = os.getenv("MODERATION_PARALLEL", "false").lower() == "true"
+
+# --- Pré-classification locale (sans appel LLM) ---
+# Messages courants et manifestement sûrs : salutations, oui/non, heures, dates, emails, téléphones.
+_SAFE_WORDS = (
+    r"oui|non|ok|okay|d'accord|daccord|merci|bonjour|bonsoir|salut|hello|yes|no|confirmer|je confirme|"
+    r"parfait|super|tres bien|c'est bon|bonne journee|au revoir|rdv|rendez-vous|demain|apres-demain|"
+    r"lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|prochain|matin|apres-midi|soir|a|le|la|"
+    r"detartrage|extraction|consultation|orthodontie|blanchiment|carie|caries|prothese|douleur"
+)
+_SAFE_TOKEN = (
+    rf"(?:{_SAFE_WORDS}"
+    r"|\d{1,2}\s*h\s*\d{0,2}"                                 # 10h, 10h30
+    r"|\d{1,2}[:/.-]\d{1,2}(?:[:/.-]\d{2,4})?"                # 10:30, 25/12, 25/12/2024
+    r"|[\w.+-]+@[\w-]+(?:\.[\w-]+)+"                          # email
+    r"|\+?\d[\d\s-]{6,16}\d)"                                 # téléphone
+)
+# Chaque mot (ou groupe d'au plus SAFE_PHRASE_WORDS mots : « je confirme », « 10 h 30 »,
+# « +221 77 123 45 67 ») doit correspondre entièrement à un élément sûr : pas de quantificateur
+# imbriqué sur tout le texte, donc pas de retour arrière exponentiel, et pas de mots accolés.
+SAFE_TOKEN_PATTERN = re.compile(_SAFE_TOKEN)
+SAFE_PHRASE_WORDS = 5
+_WORD_SEPARATORS = re.compile(r"[\s,!?;]+")
+
+# Contenus manifestement dangereux, bloqués sans appel LLM
+DENY_PATTERN = re.compile(
+    r"\b(?:bombes?|explosifs?|me suicider|suicide|me tuer|terroris\w*|pedophil\w*|pornograph\w*)\b"
+)
+
+
+def normalize_text(text: str) -> str:
+    """Minuscules, sans accents, espaces réduits : clé de cache et entrée du pré-classifieur."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.replace("’", "'")
+    return " ".join(text.split()).strip(" .!?,;")
+
+
+def pre_classify(normalized: str) -> Optional[bool]:
+    """True (sûr), False (dangereux) ou None si un avis du modèle de garde est nécessaire."""
+    if DENY_PATTERN.search(normalized):
+        return False
+    if len(normalized) <= 120 and _only_safe_words(normalized):
+        return True
+    return None
+
+
+def _only_safe_words(normalized: str) -> bool:
+    words = [word.strip(".") for word in _WORD_SEPARATORS.split(normalized)]
+    words = [word for word in words if word]
+    i = 0
+    while i < len(words):
+        for size in range(min(SAFE_PHRASE_WORDS, len(words) - i), 0, -1):
+            if SAFE_TOKEN_PATTERN.fullmatch(" ".join(words[i:i + size])):
+                i += size
+                break
+        else:
+            return False
+    return bool(words)
+
+
+class ModerationCache:
+    """Cache LRU à durée de vie des verdicts de modération, indexé par texte normalisé."""
+
+    def __init__(self, max_entries: int = MODERATION_CACHE_SIZE, ttl: int = MODERATION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bool]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, verdict: bool):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache = ModerationCache()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _known_verdict(normalized: str) -> Optional[bool]:
+    """Verdict sans appel au modèle de garde : pré-classifieur local, puis cache."""
+    verdict = pre_classify(normalized)
+    if verdict is not None:
+        metrics.counter("moderation_verdicts_total", source="allowlist" if verdict else "denylist").inc()
+        return verdict
+
+    verdict = _cache.get(normalized)
+    if verdict is not None:
+        metrics.counter("moderation_verdicts_total", source="cache").inc()
+    return verdict
+
+
+def _store_verdict(normalized: str, verdict: bool, seconds: float):
+    metrics.histogram("moderation_llm_seconds").observe(seconds)
+    metrics.counter("moderation_verdicts_total", source="llm").inc()
+    _cache.put(normalized, verdict)
+
+
+def check(text: str, classify) -> bool:
+    """
+    Retourne le verdict de modération de `text` (True si sûr).
+    Ordre : pré-classifieur local, cache, puis `classify(text)` (appel au modèle de garde).
+    Les exceptions de `classify` sont propagées et le verdict n'est alors pas mis en cache.
+    """
+    normalized = normalize_text(text)
+    verdict = _known_verdict(normalized)
+    if verdict is not None:
+        return verdict
+
+    t0 = time.perf_counter()
+    verdict = classify(text)
+    _store_verdict(normalized, verdict, time.perf_counter() - t0)
+    return verdict
+
+
+async def acheck(text: str, aclassify) -> bool:
+    """Variante asyncio de check() : `aclassify(text)` est une coroutine."""
+    normalized = normalize_text(text)
+    verdict = _known_verdict(normalized)
+    if verdict is not None:
+        return verdict
+
+    t0 = time.perf_counter()
+    verdict = await aclassify(text)
+    _store_verdict(normalized, verdict, time.perf_counter() - t0)
+    return verdict
+
+
+def submit(moderate, text: str):
+    """Lance `moderate(text)` en arrière-plan et retourne un Future (modération parallèle)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(os.getenv("MODERATION_WORKERS", "8")),
+                                               thread_name_prefix="moderation")
+    return _executor.submit(contextvars.copy_context().run, moderate, text)
+
+
+def stats() -> dict:
+    """Taux de réponses évitant le modèle de garde et latence économisée (estimée)."""
+    counts = {source: metrics.counter("moderation_verdicts_total", source=source).value
+              for source in ("allowlist", "denylist", "cache", "llm")}
+    total = sum(counts.values())
+    avoided = total - counts["llm"]
+    llm_latency = metrics.histogram("moderation_llm_seconds").snapshot()
+    return {
+        **counts,
+        "total": total,
+        "hit_rate": round(avoided / total, 4) if total else 0.0,
+        "llm_avg_seconds": llm_latency["avg"],
+        "estimated_seconds_saved": round(avoided * llm_latency["avg"], 3),
+    }
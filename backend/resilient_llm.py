@@ -0,0 +1,450 @@
+import asyncio
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+
+import metrics
+from admission import Overloaded, llm_gate
+
+# --- Configuration ---
+# Délai avant la requête de secours : quantile des latences récentes du modèle principal,
+# borné par [LLM_HEDGE_MIN_DELAY, LLM_HEDGE_MAX_DELAY] ; LLM_HEDGE_DELAY tant qu'il y a trop peu de mesures
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "3"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MAX_DELAY = float(os.getenv("LLM_HEDGE_MAX_DELAY", "10"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Disjoncteur : échecs consécutifs avant d'écarter un modèle, puis durée de mise à l'écart (s)
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Threads des appels synchrones (deux par tour au plus : principal et secours)
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "64"))
+# Appels synchrones abandonnés (perdants d'une course, encore en cours) au-delà desquels
+# aucune requête de secours n'est plus lancée : ils ne doivent pas occuper tous les threads
+LLM_MAX_ABANDONED = int(os.getenv("LLM_MAX_ABANDONED", str(LLM_HEDGE_WORKERS // 4)))
+
+_executor = None
+_executor_lock = threading.Lock()
+_abandoned = 0
+_abandoned_lock = threading.Lock()
+
+
+def _count_abandoned(delta: int):
+    global _abandoned
+    if delta:
+        with _abandoned_lock:
+            _abandoned += delta
+
+
+def abandoned_calls() -> int:
+    """Appels synchrones abandonnés dont le thread attend encore la réponse du modèle."""
+    return _abandoned
+
+
+metrics.gauge("llm_abandoned_calls", abandoned_calls)
+
+
+class ModelHealth:
+    """
+    Latences récentes et disjoncteur d'un modèle. Après `failures` échecs consécutifs le modèle
+    est écarté `reset_timeout` secondes, puis un seul appel d'essai décide de sa réintégration.
+    La latence mesurée est celle de la première réponse (premier token en streaming).
+    """
+
+    def __init__(self, name: str, failures: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET,
+                 window: int = 200):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_timeout = reset_timeout
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+        metrics.histogram("llm_model_latency_seconds", model=self.name).observe(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Quantile des latences récentes, ou None s'il y a trop peu de mesures."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def allow(self) -> bool:
+        """True si le modèle peut être appelé (disjoncteur fermé, ou appel d'essai accordé)."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(1.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                metrics.counter("llm_breaker_transitions_total", model=self.name, state="closed").inc()
+            self._failures, self._opened_at, self._probing = 0, None, False
+
+    def failure(self):
+        metrics.counter("llm_model_errors_total", model=self.name).inc()
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.failure_threshold):
+                metrics.counter("llm_breaker_transitions_total", model=self.name, state="open").inc()
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """Appel abandonné avant toute réponse : ni succès ni échec."""
+        with self._lock:
+            self._probing = False
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            failures, opened_at = self._failures, self._opened_at
+        return {
+            "state": "closed" if opened_at is None else "open",
+            "consecutive_failures": failures,
+            "p95": self.quantile(0.95),
+            "latency_seconds": metrics.histogram("llm_model_latency_seconds", model=self.name).snapshot(),
+        }
+
+
+_health = {}
+_health_lock = threading.Lock()
+
+
+def get_model_health(name: str) -> ModelHealth:
+    """Retourne l'état de santé du modèle `name`, partagé par le processus."""
+    health = _health.get(name)
+    if health is None:
+        with _health_lock:
+            health = _health.get(name)
+            if health is None:
+                health = _health[name] = ModelHealth(name)
+                metrics.gauge("llm_circuit_open", lambda: int(health.is_open()), model=name)
+    return health
+
+
+def stats() -> dict:
+    return {name: health.stats() for name, health in list(_health.items())}
+
+
+def _model_name(model: BaseChatModel) -> str:
+    return getattr(model, "model_name", None) or model._llm_type
+
+
+class _Attempts:
+    """
+    Tentatives synchrones d'un même appel. Un thread bloqué dans une requête HTTP ne peut pas être
+    interrompu : une tentative abandonnée continue jusqu'à la réponse du modèle. Elle est comptée
+    dans `_abandoned`, et la place de llm_gate prise par la requête de secours n'est rendue qu'à la
+    fin de toutes les tentatives (le nombre d'appels réellement en cours reste dans la limite).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running = {}  # id(modèle) -> événement d'abandon
+        self._extra_slot = False
+
+    def start(self, model, extra_slot: bool = False) -> threading.Event:
+        with self._lock:
+            self._running[id(model)] = cancelled = threading.Event()
+            self._extra_slot = self._extra_slot or extra_slot
+        return cancelled
+
+    def cancel(self, keep=None):
+        """Abandonne les tentatives en cours, sauf celle du modèle d'identifiant `keep`."""
+        with self._lock:
+            losers = [cancelled for key, cancelled in self._running.items() if key != keep and not cancelled.is_set()]
+            for cancelled in losers:
+                cancelled.set()
+        _count_abandoned(len(losers))
+
+    def finish(self, model):
+        """Fin d'une tentative (appelé par son thread)."""
+        with self._lock:
+            abandoned = self._running.pop(id(model)).is_set()
+            release = self._extra_slot and not self._running
+            if release:
+                self._extra_slot = False
+        _count_abandoned(-1 if abandoned else 0)
+        if release:
+            llm_gate.release()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+    return _executor
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Modèle conversationnel tolérant aux lenteurs et aux pannes : si le modèle principal n'a pas
+    répondu (premier token) dans son délai habituel, la même requête part vers le modèle de
+    secours et la première réponse l'emporte, l'autre appel étant abandonné. Un modèle en échec
+    répété est écarté par son disjoncteur ; une erreur avant toute réponse bascule sur l'autre.
+    La requête de secours occupe sa propre place de llm_gate (prise sans attendre, sinon pas de
+    secours) : le tour appelant ne détient qu'une place pour deux appels simultanés.
+    """
+
+    primary: BaseChatModel
+    fallback: Optional[BaseChatModel] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "resilient-chat"
+
+    @property
+    def model_name(self) -> str:
+        # Nom du modèle principal : les spans `llm:<modèle>` restent ceux du modèle appelé en premier
+        return _model_name(self.primary)
+
+    @property
+    def _identifying_params(self) -> dict:
+        return {"primary": self.primary._identifying_params,
+                "fallback": self.fallback._identifying_params if self.fallback is not None else None}
+
+    def bind_tools(self, tools, **kwargs):
+        # Les deux modèles reçoivent les outils au format du modèle principal (même famille d'API)
+        bound = self.primary.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+    def _candidates(self) -> list:
+        models = [self.primary] + ([self.fallback] if self.fallback is not None else [])
+        return [(model, get_model_health(_model_name(model))) for model in models]
+
+    def _hedge_delay(self, health: ModelHealth) -> float:
+        observed = health.quantile(LLM_HEDGE_QUANTILE)
+        if observed is None:
+            return LLM_HEDGE_DELAY
+        return min(LLM_HEDGE_MAX_DELAY, max(LLM_HEDGE_MIN_DELAY, observed))
+
+    def _unavailable(self, candidates: list) -> Overloaded:
+        # Tous les modèles sont écartés : réponse « réessayez » immédiate (voir admission.py)
+        metrics.counter("admission_rejected_total", gate="llm", reason="circuit_open").inc()
+        return Overloaded("circuit_open", retry_after=min(health.retry_after() for _, health in candidates))
+
+    # --- Appels synchrones (threads) ---
+    def _pump(self, model, health: ModelHealth, items, events: queue.Queue, cancelled: threading.Event,
+              attempts: _Attempts):
+        t0 = time.perf_counter()
+        answered = False
+        try:
+            for item in items:
+                if not answered:
+                    answered = True
+                    health.observe(time.perf_counter() - t0)
+                if cancelled.is_set():
+                    break  # Une autre tentative a répondu la première
+                events.put(("item", model, item))
+            else:
+                events.put(("end", model, None))
+            health.success()
+        except Exception as e:
+            health.failure()
+            events.put(("error", model, e))
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+            attempts.finish(model)
+
+    def _race(self, start):
+        """Éléments de la tentative qui répond la première ; `start(model)` retourne un itérateur."""
+        candidates = self._candidates()
+        waiting = list(candidates)
+        events = queue.Queue()
+        attempts = _Attempts()
+        running = set()  # Modèles dont la tentative peut encore répondre
+
+        def launch(extra_slot: bool = False) -> bool:
+            while waiting:
+                model, health = waiting.pop(0)
+                if health.allow():
+                    running.add(id(model))
+                    cancelled = attempts.start(model, extra_slot)
+                    _get_executor().submit(contextvars.copy_context().run, self._pump, model, health,
+                                           start(model), events, cancelled, attempts)
+                    return True
+            return False
+
+        if not launch():
+            raise self._unavailable(candidates)
+        first = next(model for model, _ in candidates if id(model) in running)
+        hedge_at = time.monotonic() + self._hedge_delay(get_model_health(_model_name(first)))
+        winner, hedged = None, False
+        try:
+            while True:
+                timeout = None
+                if winner is None and waiting and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    kind, model, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None  # Une seule requête de secours par appel
+                    if abandoned_calls() >= LLM_MAX_ABANDONED or not llm_gate.try_acquire():
+                        metrics.counter("llm_hedge_skipped_total").inc()
+                    elif launch(extra_slot=True):
+                        hedged = True
+                        metrics.counter("llm_hedged_total").inc()
+                    else:
+                        llm_gate.release()
+                    continue
+                if winner is None and kind != "error":
+                    winner = id(model)
+                    if hedged and model is not first:
+                        metrics.counter("llm_hedge_wins_total", model=_model_name(model)).inc()
+                    attempts.cancel(keep=winner)
+                if winner is not None and id(model) != winner:
+                    continue
+                if kind == "item":
+                    yield value
+                elif kind == "end":
+                    return
+                else:
+                    running.discard(id(model))
+                    if winner is not None:
+                        raise value  # Réponse déjà commencée : pas de bascule en cours de route
+                    if launch():
+                        metrics.counter("llm_failovers_total").inc()
+                    elif not running:
+                        raise value
+        finally:
+            attempts.cancel()
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        def start(model):
+            yield model._generate(messages, stop=stop, **kwargs)
+        return list(self._race(start))[0]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for chunk in self._race(lambda model: model._stream(messages, stop=stop, **kwargs)):
+            if run_manager is not None:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    # --- Appels asynchrones (boucle d'événements, mode async_app) ---
+    async def _apump(self, model, health: ModelHealth, items, events: asyncio.Queue):
+        t0 = time.perf_counter()
+        answered = False
+        try:
+            async for item in items:
+                if not answered:
+                    answered = True
+                    health.observe(time.perf_counter() - t0)
+                events.put_nowait(("item", model, item))
+            events.put_nowait(("end", model, None))
+            health.success()
+        except asyncio.CancelledError:
+            # Abandonnée au profit d'une autre tentative
+            if answered:
+                health.success()
+            else:
+                health.release()
+            raise
+        except Exception as e:
+            health.failure()
+            events.put_nowait(("error", model, e))
+
+    async def _arace(self, start):
+        """Variante asyncio de _race : la tentative perdante est annulée (sa requête HTTP fermée)."""
+        candidates = self._candidates()
+        waiting = list(candidates)
+        events = asyncio.Queue()
+        running = {}  # Modèle -> tâche
+
+        def launch() -> bool:
+            while waiting:
+                model, health = waiting.pop(0)
+                if health.allow():
+                    running[id(model)] = asyncio.ensure_future(self._apump(model, health, start(model), events))
+                    return True
+            return False
+
+        if not launch():
+            raise self._unavailable(candidates)
+        first = next(model for model, _ in candidates if id(model) in running)
+        hedge_at = time.monotonic() + self._hedge_delay(get_model_health(_model_name(first)))
+        winner, hedged, extra_slot = None, False, False
+        try:
+            while True:
+                timeout = None
+                if winner is None and waiting and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    kind, model, value = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    hedge_at = None
+                    if not llm_gate.try_acquire():
+                        metrics.counter("llm_hedge_skipped_total").inc()
+                    elif launch():
+                        hedged = extra_slot = True
+                        metrics.counter("llm_hedged_total").inc()
+                    else:
+                        llm_gate.release()
+                    continue
+                if winner is None and kind != "error":
+                    winner = id(model)
+                    if hedged and model is not first:
+                        metrics.counter("llm_hedge_wins_total", model=_model_name(model)).inc()
+                    for key, task in running.items():
+                        if key != winner:
+                            task.cancel()
+                if winner is not None and id(model) != winner:
+                    continue
+                if kind == "item":
+                    yield value
+                elif kind == "end":
+                    return
+                else:
+                    running.pop(id(model), None)
+                    if winner is not None:
+                        raise value
+                    if launch():
+                        metrics.counter("llm_failovers_total").inc()
+                    elif not running:
+                        raise value
+        finally:
+            for task in running.values():
+                task.cancel()
+            if extra_slot:
+                llm_gate.release()  # Les tentatives annulées s'arrêtent à leur prochaine attente
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        async def start(model):
+            yield await model._agenerate(messages, stop=stop, **kwargs)
+        return [result async for result in self._arace(start)][0]
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        async for chunk in self._arace(lambda model: model._astream(messages, stop=stop, **kwargs)):
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
@@ -0,0 +1,328 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import urlparse
+
+from conversation_memory import memory_from_state, memory_to_state, new_memory
+from slot_extraction import SlotTracker
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# SESSION_STORE_BACKEND : "memory" (défaut), "sqlite" (plusieurs workers sur un même hôte) ou "redis"
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", os.path.join(os.path.dirname(__file__), ".sessions.db"))
+SESSION_REDIS_URL = os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")
+# Threads des accès bloquants (stockage SQLite/Redis, file de tâches) en mode async_app
+SESSION_IO_THREADS = int(os.getenv("SESSION_IO_THREADS", "16"))
+
+
+class SessionStore:
+    """Interface commune des stockages de sessions (états sérialisés en JSON)."""
+
+    def load(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save(self, key: str, state: dict):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Stockage en mémoire du processus, borné en nombre d'entrées et en octets.
+    Éviction LRU et expiration (TTL) à la lecture comme à l'écriture.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL_SECONDS, max_entries: int = SESSION_MAX_ENTRIES,
+                 max_bytes: int = SESSION_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clé -> (expiration, payload JSON)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _pop(self, key):
+        _, payload = self._entries.pop(key)
+        self._bytes -= len(payload)
+
+    def load(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._pop(key)
+                return None
+            self._entries.move_to_end(key)
+            payload = entry[1]
+        return json.loads(payload)
+
+    def save(self, key, state):
+        payload = json.dumps(state, ensure_ascii=False)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (time.time() + self.ttl, payload)
+            self._bytes += len(payload)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                evicted = next(iter(self._entries))
+                self._pop(evicted)
+                logger.info(f"[SESSION_STORE] Session évincée (LRU) : {evicted}")
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Stockage SQLite (mode WAL) partagé par les workers d'un même hôte.
+    Expiration par TTL et éviction LRU sur la date de dernier accès.
+    """
+
+    def __init__(self, path: str = SESSION_SQLITE_PATH, ttl: int = SESSION_TTL_SECONDS,
+                 max_entries: int = SESSION_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_accessed_at ON sessions (accessed_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT payload, expires_at FROM sessions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            with conn:
+                conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            return None
+        with conn:
+            conn.execute("UPDATE sessions SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def save(self, key, state):
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (key, payload, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(state, ensure_ascii=False), now + self.ttl, now),
+            )
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % 100 == 0
+        if evict:
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """Supprime les sessions expirées puis les moins récemment utilisées au-delà de la limite."""
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+            conn.execute(
+                "DELETE FROM sessions WHERE key IN ("
+                "SELECT key FROM sessions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Stockage via le protocole Redis (RESP), sans dépendance supplémentaire.
+    Le TTL est porté par chaque clé (SET ... PX) ; l'éviction LRU relève de la
+    politique `maxmemory-policy allkeys-lru` du serveur.
+    """
+
+    def __init__(self, url: str = SESSION_REDIS_URL, ttl: int = SESSION_TTL_SECONDS, prefix: str = "session:",
+                 timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # --- Client RESP minimal (une connexion par thread) ---
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        try:
+            if self.password:
+                self._send("AUTH", self.password)
+            if self.db:
+                self._send("SELECT", self.db)
+        except Exception:
+            # Connexion non authentifiée ou sur la mauvaise base : jamais réutilisée
+            self._close()
+            raise
+
+    def _close(self):
+        for resource in (getattr(self._local, "reader", None), getattr(self._local, "sock", None)):
+            if resource is not None:
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+        self._local.sock = self._local.reader = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connexion Redis fermée")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise RuntimeError(f"Erreur Redis : {body.decode()}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [self._read_reply() for _ in range(int(body))]
+        raise RuntimeError(f"Réponse Redis inattendue : {line!r}")
+
+    def _command(self, *args):
+        for attempt in (1, 2):
+            try:
+                if getattr(self._local, "sock", None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt == 2:
+                    raise
+
+    def load(self, key):
+        payload = self._command("GET", self.prefix + key)
+        return json.loads(payload) if payload is not None else None
+
+    def save(self, key, state):
+        self._command("SET", self.prefix + key, json.dumps(state, ensure_ascii=False), "PX", int(self.ttl * 1000))
+
+    def delete(self, key):
+        self._command("DEL", self.prefix + key)
+
+
+_store = None
+_store_lock = threading.Lock()
+_io_executor = None
+
+
+def get_session_store() -> SessionStore:
+    """Retourne le stockage de sessions configuré par SESSION_STORE_BACKEND."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if SESSION_STORE_BACKEND == "sqlite":
+                    _store = SQLiteSessionStore()
+                elif SESSION_STORE_BACKEND == "redis":
+                    _store = RedisSessionStore()
+                else:
+                    _store = InMemorySessionStore()
+                logger.info(f"[SESSION_STORE] Stockage des sessions : {type(_store).__name__}")
+    return _store
+
+
+# --- Sessions de conversation ---
+class ConversationSession:
+    """État d'une conversation : la mémoire de l'agent et des données annexes."""
+
+    def __init__(self, key: str, memory, data: Optional[dict] = None, is_new: bool = False):
+        self.key = key
+        self.memory = memory
+        self.data = data or {}
+        self.is_new = is_new
+        # Champs du ticket suivis message par message (voir SlotTracker)
+        self.slot_tracker = SlotTracker(self.data.setdefault("slots", {}))
+
+    @property
+    def slots(self) -> dict:
+        """Champs du ticket déjà résolus, à jour après `save_session`."""
+        return self.slot_tracker.slots
+
+
+def open_session(key: str) -> ConversationSession:
+    """Charge la session `key` depuis le stockage, ou en crée une nouvelle."""
+    state = get_session_store().load(key)
+    if state is None:
+        return ConversationSession(key, new_memory(), is_new=True)
+    return ConversationSession(key, memory_from_state(state), data=state.get("data"))
+
+
+def save_session(session: ConversationSession):
+    """Sauvegarde l'état de la session dans le stockage."""
+    session.slot_tracker.sync(session.memory)
+    state = memory_to_state(session.memory)
+    state["data"] = session.data
+    get_session_store().save(session.key, state)
+    session.is_new = False
+
+
+async def run_blocking(func, *args):
+    """
+    Exécute `func(*args)` sur un thread du pool SESSION_IO_THREADS (mode async_app) : les accès
+    au stockage de sessions (SQLite, Redis) et à la file de tâches ne bloquent pas la boucle.
+    """
+    global _io_executor
+    if _io_executor is None:
+        with _store_lock:
+            if _io_executor is None:
+                _io_executor = ThreadPoolExecutor(max_workers=SESSION_IO_THREADS, thread_name_prefix="session-io")
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, contextvars.copy_context().run, func, *args)
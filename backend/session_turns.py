@@ -0,0 +1,203 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+# --- Configuration ---
+# Attente du premier message d'un lot avant le tour d'agent (s) : les messages de la même session
+# arrivés entre-temps sont fusionnés. 0 : seuls ceux arrivés pendant le tour précédent le sont.
+CHAT_COALESCE_WINDOW = float(os.getenv("CHAT_COALESCE_WINDOW", "0"))
+
+
+def merge_messages(messages: list) -> str:
+    """Messages consécutifs d'un patient, fusionnés en une seule entrée pour l'agent."""
+    return "\n".join(message.strip() for message in messages if message and message.strip())
+
+
+class _Batch:
+    """Messages fusionnés en un tour ; `done` est signalé quand le résultat est disponible."""
+
+    def __init__(self, done):
+        self.messages = []
+        self.done = done
+        self.result = None
+        self.error = None
+
+
+class _Slot:
+    """État d'une session : verrou du tour en cours, lot encore ouvert, nombre d'appelants."""
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.batch = None
+        self.users = 0
+
+
+class SessionTurns:
+    """
+    Un seul tour d'agent à la fois par session (la mémoire n'est jamais modifiée par deux tours
+    concurrents), et fusion des messages rapprochés : le premier message d'un lot attend `window`
+    secondes puis le verrou de la session, et exécute un tour unique pour tous les messages
+    arrivés entre-temps ; chaque appelant du lot reçoit le même résultat.
+    Le verrou est propre au processus : les messages d'une session doivent arriver au même worker.
+    """
+
+    def __init__(self, window: float = CHAT_COALESCE_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._slots = {}
+
+    def _enter(self, key: str) -> _Slot:
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = _Slot(threading.Lock())
+            slot.users += 1
+            return slot
+
+    def _leave(self, key: str, slot: _Slot):
+        with self._lock:
+            slot.users -= 1
+            if not slot.users:
+                del self._slots[key]
+
+    def _close(self, slot: _Slot, batch: _Batch):
+        # Les messages suivants ouvrent un nouveau lot
+        with self._lock:
+            if slot.batch is batch:
+                slot.batch = None
+
+    @contextmanager
+    def lock(self, key: str):
+        """Tour exclusif sur la session, sans fusion (ex. réponse diffusée en streaming)."""
+        slot = self._enter(key)
+        try:
+            t0 = time.perf_counter()
+            with slot.lock:
+                metrics.histogram("session_turn_wait_seconds").observe(time.perf_counter() - t0)
+                yield
+        finally:
+            self._leave(key, slot)
+
+    def run(self, key: str, message: str, turn):
+        """Exécute `turn(messages fusionnés)` pour le lot de `message` et retourne son résultat."""
+        slot = self._enter(key)
+        try:
+            with self._lock:
+                batch, leader = slot.batch, slot.batch is None
+                if leader:
+                    batch = slot.batch = _Batch(threading.Event())
+                batch.messages.append(message)
+            if leader:
+                try:
+                    if self.window:
+                        time.sleep(self.window)
+                    t0 = time.perf_counter()
+                    with slot.lock:
+                        metrics.histogram("session_turn_wait_seconds").observe(time.perf_counter() - t0)
+                        self._close(slot, batch)
+                        metrics.counter("session_turns_total").inc()
+                        batch.result = turn(merge_messages(batch.messages))
+                except BaseException as e:
+                    batch.error = e  # Transmise aux autres appelants du lot
+                finally:
+                    self._close(slot, batch)
+                    batch.done.set()
+            else:
+                metrics.counter("session_turns_coalesced_total").inc()
+                batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            return batch.result
+        finally:
+            self._leave(key, slot)
+
+
+class AsyncSessionTurns(SessionTurns):
+    """Variante asyncio de SessionTurns (mode async_app) : `turn` est une coroutine, l'attente n'occupe aucun thread."""
+
+    def _enter(self, key: str) -> _Slot:
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot(asyncio.Lock())
+        slot.users += 1
+        return slot
+
+    def _leave(self, key: str, slot: _Slot):
+        slot.users -= 1
+        if not slot.users:
+            del self._slots[key]
+
+    def _close(self, slot: _Slot, batch: _Batch):
+        if slot.batch is batch:
+            slot.batch = None
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        slot = self._enter(key)
+        try:
+            t0 = time.perf_counter()
+            async with slot.lock:
+                metrics.histogram("session_turn_wait_seconds").observe(time.perf_counter() - t0)
+                yield
+        finally:
+            self._leave(key, slot)
+
+    async def run(self, key: str, message: str, turn):
+        slot = self._enter(key)
+        try:
+            batch, leader = slot.batch, slot.batch is None
+            if leader:
+                batch = slot.batch = _Batch(asyncio.Event())
+            batch.messages.append(message)
+            if leader:
+                try:
+                    if self.window:
+                        await asyncio.sleep(self.window)
+                    t0 = time.perf_counter()
+                    async with slot.lock:
+                        metrics.histogram("session_turn_wait_seconds").observe(time.perf_counter() - t0)
+                        self._close(slot, batch)
+                        metrics.counter("session_turns_total").inc()
+                        batch.result = await turn(merge_messages(batch.messages))
+                except BaseException as e:
+                    batch.error = e
+                finally:
+                    self._close(slot, batch)
+                    batch.done.set()
+            else:
+                metrics.counter("session_turns_coalesced_total").inc()
+                await batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            return batch.result
+        finally:
+            self._leave(key, slot)
+
+
+_turns = None
+_async_turns = None
+_turns_lock = threading.Lock()
+
+
+def get_session_turns() -> SessionTurns:
+    """Retourne le coordinateur des tours partagé par le processus."""
+    global _turns
+    if _turns is None:
+        with _turns_lock:
+            if _turns is None:
+                _turns = SessionTurns()
+    return _turns
+
+
+def get_async_session_turns() -> AsyncSessionTurns:
+    """Retourne le coordinateur asyncio des tours (mode async_app)."""
+    global _async_turns
+    if _async_turns is None:
+        with _turns_lock:
+            if _async_turns is None:
+                _async_turns = AsyncSessionTurns()
+    return _async_turns
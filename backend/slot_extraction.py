@@ -0,0 +1,214 @@
+import datetime
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Champs de TicketData collectés au fil de la conversation
+SLOT_KEYS = ["name", "email", "phone", "service_type", "proposed_date", "proposed_time"]
+
+# --- Motifs précompilés ---
+EMAIL_PATTERN = re.compile(r"[\w\.-]+@[\w\.-]+\.\w+")
+PHONE_PATTERN = re.compile(r"(?:\+221)?\s*(\d{2,3}[\s\-]?\d{3}[\s\-]?\d{3,4})")
+NAME_PATTERN = re.compile(r"(?:je m'appelle|nom est|je suis)\s*([A-Za-zÀ-ÿ\- ]+)", re.IGNORECASE)
+NAME_LABEL_PATTERN = re.compile(r"nom[:\s]+([A-Za-zÀ-ÿ\- ]+)", re.IGNORECASE)
+NAME_EXCLUDED_PATTERN = re.compile(r"@|tel|mail|soin|rdv|rendez-vous|demain|lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche|\d", re.IGNORECASE)
+SERVICE_PATTERN = re.compile(r"(détartrage|extraction|consultation|orthodontie|blanchiment|carie[s]?|prothèse[s]?|parodontologie|cavité[s]?|douleur[s]?|mal de dents?)", re.IGNORECASE)
+TIME_PATTERN = re.compile(r"(\d{1,2})h(\d{0,2})")
+NEXT_WEEKDAY_PATTERN = re.compile(r'(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche) prochain')
+WEEKDAY_PATTERN = re.compile(r'(lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche)')
+NUMERIC_DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{2,4})')
+
+# Indices signalant qu'un message peut contenir un champ : un seul parcours du texte
+# pour savoir quelles extractions lancer (mêmes conditions que extract_user_data_from_messages)
+TRIGGER_PATTERN = re.compile(
+    r"(?P<email>@)|(?P<phone>77|tel|tél|\+)|(?P<name>je m'appelle|nom)"
+    r"|(?P<proposed_date>demain|/|lundi|mardi|mercredi|jeudi|vendredi|samedi|dimanche)"
+)
+
+# --- Fonctions d'extraction d'infos utilisateur ---
+def extract_email(text):
+    match = EMAIL_PATTERN.search(text)
+    return match.group(0) if match else ""
+
+def extract_phone(text):
+    match = PHONE_PATTERN.search(text)
+    return match.group(1).replace(" ", "").replace("-", "") if match else ""
+
+def extract_name(text):
+    # Cherche les formulations classiques
+    match = NAME_PATTERN.search(text)
+    if match:
+        return match.group(1).strip()
+    # Sinon, tente de trouver un prénom/nom isolé (ex: "Nom: Wade" ou juste "Wade")
+    match = NAME_LABEL_PATTERN.search(text)
+    if match:
+        return match.group(1).strip()
+    # Si le message ne contient qu'un mot (et que ce n'est pas un mot-clé), on suppose que c'est le nom
+    words = text.strip().split()
+    if len(words) == 1 and len(words[0]) > 2 and not NAME_EXCLUDED_PATTERN.search(words[0]):
+        return words[0]
+    return ""
+
+def extract_service_type(text):
+    # Amélioration de la regex pour mieux capturer les types de soins
+    match = SERVICE_PATTERN.search(text)
+    if match:
+        service = match.group(1).capitalize()
+        # Normalisation des termes
+        if service.lower() in ["carie", "caries", "cavité", "cavités"]:
+            return "Carie"
+        elif service.lower() in ["douleur", "douleurs", "mal de dents"]:
+            return "Douleur"
+        else:
+            return service
+    return "Consultation"
+
+def extract_time(text):
+    match = TIME_PATTERN.search(text)
+    if match:
+        return f"{match.group(1)}h{match.group(2) if match.group(2) else '00'}"
+    return ""
+
+def extract_date(text):
+    text = text.lower()
+    today = datetime.date.today()
+    jours = {
+        'lundi': 0, 'mardi': 1, 'mercredi': 2, 'jeudi': 3, 'vendredi': 4, 'samedi': 5, 'dimanche': 6
+    }
+    # 1. Demain, après-demain
+    if 'après-demain' in text or 'apres-demain' in text:
+        return (today + datetime.timedelta(days=2)).strftime('%Y-%m-%d')
+    if 'demain' in text:
+        return (today + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    # 2. samedi prochain, lundi prochain, etc.
+    match = NEXT_WEEKDAY_PATTERN.search(text)
+    if match:
+        jour = match.group(1)
+        target = jours[jour]
+        days_ahead = (target - today.weekday() + 7) % 7
+        if days_ahead == 0:
+            days_ahead = 7
+        return (today + datetime.timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+    # 3. juste samedi, lundi, etc.
+    match = WEEKDAY_PATTERN.search(text)
+    if match:
+        jour = match.group(1)
+        target = jours[jour]
+        days_ahead = (target - today.weekday() + 7) % 7
+        if days_ahead == 0:
+            days_ahead = 7
+        return (today + datetime.timedelta(days=days_ahead)).strftime('%Y-%m-%d')
+    # 4. format date classique (ex: 25/12/2024)
+    match = NUMERIC_DATE_PATTERN.search(text)
+    if match:
+        day, month, year = match.groups()
+        if len(year) == 2:
+            year = '20' + year
+        try:
+            date = datetime.date(int(year), int(month), int(day))
+            return date.strftime('%Y-%m-%d')
+        except:
+            return ''
+    return ''
+
+
+def extract_user_data_from_messages(messages) -> dict:
+    """Extraction naïve des informations du ticket, du message le plus récent au plus ancien."""
+    user_data = {"name": "", "email": "", "phone": "", "service_type": "", "proposed_date": "", "proposed_time": ""}
+
+    logger.debug(f"[SLOTS] Extraction des données utilisateur depuis {len(messages)} messages")
+    
+    for i, msg in enumerate(reversed(messages)):
+        content = msg.content.lower()
+        logger.debug(f"[SLOTS] Message {i}: {content[:100]}...")
+        
+        if not user_data["email"] and "@" in content:
+            user_data["email"] = extract_email(content)
+            logger.debug(f"[SLOTS] Email extrait: {user_data['email']}")
+            
+        if not user_data["phone"] and any(x in content for x in ["77", "tel", "tél", "+"]):
+            user_data["phone"] = extract_phone(content)
+            logger.debug(f"[SLOTS] Téléphone extrait: {user_data['phone']}")
+            
+        if not user_data["name"] and ("je m'appelle" in content or "nom" in content):
+            user_data["name"] = extract_name(content)
+            logger.debug(f"[SLOTS] Nom extrait: {user_data['name']}")
+            
+        # Amélioration : chercher le type de soin dans TOUS les messages, pas seulement ceux contenant "soin"
+        if not user_data["service_type"]:
+            extracted_service = extract_service_type(content)
+            if extracted_service and extracted_service != "Consultation":
+                user_data["service_type"] = extracted_service
+                logger.debug(f"[SLOTS] Type de soin extrait: {user_data['service_type']}")
+                
+        if not user_data["proposed_time"] and "h" in content:
+            user_data["proposed_time"] = extract_time(content)
+            logger.debug(f"[SLOTS] Heure extraite: {user_data['proposed_time']}")
+            
+        if not user_data["proposed_date"] and any(x in content for x in ["demain", "/", "lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche"]):
+            user_data["proposed_date"] = extract_date(content)
+            logger.debug(f"[SLOTS] Date extraite: {user_data['proposed_date']}")
+
+    return user_data
+
+
+class SlotTracker:
+    """
+    État des champs du ticket d'une session, mis à jour à chaque nouveau message.
+
+    Chaque message n'est analysé qu'une fois ; la valeur la plus récente de chaque champ
+    l'emporte (même résultat que extract_user_data_from_messages sur les mêmes messages).
+    `state` est un dict sérialisable, conservé dans les données de la session.
+    """
+
+    def __init__(self, state: dict = None):
+        self.state = state if state is not None else {}
+        self.state.setdefault("values", {key: "" for key in SLOT_KEYS})
+        self.state.setdefault("seen", 0)
+
+    @property
+    def slots(self) -> dict:
+        return self.state["values"]
+
+    def observe(self, text: str) -> list:
+        """Analyse un message ; retourne la liste des champs mis à jour."""
+        content = text.lower()
+        values = self.slots
+        found = {match.lastgroup for match in TRIGGER_PATTERN.finditer(content)}
+        extracted = {}
+        if "email" in found:
+            extracted["email"] = extract_email(content)
+        if "phone" in found:
+            extracted["phone"] = extract_phone(content)
+        if "name" in found:
+            extracted["name"] = extract_name(content)
+        if "proposed_date" in found:
+            extracted["proposed_date"] = extract_date(content)
+        if "h" in content:
+            extracted["proposed_time"] = extract_time(content)
+        service = extract_service_type(content)
+        if service != "Consultation":
+            extracted["service_type"] = service
+        updated = [key for key, value in extracted.items() if value and values.get(key) != value]
+        for key in updated:
+            values[key] = extracted[key]
+        return updated
+
+    def sync(self, memory) -> list:
+        """
+        Analyse les messages du patient ajoutés à la mémoire depuis le dernier appel ; retourne les
+        champs mis à jour. Les réponses de l'assistant (FAQ, récapitulatifs) sont ignorées : une
+        date ou une heure qu'elles mentionnent (ex. les horaires d'ouverture) n'est pas un choix du patient.
+        """
+        messages = memory.chat_memory.messages
+        # Les messages repliés dans le résumé (TokenBudgetMemory) comptent dans la position
+        total = getattr(memory, "folded_messages", 0) + len(messages)
+        new_count = min(total - self.state["seen"], len(messages))
+        updated = []
+        if new_count > 0:
+            for message in messages[-new_count:]:
+                if message.type == "human":
+                    updated.extend(self.observe(str(message.content)))
+        self.state["seen"] = total
+        return updated
@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Préchauffage en arrière-plan (modèles, agent, Supabase, Calendar) dès le chargement du worker
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() == "true"
+
+# Référence des durées : import de ce module, en tête de app.py
+_t0 = time.perf_counter()
+_last_mark = _t0
+_lock = threading.Lock()
+_phases = []  # Phases dans l'ordre : nom, début (s depuis _t0), durée, thread, statut
+_warmup_done = threading.Event()
+_warmup_state = "disabled"
+
+
+def _record(name: str, start: float, seconds: float, status: str = "ok"):
+    metrics.histogram("startup_phase_seconds", phase=name).observe(seconds)
+    with _lock:
+        _phases.append({
+            "phase": name,
+            "start_s": round(start - _t0, 3),
+            "seconds": round(seconds, 3),
+            "thread": threading.current_thread().name,
+            "status": status,
+        })
+
+
+def mark(name: str):
+    """Clôt une phase séquentielle du démarrage (depuis la marque précédente)."""
+    global _last_mark
+    now = time.perf_counter()
+    with _lock:
+        start, _last_mark = _last_mark, now
+    _record(name, start, now - start)
+
+
+@contextmanager
+def phase(name: str):
+    """Mesure une phase du démarrage (ex. une étape du préchauffage)."""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _record(name, start, time.perf_counter() - start, status)
+
+
+def start_warmup(steps: list) -> threading.Thread:
+    """
+    Exécute les étapes (nom, fonction) dans un thread de fond : les clients lourds sont prêts
+    avant les premières requêtes sans retarder la disponibilité du worker. Une étape en échec
+    est journalisée et sera refaite au premier usage.
+    """
+    global _warmup_state
+    _warmup_state = "running"
+
+    def run():
+        global _warmup_state
+        start = time.perf_counter()
+        for name, step in steps:
+            try:
+                with phase(f"warmup:{name}"):
+                    step()
+            except Exception as e:
+                logger.warning(f"[STARTUP] Préchauffage '{name}' en échec : {e}")
+        _record("warmup", start, time.perf_counter() - start)
+        _warmup_state = "done"
+        _warmup_done.set()
+        logger.info(f"[STARTUP] Préchauffage terminé : {summary()}")
+
+    thread = threading.Thread(target=run, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_warmup(timeout: float = None) -> bool:
+    return _warmup_done.wait(timeout)
+
+
+def summary() -> str:
+    with _lock:
+        return ", ".join(f"{p['phase']} {1000 * p['seconds']:.0f} ms" for p in _phases)
+
+
+def report() -> dict:
+    """Durée de chaque phase du démarrage et état du préchauffage."""
+    with _lock:
+        phases = list(_phases)
+    return {
+        "uptime_s": round(time.perf_counter() - _t0, 3),
+        "warmup": _warmup_state,
+        "phases": phases,
+    }
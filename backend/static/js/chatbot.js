@@ -2,6 +2,7 @@
 const API_ENDPOINT = '/api/chat';
 const TYPING_DELAY = 1000;
 const REASONING_DISPLAY_DURATION = 1800; // Durée d'affichage de la réflexion en ms
+const STREAM_RESPONSES = true; // Réponses diffusées token par token (Server-Sent Events)
 
 // Éléments DOM
 const chatbox = document.getElementById('chatbox');
@@ -86,6 +87,30 @@ function removeTypingIndicator(indicator) {
   }
 }
 
+// Lecture d'un flux Server-Sent Events reçu en réponse à un POST (EventSource ne gère que GET)
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let dataLines = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      }
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join('\n')));
+    }
+  }
+}
+
 // Gestion des messages
 async function sendMessage() {
   const message = userInput.value.trim();
@@ -110,7 +135,8 @@ async function sendMessage() {
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ 
         history: history,
-        session_id: sessionId
+        session_id: sessionId,
+        stream: STREAM_RESPONSES
       }),
     });
     
@@ -120,15 +146,45 @@ async function sendMessage() {
       throw new Error(errorMessage);
     }
     
-    const data = await response.json();
+    let data;
+    let botMessage = null;
+    if ((response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+      // Affichage progressif des tokens ; la réponse finale (`done`) remplace le texte partiel
+      let partial = '';
+      await readEventStream(response, (event, payload) => {
+        if (event === 'token') {
+          if (!botMessage) {
+            removeTypingIndicator(typingIndicator);
+            botMessage = createMessageElement('');
+            chatbox.appendChild(botMessage);
+          }
+          partial += payload.text;
+          botMessage.querySelector('.message-content').innerHTML = formatMarkdown(partial);
+          chatbox.scrollTop = chatbox.scrollHeight;
+        } else if (event === 'done' || event === 'error') {
+          data = payload;
+          if (payload.ttft_ms != null) console.debug(`Temps jusqu'au premier token : ${payload.ttft_ms} ms`);
+        }
+      });
+      if (data && data.status === 'error') throw new Error(data.response);
+    } else {
+      data = await response.json();
+      await new Promise(resolve => setTimeout(resolve, TYPING_DELAY));
+    }
     
     if (data && data.response) {
       history.push({ role: 'assistant', content: data.response });
-      await new Promise(resolve => setTimeout(resolve, TYPING_DELAY));
-      const botMessage = createMessageElement(data.response);
-      chatbox.appendChild(botMessage);
+      if (botMessage) {
+        botMessage.querySelector('.message-content').innerHTML = formatMarkdown(data.response);
+      } else {
+        botMessage = createMessageElement(data.response);
+        chatbox.appendChild(botMessage);
+      }
 
-      if (data.response.includes("Votre demande est en cours de traitement")) {
+      if (data.job_id) {
+        // Le serveur pousse la confirmation dès que le ticket est créé
+        subscribeToConfirmation(data.job_id);
+      } else if (data.response.includes("Votre demande est en cours de traitement")) {
         // Extraire l'email utilisateur depuis l'historique ou le dernier message utilisateur
         // Exemple naïf :
         let email = null;
@@ -305,6 +361,50 @@ if (inputContainer) {
   }
 }
 
+function showTicketConfirmation(ticket) {
+  const confirmMsg = `✅ Ticket confirmé !<br>- ID : <strong>${ticket.ticket_id}</strong><br>- Soin : <strong>${ticket.service_type}</strong><br>- Date : <strong>${ticket.date}</strong> à <strong>${ticket.time}</strong>`;
+  const botMessage = createMessageElement(confirmMsg, false);
+  chatbox.appendChild(botMessage);
+  chatbox.scrollTop = chatbox.scrollHeight;
+}
+
+// Abonnement (Server-Sent Events) à la confirmation du rendez-vous
+const MAX_CONFIRMATION_WAITS = 10; // ~25s par attente côté serveur
+
+function subscribeToConfirmation(jobId) {
+  const source = new EventSource(`/api/confirmations/${encodeURIComponent(jobId)}/events`);
+  let waits = 0;
+
+  source.addEventListener('confirmed', (event) => {
+    source.close();
+    showTicketConfirmation(JSON.parse(event.data));
+  });
+
+  source.addEventListener('failed', () => {
+    source.close();
+    const errorMsg = createMessageElement("❌ Le rendez-vous n'a pas pu être enregistré. Merci de réessayer ou de contacter la clinique.", false);
+    chatbox.appendChild(errorMsg);
+    chatbox.scrollTop = chatbox.scrollHeight;
+  });
+
+  // Traitement encore en cours : le navigateur se reconnecte automatiquement
+  source.addEventListener('pending', () => {
+    waits += 1;
+    if (waits >= MAX_CONFIRMATION_WAITS) {
+      source.close();
+      const waitMsg = createMessageElement("⏳ Ticket encore en cours... Vous recevrez la confirmation par e-mail.", false);
+      chatbox.appendChild(waitMsg);
+      chatbox.scrollTop = chatbox.scrollHeight;
+    }
+  });
+
+  source.onerror = () => {
+    if (source.readyState === EventSource.CLOSED) {
+      console.error("Flux de confirmation fermé pour la tâche", jobId);
+    }
+  };
+}
+
 // Ajout de la vérification du ticket après confirmation
 function checkTicketStatus(email, retryCount = 0) {
   setTimeout(() => {
@@ -313,10 +413,7 @@ function checkTicketStatus(email, retryCount = 0) {
       .then(data => {
         if (data.status === "success" && data.found) {
           // Affiche le résultat dans la chatbox
-          const confirmMsg = `✅ Ticket confirmé !<br>- ID : <strong>${data.ticket_id}</strong><br>- Soin : <strong>${data.service_type}</strong><br>- Date : <strong>${data.date}</strong> à <strong>${data.time}</strong>`;
-          const botMessage = createMessageElement(confirmMsg, false);
-          chatbox.appendChild(botMessage);
-          chatbox.scrollTop = chatbox.scrollHeight;
+          showTicketConfirmation(data);
         } else {
           // Affiche un message d'attente et un bouton pour relancer
           const waitMsg = document.createElement('div');
@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+import httpx
+
+import metrics
+import tracing
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = logging.getLogger(__name__)
+
+# Paramètres du pool de connexions HTTP (keep-alive) vers Supabase
+MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SUPABASE_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+REQUEST_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+# Intervalle du contrôle de santé en arrière-plan (secondes, 0 pour désactiver)
+HEALTH_CHECK_INTERVAL = int(os.getenv("SUPABASE_HEALTH_CHECK_INTERVAL", "60"))
+HEALTH_CHECK_TABLE = os.getenv("SUPABASE_HEALTH_CHECK_TABLE", "tickets")
+
+# Opérations sans effet de bord, réessayables quelle que soit l'erreur de transport
+READ_OPERATIONS = ("select", "health_check")
+# Erreurs survenues avant l'envoi de la requête : une écriture peut alors être réessayée sans risque
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class SupabasePool:
+    """
+    Client Supabase unique par processus, adossé à un pool de connexions keep-alive.
+
+    Les erreurs de transport (connexion coupée, timeout) provoquent une reconnexion
+    automatique et une nouvelle tentative, pour les lectures seulement : une écriture n'est
+    réessayée que si la requête n'a pas pu partir (échec de connexion), car après un timeout
+    de lecture Supabase a peut-être déjà appliqué l'écriture. Chaque opération sur une table est
+    chronométrée dans l'histogramme `supabase_call_seconds{table, operation}`.
+    """
+
+    def __init__(self, url: str, key: str, health_check_interval: int = HEALTH_CHECK_INTERVAL):
+        self.url = url
+        self.key = key
+        self.health_check_interval = health_check_interval
+        self._lock = threading.Lock()
+        self._client = None
+        self._http = None
+        self._health_thread = None
+        self.healthy = None
+        self.last_health_check = None
+
+    def _connect(self):
+        from supabase import create_client, ClientOptions  # Import lourd, différé à la première connexion
+        with metrics.timed("supabase_connect_seconds"):
+            http = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=REQUEST_TIMEOUT,
+            )
+            client = create_client(self.url, self.key, options=ClientOptions(httpx_client=http, postgrest_client_timeout=REQUEST_TIMEOUT))
+        self._http, self._client = http, client
+        logger.info("[SUPABASE_POOL] Client Supabase partagé créé.")
+
+    def client(self) -> "Client":
+        """Retourne le client partagé (créé au premier appel)."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._connect()
+                    self._start_health_checks()
+        return self._client
+
+    def reconnect(self):
+        """Ferme le pool de connexions courant et en recrée un."""
+        with self._lock:
+            old_http = self._http
+            self._connect()
+        metrics.counter("supabase_reconnections_total").inc()
+        logger.warning("[SUPABASE_POOL] Reconnexion à Supabase effectuée.")
+        if old_http is not None:
+            try:
+                old_http.close()
+            except Exception:
+                pass
+
+    def execute(self, table: str, operation: str, build):
+        """
+        Exécute `build(client.table(table))` et retourne le résultat de `.execute()`.
+        Exemple : pool.execute("tickets", "insert", lambda t: t.insert(data))
+        """
+        for attempt in (1, 2):
+            query = build(self.client().table(table))
+            t0 = time.perf_counter()
+            try:
+                with tracing.span(f"supabase:{table}.{operation}"):
+                    result = query.execute()
+                metrics.histogram("supabase_call_seconds", table=table, operation=operation).observe(time.perf_counter() - t0)
+                return result
+            except httpx.TransportError as e:
+                metrics.counter("supabase_errors_total", table=table, operation=operation).inc()
+                logger.error(f"[SUPABASE_POOL] Erreur de transport sur {table}.{operation} (tentative {attempt}) : {e}")
+                if attempt == 2 or not (operation in READ_OPERATIONS or isinstance(e, NOT_SENT_ERRORS)):
+                    raise
+                self.reconnect()
+
+    def health_check(self) -> bool:
+        """Requête légère vérifiant que Supabase répond ; reconnecte en cas d'échec."""
+        try:
+            self.execute(HEALTH_CHECK_TABLE, "health_check", lambda t: t.select("*").limit(1))
+            self.healthy = True
+        except Exception as e:
+            logger.error(f"[SUPABASE_POOL] Contrôle de santé en échec : {e}")
+            self.healthy = False
+            try:
+                self.reconnect()
+            except Exception as reconnect_error:
+                logger.error(f"[SUPABASE_POOL] Reconnexion impossible : {reconnect_error}")
+        self.last_health_check = time.time()
+        return self.healthy
+
+    def _start_health_checks(self):
+        if self.health_check_interval <= 0 or self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.health_check_interval)
+                self.health_check()
+
+        self._health_thread = threading.Thread(target=loop, name="supabase-health-check", daemon=True)
+        self._health_thread.start()
+
+    def stats(self) -> dict:
+        """Latences des opérations Supabase par table, et état de santé."""
+        return {
+            "healthy": self.healthy,
+            "last_health_check": self.last_health_check,
+            "metrics": metrics.snapshot("supabase_"),
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_supabase_pool() -> Optional[SupabasePool]:
+    """Retourne le pool Supabase du processus, ou None si la configuration manque."""
+    global _pool
+    if _pool is None:
+        supabase_url = os.getenv('SUPABASE_URL')
+        supabase_key = os.getenv('SUPABASE_KEY')
+        if not supabase_url or not supabase_key:
+            logger.error("SUPABASE_URL ou SUPABASE_KEY non configurés")
+            return None
+        with _pool_lock:
+            if _pool is None:
+                _pool = SupabasePool(supabase_url, supabase_key)
+    return _pool
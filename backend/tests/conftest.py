@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Les modules de l'application sont importés depuis backend/ (comme par gunicorn)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Pas de préchauffage en arrière-plan à l'import de app (clients réels, thread encore actif à la sortie)
+os.environ.setdefault("WARMUP_ON_START", "false")
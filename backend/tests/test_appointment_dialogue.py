@@ -0,0 +1,54 @@
+import faq
+import lead_graph
+from session_store import open_session, save_session
+
+AGENT_REPLY = "Très bien, c'est noté. Pouvez-vous me donner l'information suivante ?"
+
+
+def patient_turn(session, message: str, submitted: list) -> str:
+    """Un tour comme dans app.answer_without_agent, l'agent étant remplacé par une réponse fixe."""
+    local = lead_graph.answer_appointment_turn(session, message)
+    if local is not None:
+        reply = local["response"]
+        if local["job_id"]:
+            submitted.append(local["job_id"])
+    else:
+        reply = faq.answer(message) or AGENT_REPLY
+        session.memory.save_context({"input": message}, {"output": reply})
+    save_session(session)
+    return reply
+
+
+def test_faq_answer_does_not_fill_date_and_time(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(lead_graph, "submit_appointment", lambda ticket: "JOB-1")
+    session = open_session("web:test-faq-hours")
+
+    # La réponse aux horaires mentionne « Lundi » et « 9h » : ce ne sont pas les choix du patient
+    assert "9h" in patient_turn(session, "Quels sont vos horaires ?", submitted)
+    replies = [patient_turn(session, message, submitted) for message in (
+        "Je voudrais un détartrage",
+        "Je m'appelle Awa Diop",
+        "awa.diop@example.com",
+        "77 123 4567",
+        "oui",
+    )]
+
+    assert not any("récapitulatif" in reply for reply in replies)
+    assert submitted == []
+    assert not session.slots["proposed_date"] and not session.slots["proposed_time"]
+
+
+def test_recap_once_the_patient_chose_date_and_time(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(lead_graph, "submit_appointment", lambda ticket: "JOB-1")
+    session = open_session("web:test-patient-slot")
+
+    for message in ("Je voudrais un détartrage", "Je m'appelle Awa Diop", "awa.diop@example.com",
+                    "77 123 4567", "Le 25/11/2026"):
+        patient_turn(session, message, submitted)
+    recap = patient_turn(session, "Vers 10h30", submitted)
+
+    assert "récapitulatif" in recap and "2026-11-25" in recap
+    assert lead_graph.PROCESSING_REPLY == patient_turn(session, "oui", submitted)
+    assert len(submitted) == 1
@@ -0,0 +1,65 @@
+import sqlite3
+import time
+
+import lead_graph
+import ticket_writer
+from benchmarks.stubs import CalendarStub, SmtpStub, SupabaseStub
+from email_dispatcher import EmailDispatcher
+from jobs import JobQueue
+from lead_graph import TicketData
+from ticket_writer import TicketWriter
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_appointment_job_killed_while_running_is_replayed_without_duplicates(tmp_path, monkeypatch):
+    calendar, supabase, smtp = CalendarStub(), SupabaseStub(), SmtpStub().start()
+    writer = TicketWriter(db_path=str(tmp_path / "journal.db"), flush_interval=0.01)
+    emails = EmailDispatcher("clinique@example.com", "secret", host=smtp.host, port=smtp.port, starttls=False,
+                             db_path=str(tmp_path / "outbox.db"))
+    monkeypatch.setenv("SENDER_EMAIL", "clinique@example.com")
+    monkeypatch.setenv("SENDER_APP_PASSWORD", "secret")
+    monkeypatch.setattr(lead_graph, "get_calendar_service", calendar.get_service)
+    monkeypatch.setattr(lead_graph, "get_calendar_pool", lambda *args: calendar)
+    monkeypatch.setattr(lead_graph, "get_calendar_mirror", lambda: None)
+    monkeypatch.setattr(lead_graph, "get_supabase_pool", lambda: supabase)
+    monkeypatch.setattr(ticket_writer, "get_supabase_pool", lambda: supabase)
+    monkeypatch.setattr(lead_graph, "get_ticket_writer", lambda: writer)
+    monkeypatch.setattr(lead_graph, "get_email_dispatcher", lambda username, password: emails)
+    db_path = str(tmp_path / "jobs.db")
+    first = JobQueue(db_path=db_path, workers=0)
+    first.register("appointment", lead_graph._run_appointment_job)
+    monkeypatch.setattr(lead_graph, "get_job_queue", lambda: first)
+    try:
+        job_id = lead_graph.submit_appointment(TicketData(
+            type="appointment", name="Awa Diop", email="awa.diop@example.com", phone="771234567",
+            service_type="détartrage", proposed_date="2026-11-25", proposed_time="10:30"))
+
+        # Processus arrêté après les effets de la tâche, avant de l'avoir marquée terminée
+        first._run(job_id, *first._claim(job_id)[:3])
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute("UPDATE jobs SET state = 'running', owner = '1:ancien-boot:1' WHERE id = ?", (job_id,))
+        conn.close()
+
+        second = JobQueue(db_path=db_path, workers=0)
+        second.register("appointment", lead_graph._run_appointment_job)
+        second._resume()
+        assert second._queue.get_nowait() == job_id
+        second._run(job_id, *second._claim(job_id)[:3])
+
+        job = second.get(job_id)
+        assert job["state"] == "done"
+        assert len(calendar.created) == 1
+        assert job["result"]["google_event_link"] == next(iter(calendar.created.values()))["htmlLink"]
+        assert wait_until(lambda: writer.pending() == 0)
+        assert [row["ticket_id"] for row in supabase.tables["tickets"]] == [job["result"]["ticket_id"]]
+        assert wait_until(lambda: emails.delivery_status(job["result"]["ticket_id"])["status"] == "sent")
+        assert len(smtp.messages) == 1
+    finally:
+        smtp.stop()
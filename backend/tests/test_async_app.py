@@ -0,0 +1,77 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import app
+import async_app
+from lead_graph import CONFIRM_SENTINEL
+from session_store import open_session
+
+
+def post_chat(payload: dict):
+    async def scenario():
+        async with TestClient(TestServer(async_app.create_app())) as client:
+            response = await client.post("/api/chat", json=payload)
+            return response.status, response.headers.get("Content-Type", ""), await response.text()
+    return asyncio.run(scenario())
+
+
+def test_error_after_the_stream_started_is_an_sse_event(monkeypatch):
+    def fail(session, user_input):
+        raise RuntimeError("stockage de sessions indisponible")
+
+    monkeypatch.setattr(async_app, "answer_without_agent", fail)
+
+    status, content_type, body = post_chat({"session_id": "test-sse-error", "stream": True,
+                                            "history": [{"role": "user", "content": "Bonjour"}]})
+
+    assert (status, content_type) == (200, "text/event-stream")
+    assert body.startswith("event: error\n") and "Une erreur interne est survenue." in body
+
+
+def test_stream_turn_completes_after_the_client_disconnects(monkeypatch):
+    confirmed = []
+    reply = f"Parfait, votre rendez-vous est confirmé. {CONFIRM_SENTINEL}"
+
+    async def scenario():
+        release = asyncio.Event()
+
+        class SlowAgent:
+            def __init__(self, memory, stream=False):
+                self.memory = memory
+
+            async def ainvoke(self, inputs, config=None):
+                for token in ("Parfait, ", "votre ", "rendez-vous "):
+                    for handler in config["callbacks"]:
+                        await handler.on_llm_new_token(token)
+                    await asyncio.sleep(0.05)
+                await release.wait()
+                self.memory.save_context(inputs, {"output": reply})
+                return {"output": reply}
+
+        monkeypatch.setattr(async_app, "get_agent_executor", SlowAgent)
+        async with TestClient(TestServer(async_app.create_app())) as client:
+            response = await client.post("/api/chat", json={"session_id": "test-async-disconnect", "stream": True,
+                                                            "history": [{"role": "user", "content": "oui"}]})
+            assert (await response.content.readline()).startswith(b"event: token")
+            response.close()  # Client déconnecté avant `done`
+
+            turns = async_app.get_async_session_turns()
+
+            async def next_turn():
+                async with turns.lock("web:test-async-disconnect"):
+                    pass
+
+            waiting = asyncio.ensure_future(next_turn())
+            await asyncio.sleep(0.2)
+            assert not waiting.done()  # Le tour abandonné garde la session jusqu'à sa fin
+            release.set()
+            await asyncio.wait_for(waiting, 5)
+
+    monkeypatch.setattr(async_app, "answer_without_agent", lambda session, user_input: None)
+    monkeypatch.setattr(app, "confirm_appointment", lambda session: confirmed.append("JOB-1") or "JOB-1")
+    asyncio.run(scenario())
+
+    assert confirmed == ["JOB-1"]
+    history = open_session("web:test-async-disconnect").memory.chat_memory.messages
+    assert history[-1].content == reply
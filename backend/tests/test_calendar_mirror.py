@@ -0,0 +1,114 @@
+import itertools
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from calendar_mirror import CalendarMirror
+
+SLOT = datetime(2026, 11, 25, 10, 0, tzinfo=timezone.utc)
+
+
+def event(event_id: str, start: datetime, minutes: int = 60, status: str = "confirmed") -> dict:
+    return {"id": event_id, "status": status, "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(minutes=minutes)).isoformat()}}
+
+
+class FakeCalendar:
+    """Faux service Calendar : events.list complet ou incrémental (syncToken), jetons expirables (410)."""
+
+    def __init__(self):
+        self.stored = {}
+        self.changes = []  # (n° de version, événement)
+        self.versions = itertools.count(1)
+        self.expired = set()
+        self.calls = []
+
+    def put(self, item: dict):
+        self.stored[item["id"]] = item
+        self.changes.append((next(self.versions), item))
+
+    def events(self):
+        return self
+
+    def list(self, **params):
+        self.calls.append(params)
+        return self
+
+    def execute(self):
+        params = self.calls[-1]
+        version = self.changes[-1][0] if self.changes else 0
+        token = params.get("syncToken")
+        if token is None:
+            items = [item for item in self.stored.values() if item["status"] != "cancelled"]
+        elif token in self.expired:
+            raise HttpError(httplib2.Response({"status": 410}), b'{"error": {"message": "gone"}}')
+        else:
+            items = [item for v, item in self.changes if v > int(token)]
+        return {"items": items, "nextSyncToken": str(version)}
+
+
+@pytest.fixture
+def calendar():
+    return FakeCalendar()
+
+
+def mirror_of(service, tmp_path) -> CalendarMirror:
+    return CalendarMirror(lambda: service, "clinique", db_path=str(tmp_path / "mirror.db"))
+
+
+def test_incremental_sync_applies_new_and_cancelled_events(calendar, tmp_path):
+    calendar.put(event("a", SLOT))
+    mirror = mirror_of(calendar, tmp_path)
+    mirror.sync()
+    assert "timeMin" in calendar.calls[-1] and "syncToken" not in calendar.calls[-1]
+    assert not mirror.check_availability(SLOT, SLOT + timedelta(minutes=30))
+
+    calendar.put(event("a", SLOT, status="cancelled"))
+    calendar.put(event("b", SLOT + timedelta(hours=2)))
+    mirror.sync()
+
+    assert calendar.calls[-1]["syncToken"] == "1" and "timeMin" not in calendar.calls[-1]
+    assert mirror.check_availability(SLOT, SLOT + timedelta(minutes=30))
+    assert not mirror.check_availability(SLOT + timedelta(hours=2), SLOT + timedelta(hours=3))
+
+
+def test_expired_sync_token_falls_back_to_a_full_sync(calendar, tmp_path):
+    calendar.put(event("a", SLOT))
+    mirror = mirror_of(calendar, tmp_path)
+    mirror.sync()
+
+    # Événement supprimé pendant que le jeton expirait : absent de la synchronisation complète
+    del calendar.stored["a"]
+    calendar.expired.add("1")
+    mirror.sync()
+
+    assert [("syncToken" in call, "timeMin" in call) for call in calendar.calls] == \
+        [(False, True), (True, False), (False, True)]
+    assert mirror.check_availability(SLOT, SLOT + timedelta(minutes=30))
+
+
+def test_created_event_is_written_through_before_the_next_sync(calendar, tmp_path):
+    mirror = mirror_of(calendar, tmp_path)
+    mirror.sync()
+
+    mirror.record_event(event("rdv1", SLOT))
+
+    assert not mirror.check_availability(SLOT + timedelta(minutes=30), SLOT + timedelta(minutes=90))
+    assert len(calendar.calls) == 1
+
+
+def test_failed_first_sync_is_not_retried_on_every_lookup(tmp_path):
+    attempts = []
+
+    def unavailable():
+        attempts.append(1)
+        return None
+
+    mirror = CalendarMirror(unavailable, "clinique", db_path=str(tmp_path / "mirror.db"))
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            mirror.check_availability(SLOT, SLOT + timedelta(hours=1))
+
+    assert len(attempts) == 1
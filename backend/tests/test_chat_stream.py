@@ -0,0 +1,47 @@
+import threading
+
+import app
+from lead_graph import CONFIRM_SENTINEL
+from session_store import open_session
+
+CONFIRMED_REPLY = f"Parfait, votre rendez-vous est confirmé. {CONFIRM_SENTINEL}"
+
+
+def test_stream_turn_completes_after_the_client_disconnects(monkeypatch):
+    release, confirmed = threading.Event(), []
+
+    class SlowAgent:
+        """Comme AgentExecutor : diffuse ses tokens, puis enregistre la réponse dans la mémoire."""
+
+        def __init__(self, memory, stream=False):
+            self.memory = memory
+
+        def invoke(self, inputs, config=None):
+            for handler in config["callbacks"]:
+                handler.on_llm_new_token("Parfait, ")
+            release.wait(5)
+            self.memory.save_context(inputs, {"output": CONFIRMED_REPLY})
+            return {"output": CONFIRMED_REPLY}
+
+    monkeypatch.setattr(app, "get_agent_executor", SlowAgent)
+    monkeypatch.setattr(app, "answer_without_agent", lambda session, user_input: None)
+    monkeypatch.setattr(app, "confirm_appointment", lambda session: confirmed.append("JOB-1") or "JOB-1")
+
+    stream = app.stream_chat("test-stream-disconnect", "oui")
+    assert next(stream).startswith("event: token")
+    stream.close()  # Client déconnecté avant `done`
+
+    next_turn = threading.Event()
+
+    def wait_for_session():
+        with app.get_session_turns().lock("web:test-stream-disconnect"):
+            next_turn.set()
+
+    threading.Thread(target=wait_for_session, daemon=True).start()
+    assert not next_turn.wait(0.2)  # Le tour abandonné garde la session jusqu'à sa fin
+    release.set()
+    assert next_turn.wait(5)
+
+    assert confirmed == ["JOB-1"]
+    history = open_session("web:test-stream-disconnect").memory.chat_memory.messages
+    assert history[-1].content == CONFIRMED_REPLY
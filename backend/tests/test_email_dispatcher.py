@@ -0,0 +1,58 @@
+import sqlite3
+import time
+
+from benchmarks.stubs import SmtpStub
+from email_dispatcher import EmailDispatcher
+
+
+def dispatcher(tmp_path, smtp):
+    return EmailDispatcher("clinique@example.com", "secret", host=smtp.host, port=smtp.port, starttls=False,
+                           db_path=str(tmp_path / "outbox.db"))
+
+
+def wait_for_status(emails, ticket_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while emails.delivery_status(ticket_id)["status"] != status and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return emails.delivery_status(ticket_id)
+
+
+def test_email_is_sent_once_per_ticket_and_its_status_is_kept(tmp_path):
+    smtp = SmtpStub().start()
+    try:
+        emails = dispatcher(tmp_path, smtp)
+        assert emails.delivery_status("TICKET-1") == {"status": "unknown"}
+
+        assert emails.enqueue("TICKET-1", "clinique@example.com", ["awa.diop@example.com"], "Subject: RDV\r\n\r\nOK")
+        # Tâche de rendez-vous reprise : le même ticket ne renvoie pas d'e-mail
+        assert not emails.enqueue("TICKET-1", "clinique@example.com", ["awa.diop@example.com"], "Subject: RDV\r\n\r\nOK")
+
+        status = wait_for_status(emails, "TICKET-1", "sent")
+        assert (status["status"], status["attempts"]) == ("sent", 1)
+        assert len(smtp.messages) == 1
+        assert emails.pending() == 0
+    finally:
+        smtp.stop()
+
+
+def test_unsent_email_of_a_stopped_process_is_sent_at_startup(tmp_path):
+    smtp = SmtpStub().start()
+    try:
+        db_path = str(tmp_path / "outbox.db")
+        EmailDispatcher("clinique@example.com", "secret", db_path=db_path)  # Crée la boîte d'envoi
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.execute(
+                "INSERT INTO email_outbox (ticket_id, from_addr, recipients, message, status, owner, created_at, "
+                "updated_at) VALUES ('TICKET-2', 'clinique@example.com', '[\"awa.diop@example.com\"]', "
+                "'Subject: RDV\r\n\r\nOK', 'queued', '1:ancien-boot:1', 0, 0)"
+            )
+        conn.close()
+
+        emails = dispatcher(tmp_path, smtp)
+        emails.start()
+
+        assert wait_for_status(emails, "TICKET-2", "sent")["status"] == "sent"
+        assert len(smtp.messages) == 1
+    finally:
+        smtp.stop()
@@ -0,0 +1,31 @@
+import pytest
+
+import app
+import faq
+from session_store import open_session
+
+
+@pytest.mark.parametrize("message", ["samedi", "Le samedi", "dimanche", "ou ?", "numero", "clinique"])
+def test_a_single_common_word_is_not_a_question(message):
+    assert faq.answer(message) is None
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("horaires ?", "hours"),
+    ("Vous ouvrez le samedi ?", "hours"),
+    ("Votre adresse ?", "address"),
+    ("Où se trouve la clinique ?", "address"),
+    ("Quel est votre numéro de téléphone ?", "phone"),
+])
+def test_known_questions_are_answered(message, intent):
+    assert faq.answer(message) == faq.FaqIndex().answers[intent]
+
+
+def test_faq_is_skipped_while_a_booking_is_partly_filled():
+    question = "Quel est votre numéro de téléphone ?"
+    assert app.answer_without_agent(open_session("web:test-faq-no-booking"), question) is not None
+
+    session = open_session("web:test-faq-booking")
+    assert app.answer_without_agent(session, "Je voudrais un détartrage") is None
+    # Pendant la collecte, le tour revient à l'agent (il connaît aussi les coordonnées de la clinique)
+    assert app.answer_without_agent(session, question) is None
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+
+from jobs import JobQueue, process_owner
+
+
+def running_job(db_path, job_id, owner):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, state, owner, created_at) VALUES (?, 'noop', '{}', 'running', ?, 0)",
+            (job_id, owner),
+        )
+    conn.close()
+
+
+def test_running_job_of_a_previous_process_with_the_same_pid_is_resumed(tmp_path):
+    # Conteneur redémarré : le nouveau processus reprend le pid de celui qui avait pris la tâche
+    db_path = str(tmp_path / "jobs.db")
+    queue = JobQueue(db_path=db_path, workers=0)
+    running_job(db_path, "JOB-STALE", f"{os.getpid()}:ancien-boot:1")
+
+    queue._resume()
+
+    assert queue._queue.get_nowait() == "JOB-STALE"
+    assert queue.get("JOB-STALE")["state"] == "queued"
+
+
+def test_running_job_of_a_live_process_is_left_alone(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    queue = JobQueue(db_path=db_path, workers=0)
+    parent = os.getppid()
+    running_job(db_path, "JOB-LIVE", process_owner(parent))
+
+    queue._resume()
+
+    assert queue._queue.empty()
+    assert queue.get("JOB-LIVE")["state"] == "running"
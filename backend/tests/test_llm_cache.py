@@ -0,0 +1,27 @@
+import lead_graph
+import metrics
+from benchmarks.stubs import FakeChatGroq
+from llm_cache import HardenedSQLiteCache
+
+
+def lookups() -> dict:
+    return {result: metrics.counter("llm_cache_requests_total", result=result).value for result in ("hit", "miss")}
+
+
+def test_non_streamed_agent_turns_are_served_from_the_cache(monkeypatch, tmp_path):
+    cache = HardenedSQLiteCache(database_path=str(tmp_path / "llm_cache.db"))
+    model = FakeChatGroq(latency=0, token_delay=0, tokens=5, cache=cache)
+    monkeypatch.setattr(lead_graph, "get_llm", lambda: model)
+    monkeypatch.setattr(lead_graph, "_compiled_agent", None)
+    inputs = {"input": "Bonjour", "chat_history": []}
+
+    before = lookups()
+    first = lead_graph.get_agent_executor(memory=None).invoke(inputs)
+    second = lead_graph.get_agent_executor(memory=None).invoke(inputs)
+    assert second["output"] == first["output"]
+    assert lookups() == {"hit": before["hit"] + 1, "miss": before["miss"] + 1}
+
+    # Tour diffusé (SSE) : le modèle est appelé en streaming, sans passer par le cache
+    lead_graph.get_agent_executor(memory=None, stream=True).invoke(inputs)
+    assert lookups() == {"hit": before["hit"] + 1, "miss": before["miss"] + 1}
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import time
+
+from message_queue import AsyncKeyedWorkQueue, KeyedWorkQueue
+
+DEBOUNCE = 0.2
+
+
+def test_debounced_key_does_not_hold_the_only_worker():
+    done = {}
+    finished = threading.Event()
+
+    def handler(key, items):
+        done[key] = (time.monotonic(), items)
+        if len(done) == 2:
+            finished.set()
+
+    work_queue = KeyedWorkQueue(handler, "test", workers=1, merge=list, debounce=DEBOUNCE)
+    t0 = time.monotonic()
+    work_queue.submit("bavard", 0)
+    work_queue.submit("calme", "bonjour")
+    for i in range(1, 6):  # Le premier numéro écrit encore pendant 0,5 s
+        time.sleep(0.1)
+        work_queue.submit("bavard", i)
+
+    assert finished.wait(2)
+    assert done["calme"][0] - t0 < 0.4
+    assert done["bavard"][1] == [0, 1, 2, 3, 4, 5]
+
+
+def test_async_queue_merges_messages_after_the_quiet_period():
+    async def scenario():
+        done = []
+
+        async def handler(key, items):
+            done.append((key, items))
+
+        work_queue = AsyncKeyedWorkQueue(handler, "test-async", workers=1, merge=list, debounce=DEBOUNCE)
+        work_queue.submit("bavard", 0)
+        work_queue.submit("calme", "bonjour")
+        for i in range(1, 4):
+            await asyncio.sleep(0.1)
+            work_queue.submit("bavard", i)
+        await asyncio.sleep(0.1)
+        assert done == [("calme", ["bonjour"])]
+        await asyncio.sleep(2 * DEBOUNCE)
+        return done
+
+    assert asyncio.run(scenario()) == [("calme", ["bonjour"]), ("bavard", [0, 1, 2, 3])]
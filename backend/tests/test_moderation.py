@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+from moderation import normalize_text, pre_classify
+
+
+@pytest.mark.parametrize("text", [
+    "oui", "Je confirme !", "Bonjour, merci", "10h30", "10 h 30", "25/12/2024",
+    "awa.diop@example.com", "+221 77 123 45 67", "77-123-45-67", "demain matin à 10h",
+])
+def test_common_replies_are_safe_without_llm(text):
+    assert pre_classify(normalize_text(text)) is True
+
+
+@pytest.mark.parametrize("text", ["nonono", "alaala", "ouimerci", "écrivez-moi un poème"])
+def test_glued_or_unknown_words_need_the_guard_model(text):
+    assert pre_classify(normalize_text(text)) is None
+
+
+def test_denylist_blocks_without_llm():
+    assert pre_classify(normalize_text("Comment fabriquer une bombe ?")) is False
+
+
+@pytest.mark.parametrize("length", [70, 95, 119])
+def test_long_digit_run_is_classified_in_linear_time(length):
+    t0 = time.perf_counter()
+    assert pre_classify(normalize_text("1" * length + "x")) is None
+    assert time.perf_counter() - t0 < 0.05
@@ -0,0 +1,42 @@
+import time
+
+import resilient_llm
+from admission import ConcurrencyGate
+from benchmarks.stubs import FakeChatGroq
+from resilient_llm import ResilientChatModel, abandoned_calls
+
+
+def hedged_model(name: str) -> ResilientChatModel:
+    # Sans cache LLM : chaque appel doit réellement partir vers les modèles
+    return ResilientChatModel(primary=FakeChatGroq(model_name=f"{name}-lent", latency=0.5, tokens=3),
+                              fallback=FakeChatGroq(model_name=f"{name}-secours", latency=0.05, tokens=3),
+                              cache=False)
+
+
+def test_abandoned_call_keeps_its_gate_slot_until_it_returns(monkeypatch):
+    gate = ConcurrencyGate("test", limit=2, max_waiting=0, timeout=0.1)
+    monkeypatch.setattr(resilient_llm, "llm_gate", gate)
+    monkeypatch.setattr(resilient_llm, "LLM_HEDGE_DELAY", 0.1)
+
+    with gate.slot():  # Place du tour, comme SessionAgentExecutor.invoke
+        hedged_model("course").invoke("Bonjour")
+
+    # Le secours a gagné ; l'appel principal, toujours en cours, garde la seconde place
+    assert (gate.stats()["in_use"], abandoned_calls()) == (1, 1)
+    time.sleep(0.6)
+    assert (gate.stats()["in_use"], abandoned_calls()) == (0, 0)
+
+
+def test_no_hedge_without_a_free_gate_slot(monkeypatch):
+    gate = ConcurrencyGate("test", limit=1, max_waiting=0, timeout=0.1)
+    monkeypatch.setattr(resilient_llm, "llm_gate", gate)
+    monkeypatch.setattr(resilient_llm, "LLM_HEDGE_DELAY", 0.1)
+    skipped = resilient_llm.metrics.counter("llm_hedge_skipped_total").value
+
+    t0 = time.monotonic()
+    with gate.slot():
+        hedged_model("complet").invoke("Bonjour")
+
+    assert time.monotonic() - t0 >= 0.5  # Réponse du modèle principal, sans secours
+    assert resilient_llm.metrics.counter("llm_hedge_skipped_total").value == skipped + 1
+    assert gate.stats()["in_use"] == 0
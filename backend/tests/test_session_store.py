@@ -0,0 +1,79 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.stubs import RedisStub
+from session_store import RedisSessionStore, SQLiteSessionStore
+
+STATE = {"messages": [{"type": "human", "content": "Bonjour"}], "data": {"slots": {"name": "Awa Diop"}}}
+
+
+def test_sqlite_store_round_trip_expiry_and_eviction(tmp_path):
+    store = SQLiteSessionStore(path=str(tmp_path / "sessions.db"), max_entries=10)
+    store.save("web:s1", STATE)
+    assert store.load("web:s1") == STATE
+
+    expired = SQLiteSessionStore(path=str(tmp_path / "sessions.db"), ttl=-1)
+    expired.save("web:s2", STATE)
+    assert expired.load("web:s2") is None
+
+    for i in range(99):  # La 100e écriture déclenche l'éviction LRU
+        store.save(f"web:lot{i}", STATE)
+    assert store._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 10
+    store.delete("web:lot98")
+    assert store.load("web:lot98") is None
+
+
+def test_sqlite_store_counts_writes_from_concurrent_threads(tmp_path):
+    store = SQLiteSessionStore(path=str(tmp_path / "sessions.db"))
+
+    def writer(n):
+        for i in range(25):
+            store.save(f"web:{n}:{i}", STATE)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store._writes == 200
+
+
+@pytest.fixture
+def redis():
+    server = RedisStub(password="secret").start()
+    yield server
+    server.stop()
+
+
+def test_redis_store_round_trip_with_auth_and_db(redis):
+    store = RedisSessionStore(url=f"redis://:secret@{redis.host}:{redis.port}/2", ttl=60)
+    store.save("web:s1", STATE)
+
+    assert store.load("web:s1") == STATE
+    assert b"session:web:s1" in redis.databases[2]
+    store.delete("web:s1")
+    assert store.load("web:s1") is None
+    assert redis.connections == 1  # Connexion réutilisée
+
+
+def test_redis_key_expires_with_the_session_ttl(redis):
+    store = RedisSessionStore(url=f"redis://:secret@{redis.host}:{redis.port}/0", ttl=0.05)
+    store.save("web:s1", STATE)
+    time.sleep(0.1)
+    assert store.load("web:s1") is None
+
+
+def test_redis_connection_is_dropped_when_auth_fails(redis):
+    store = RedisSessionStore(url=f"redis://:mauvais@{redis.host}:{redis.port}/0")
+
+    with pytest.raises(RuntimeError, match="WRONGPASS"):
+        store.load("web:s1")
+    assert store._local.sock is None
+
+    # Corrigé, le mot de passe est renvoyé sur une nouvelle connexion (pas de socket non authentifié réutilisé)
+    store.password = "secret"
+    assert store.load("web:s1") is None
+    assert redis.connections == 2
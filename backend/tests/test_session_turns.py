@@ -0,0 +1,85 @@
+import asyncio
+import threading
+
+import pytest
+
+from session_turns import AsyncSessionTurns, SessionTurns
+
+WINDOW = 0.2
+
+
+def run_together(turns, messages: list, turn) -> list:
+    """Appelle turns.run depuis un thread par message ; retourne le résultat (ou l'exception) de chacun."""
+    results = [None] * len(messages)
+
+    def call(i):
+        try:
+            results[i] = turns.run("web:s1", messages[i], turn)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(messages))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_callers_of_the_same_window_share_one_turn():
+    turns, calls = SessionTurns(window=WINDOW), []
+
+    def turn(text):
+        calls.append(text)
+        return {"response": text.upper()}
+
+    results = run_together(turns, ["bonjour", "je voudrais", "un rendez-vous"], turn)
+
+    assert len(calls) == 1 and sorted(calls[0].split("\n")) == ["bonjour", "je voudrais", "un rendez-vous"]
+    assert all(result is results[0] for result in results)
+    assert turns._slots == {}
+
+
+def test_turn_error_reaches_every_caller_of_the_batch():
+    turns = SessionTurns(window=WINDOW)
+
+    def turn(text):
+        raise ValueError("agent indisponible")
+
+    results = run_together(turns, ["bonjour", "vous êtes là ?"], turn)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert turns._slots == {}
+    # La session reste utilisable : le lot suivant a son propre tour
+    assert turns.run("web:s1", "re-bonjour", lambda text: text) == "re-bonjour"
+    assert turns._slots == {}
+
+
+def test_async_callers_share_one_turn_and_the_error():
+    async def scenario():
+        turns, calls = AsyncSessionTurns(window=WINDOW), []
+
+        async def turn(text):
+            calls.append(text)
+            return text
+
+        async def failing(text):
+            raise ValueError("agent indisponible")
+
+        shared = await asyncio.gather(*(turns.run("web:s1", m, turn) for m in ("bonjour", "un détartrage")))
+        assert calls == ["bonjour\nun détartrage"] and shared == [calls[0]] * 2
+        errors = await asyncio.gather(*(turns.run("web:s1", m, failing) for m in ("a", "b")), return_exceptions=True)
+        assert all(isinstance(error, ValueError) for error in errors)
+        assert turns._slots == {}
+
+    asyncio.run(scenario())
+
+
+def test_slot_is_released_when_a_locked_turn_fails():
+    turns = SessionTurns()
+
+    with pytest.raises(RuntimeError):
+        with turns.lock("web:s1"):
+            raise RuntimeError("flux interrompu")
+
+    assert turns._slots == {}
@@ -0,0 +1,41 @@
+import httpx
+import pytest
+
+from supabase_client import SupabasePool
+
+
+class FlakyQuery:
+    def __init__(self, calls, error):
+        self.calls = calls
+        self.error = error
+
+    def execute(self):
+        self.calls.append(1)
+        if len(self.calls) == 1:
+            raise self.error
+        return "ok"
+
+
+def pool_failing_once(error):
+    calls = []
+    pool = SupabasePool("https://example.supabase.co", "key", health_check_interval=0)
+    pool._client = type("Client", (), {"table": lambda self, name: name})()
+    pool.reconnect = lambda: None
+    return pool, calls, lambda table: FlakyQuery(calls, error)
+
+
+def test_write_is_not_resent_after_a_read_timeout():
+    pool, calls, build = pool_failing_once(httpx.ReadTimeout("timeout"))
+    with pytest.raises(httpx.ReadTimeout):
+        pool.execute("tickets", "upsert", build)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("operation, error", [
+    ("upsert", httpx.ConnectError("refused")),
+    ("select", httpx.ReadTimeout("timeout")),
+])
+def test_unsent_write_or_read_is_retried(operation, error):
+    pool, calls, build = pool_failing_once(error)
+    assert pool.execute("tickets", operation, build) == "ok"
+    assert len(calls) == 2
@@ -0,0 +1,42 @@
+import time
+
+import ticket_writer
+from benchmarks.stubs import SupabaseStub
+from ticket_writer import TicketWriter
+
+
+class RejectingPool:
+    def execute(self, table, operation, build):
+        raise Exception("new row violates check constraint")
+
+
+def journaled(writer, ticket_id):
+    row = {"ticket_id": ticket_id, "email": "awa.diop@example.com"}
+    with writer._conn() as conn:
+        conn.execute("INSERT INTO tickets_journal (ticket_id, row, email, created_at) VALUES (?, '{}', ?, ?)",
+                     (ticket_id, row["email"], time.time()))
+    return {"ticket_id": ticket_id, "row": row, "attempts": 0, "queued_at": time.monotonic()}
+
+
+def test_rejected_ticket_is_dead_lettered_after_max_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(ticket_writer, "get_supabase_pool", RejectingPool)
+    monkeypatch.setattr(ticket_writer, "TICKET_MAX_ATTEMPTS", 2)
+    writer = TicketWriter(db_path=str(tmp_path / "journal.db"))
+    item = journaled(writer, "TCK-1")
+
+    writer._flush([item])
+    assert (writer.pending(), writer.dead(), len(writer._retries)) == (1, 0, 1)
+    writer._flush([item])
+    assert (writer.pending(), writer.dead(), len(writer._retries)) == (0, 1, 1)
+
+
+def test_replayed_batch_is_not_inserted_twice(tmp_path, monkeypatch):
+    pool = SupabaseStub()
+    monkeypatch.setattr(ticket_writer, "get_supabase_pool", lambda: pool)
+    writer = TicketWriter(db_path=str(tmp_path / "journal.db"))
+
+    writer._flush([journaled(writer, "TCK-1")])
+    writer._flush([journaled(writer, "TCK-1")])  # Réponse perdue puis reprise du journal
+
+    assert [row["ticket_id"] for row in pool.tables["tickets"]] == ["TCK-1"]
+    assert writer.pending() == 0
@@ -0,0 +1,39 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+import whatsapp_sender
+from whatsapp_sender import WhatsAppSender
+
+CONNECTION_REFUSED = requests.exceptions.ConnectionError(
+    MaxRetryError(None, "/messages", NewConnectionError(None, "Connection refused")))
+
+
+def sender_failing_with(error, monkeypatch):
+    monkeypatch.setattr(whatsapp_sender, "WHATSAPP_BACKOFF_BASE", 0.0)
+    sender = WhatsAppSender("token", "123", max_retries=2, rate_per_second=0)
+    calls = []
+
+    def post(*args, **kwargs):
+        calls.append(1)
+        raise error
+
+    sender.session.post = post
+    return sender, calls
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ReadTimeout("read timed out"),
+    requests.exceptions.ConnectionError("Connection aborted."),
+])
+def test_message_is_not_resent_when_it_may_have_been_delivered(error, monkeypatch):
+    sender, calls = sender_failing_with(error, monkeypatch)
+    assert "error" in sender.send("221770000000", "Bonjour")
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ConnectTimeout("connect timed out"), CONNECTION_REFUSED])
+def test_message_is_resent_when_the_connection_failed(error, monkeypatch):
+    sender, calls = sender_failing_with(error, monkeypatch)
+    assert "error" in sender.send("221770000000", "Bonjour")
+    assert len(calls) == 3
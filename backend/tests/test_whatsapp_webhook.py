@@ -0,0 +1,34 @@
+import moderation
+import whatsapp_webhook
+from admission import Overloaded
+from session_store import open_session
+
+
+class FakeAgent:
+    """Comme AgentExecutor : la réponse est enregistrée dans la mémoire de la session."""
+
+    def __init__(self, memory):
+        self.memory = memory
+
+    def invoke(self, inputs):
+        output = "Nous proposons des détartrages du lundi au vendredi."
+        self.memory.save_context(inputs, {"output": output})
+        return {"output": output}
+
+
+def test_overload_on_output_moderation_blocks_the_saved_turn(monkeypatch):
+    def moderate(text):
+        if text.startswith("Nous proposons"):
+            raise Overloaded("timeout", retry_after=1.0)
+        return True
+
+    monkeypatch.setattr(moderation, "MODERATION_PARALLEL", False)
+    monkeypatch.setattr(whatsapp_webhook, "moderate_content", moderate)
+    monkeypatch.setattr(whatsapp_webhook, "get_agent_executor", FakeAgent)
+
+    reply = whatsapp_webhook.process_message("Vous faites les détartrages ?", "221770000001")
+
+    # Le tour est sauvegardé : la surcharge ne remonte pas (le patient ne renverra pas le message)
+    assert reply == whatsapp_webhook.BLOCKED_OUTPUT_REPLY
+    history = open_session("whatsapp:221770000001").memory.chat_memory.messages
+    assert history[-2].content == "Vous faites les détartrages ?"
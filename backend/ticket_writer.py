@@ -0,0 +1,267 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import httpx
+
+import metrics
+import tracing
+from jobs import owner_alive, process_owner
+from supabase_client import get_supabase_pool
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+TICKET_JOURNAL_PATH = os.getenv("TICKET_JOURNAL_PATH", os.path.join(os.path.dirname(__file__), ".tickets_journal.db"))
+# Un lot part vers Supabase dès TICKET_BATCH_SIZE tickets, ou TICKET_FLUSH_INTERVAL s après le premier
+TICKET_BATCH_SIZE = int(os.getenv("TICKET_BATCH_SIZE", "50"))
+TICKET_FLUSH_INTERVAL = float(os.getenv("TICKET_FLUSH_INTERVAL", "0.5"))
+TICKET_BACKOFF_BASE = float(os.getenv("TICKET_BACKOFF_BASE", "2"))
+TICKET_BACKOFF_MAX = float(os.getenv("TICKET_BACKOFF_MAX", "300"))
+# Au-delà de TICKET_MAX_ATTEMPTS refus de Supabase, le ticket reste au journal marqué en échec définitif
+TICKET_MAX_ATTEMPTS = int(os.getenv("TICKET_MAX_ATTEMPTS", "20"))
+
+
+class TicketWriter:
+    """
+    Écriture différée des tickets dans Supabase, par insertions groupées.
+
+    Chaque ticket est d'abord inscrit dans un journal SQLite local, puis un thread unique
+    l'insère dans la table `tickets` avec les autres tickets arrivés entre-temps (lot envoyé
+    à TICKET_BATCH_SIZE tickets ou après TICKET_FLUSH_INTERVAL secondes). Un ticket ne quitte
+    le journal qu'une fois inséré ; au démarrage, ceux d'un processus arrêté sont réinsérés.
+    L'insertion est un upsert sur ticket_id qui ignore les doublons : un lot déjà inséré
+    (réponse perdue, reprise) n'est pas dupliqué. Il exige une contrainte d'unicité sur
+    `tickets.ticket_id` côté Supabase (voir README.md). Un lot refusé est réessayé ticket par ticket,
+    les échecs avec un backoff exponentiel ; un ticket refusé TICKET_MAX_ATTEMPTS fois est
+    mis de côté (dead_at) jusqu'à retry_dead(), une panne de Supabase est réessayée sans limite.
+    """
+
+    def __init__(self, db_path: str = TICKET_JOURNAL_PATH, batch_size: int = TICKET_BATCH_SIZE,
+                 flush_interval: float = TICKET_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._retries = []  # tas de (échéance, n°, lot de tickets)
+        self._counter = itertools.count()
+        self._local = threading.local()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tickets_journal ("
+                "ticket_id TEXT PRIMARY KEY, row TEXT NOT NULL, email TEXT, owner TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, dead_at REAL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tickets_journal_email ON tickets_journal (email)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # --- API publique ---
+    def submit(self, row: dict):
+        """
+        Inscrit le ticket au journal et le met en file d'insertion ; retourne immédiatement.
+        Un ticket déjà au journal (tâche de rendez-vous reprise) n'est pas inscrit une seconde fois.
+        """
+        self.start()  # Reprise du journal avant cette inscription (sinon le ticket serait mis en file deux fois)
+        conn = self._conn()
+        with conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO tickets_journal (ticket_id, row, email, owner, created_at) VALUES (?, ?, ?, ?, ?)",
+                (row["ticket_id"], json.dumps(row, ensure_ascii=False), row.get("email"), process_owner(), time.time()),
+            ).rowcount
+        if not inserted:
+            logger.info(f"[TICKETS] Ticket {row['ticket_id']} déjà au journal ; ignoré.")
+            return
+        metrics.counter("tickets_journaled_total").inc()
+        self._queue.put({"ticket_id": row["ticket_id"], "row": row, "attempts": 0, "queued_at": time.monotonic()})
+
+    def pending_for_email(self, email: str, since: str) -> list:
+        """Tickets encore au journal pour cet e-mail, créés depuis `since` (ISO 8601), les plus récents d'abord."""
+        rows = self._conn().execute(
+            "SELECT row FROM tickets_journal WHERE email = ? AND dead_at IS NULL ORDER BY created_at DESC", (email,)
+        ).fetchall()
+        return [ticket for ticket in (json.loads(row[0]) for row in rows) if ticket.get("created_at", "") >= since]
+
+    def pending(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM tickets_journal WHERE dead_at IS NULL").fetchone()[0]
+
+    def dead(self) -> int:
+        """Tickets refusés TICKET_MAX_ATTEMPTS fois, gardés au journal sans nouvel essai."""
+        return self._conn().execute("SELECT COUNT(*) FROM tickets_journal WHERE dead_at IS NOT NULL").fetchone()[0]
+
+    def retry_dead(self) -> int:
+        """Remet en file les tickets en échec définitif (après correction côté Supabase) ; retourne leur nombre."""
+        self.start()
+        conn = self._conn()
+        with conn:
+            rows = conn.execute("SELECT ticket_id, row FROM tickets_journal WHERE dead_at IS NOT NULL").fetchall()
+            conn.executemany("UPDATE tickets_journal SET dead_at = NULL, attempts = 0, owner = ? WHERE ticket_id = ?",
+                             [(process_owner(), row[0]) for row in rows])
+        for ticket_id, row in rows:
+            self._queue.put({"ticket_id": ticket_id, "row": json.loads(row), "attempts": 0, "queued_at": time.monotonic()})
+        return len(rows)
+
+    # --- Démarrage et reprise ---
+    def start(self):
+        """Démarre le thread d'insertion (une seule fois) et reprend les tickets non insérés."""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._resume()
+                self._thread = threading.Thread(target=self._run, name="ticket-writer", daemon=True)
+                self._thread.start()
+
+    def _resume(self):
+        conn = self._conn()
+        resumed = 0
+        me = process_owner()
+        for ticket_id, row, owner, attempts in conn.execute(
+                "SELECT ticket_id, row, owner, attempts FROM tickets_journal "
+                "WHERE dead_at IS NULL ORDER BY created_at").fetchall():
+            # Ticket d'un autre worker vivant : il l'insère lui-même (un ticket inséré deux fois est ignoré par l'upsert)
+            if owner and owner != me and owner_alive(owner):
+                continue
+            with conn:
+                claimed = conn.execute(
+                    "UPDATE tickets_journal SET owner = ? WHERE ticket_id = ? AND owner IS ?", (me, ticket_id, owner),
+                ).rowcount
+            if claimed:
+                self._queue.put({"ticket_id": ticket_id, "row": json.loads(row), "attempts": attempts,
+                                 "queued_at": time.monotonic()})
+                resumed += 1
+        if resumed:
+            metrics.counter("tickets_replayed_total").inc(resumed)
+            logger.info(f"[TICKETS] {resumed} ticket(s) non inséré(s) repris du journal au démarrage.")
+
+    # --- Insertion ---
+    def _next_batch(self) -> list:
+        """Attend un premier ticket prêt, puis complète le lot jusqu'à sa taille ou son échéance."""
+        batch = []
+        while self._retries and self._retries[0][0] <= time.monotonic() and len(batch) < self.batch_size:
+            batch.extend(heapq.heappop(self._retries)[2])
+        if not batch:
+            timeout = max(0.0, self._retries[0][0] - time.monotonic()) if self._retries else None
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch:
+                with tracing.trace(), tracing.span("tickets:flush", size=len(batch)):
+                    self._flush(batch)
+
+    def _flush(self, batch: list):
+        pool = get_supabase_pool()
+        if not pool:
+            self._retry(batch, RuntimeError("client Supabase introuvable"))
+            return
+        try:
+            t0 = time.perf_counter()
+            pool.execute("tickets", "upsert", lambda table: table.upsert(
+                [item["row"] for item in batch], on_conflict="ticket_id", ignore_duplicates=True))
+            metrics.histogram("ticket_flush_seconds").observe(time.perf_counter() - t0)
+        except Exception as e:
+            if len(batch) > 1 and not isinstance(e, httpx.TransportError):
+                # Lot refusé par Supabase : un ticket invalide ne doit pas bloquer les autres
+                logger.warning(f"[TICKETS] Lot de {len(batch)} tickets refusé ({e}) ; insertion un par un.")
+                for item in batch:
+                    self._flush([item])
+            else:
+                # Supabase injoignable : le lot entier est réessayé plus tard, sans limite
+                self._retry(batch, e, rejected=not isinstance(e, httpx.TransportError))
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM tickets_journal WHERE ticket_id = ?", [(item["ticket_id"],) for item in batch])
+        now = time.monotonic()
+        for item in batch:
+            metrics.histogram("ticket_write_delay_seconds").observe(now - item["queued_at"])
+        metrics.counter("ticket_flush_batches_total").inc()
+        metrics.counter("tickets_flushed_total").inc(len(batch))
+        logger.info(f"[TICKETS] {len(batch)} ticket(s) inséré(s) dans Supabase.")
+
+    def _retry(self, batch: list, error: Exception, rejected: bool = False):
+        """Replanifie le lot ; `rejected` : refus de Supabase (compte pour TICKET_MAX_ATTEMPTS), pas une panne."""
+        for item in batch:
+            item["attempts"] += 1
+        attempts = max(item["attempts"] for item in batch)
+        dead = rejected and attempts >= TICKET_MAX_ATTEMPTS
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE tickets_journal SET attempts = ?, last_error = ?, dead_at = ? WHERE ticket_id = ?",
+                             [(item["attempts"], str(error), time.time() if dead else None, item["ticket_id"])
+                              for item in batch])
+        metrics.counter("ticket_flush_errors_total").inc()
+        error_str = str(error)
+        if 'violates row-level security policy' in error_str:
+            logger.error("--- ERREUR DE POLITIQUE SUPABASE (RLS) ---")
+            logger.error("La table 'tickets' bloque l'écriture. Allez sur Supabase > Policies et créez une politique d'INSERT pour la table 'tickets'.")
+        elif "Could not find the 'google_event_link' column" in error_str:
+            logger.error("--- ERREUR DE SCHEMA SUPABASE ---")
+            logger.error("La colonne 'google_event_link' est manquante dans la table 'tickets'. Veuillez l'ajouter (type: text).")
+        elif "no unique or exclusion constraint matching the ON CONFLICT" in error_str:
+            logger.error("--- ERREUR DE SCHEMA SUPABASE ---")
+            logger.error("La table 'tickets' n'a pas de contrainte d'unicité sur 'ticket_id', requise par l'upsert. "
+                         "Veuillez l'ajouter (voir README.md).")
+        if dead:
+            metrics.counter("tickets_dead_total").inc(len(batch))
+            logger.error(f"[TICKETS] {len(batch)} ticket(s) refusé(s) {attempts} fois, abandonné(s) : {error}. "
+                         f"Ils restent au journal ({self.db_path}) jusqu'à retry_dead().")
+            return
+        delay = min(TICKET_BACKOFF_MAX, TICKET_BACKOFF_BASE ** attempts)
+        heapq.heappush(self._retries, (time.monotonic() + delay, next(self._counter), batch))
+        logger.error(f"[TICKETS] Insertion de {len(batch)} ticket(s) en échec "
+                     f"(tentative {attempts}, nouvel essai dans {delay:.0f}s) : {error}")
+
+    # --- Observabilité ---
+    def stats(self) -> dict:
+        return {
+            "journal_pending": self.pending(),
+            "dead": self.dead(),
+            "local_queue_depth": self._queue.qsize(),
+            "retrying": sum(len(batch) for _, _, batch in list(self._retries)),
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "metrics": metrics.snapshot("ticket"),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_ticket_writer() -> TicketWriter:
+    """Retourne l'écrivain de tickets partagé par le processus."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = TicketWriter()
+                metrics.gauge("ticket_journal_pending", _writer.pending)
+    return _writer
@@ -0,0 +1,200 @@
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# Niveau des lignes de log structurées émises à la fin de chaque span (DEBUG par défaut)
+TRACE_SPANS_LOG_LEVEL = getattr(logging, os.getenv("TRACE_SPANS_LOG_LEVEL", "DEBUG").upper(), logging.DEBUG)
+LOG_FORMAT = "%(asctime)s %(levelname)s [trace=%(trace_id)s] %(name)s: %(message)s"
+TRACE_HEADER = "X-Trace-Id"
+
+# Identifiant de trace et span courants (propagés aux threads via contextvars.copy_context)
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: Optional[str] = None):
+    """Exécute le bloc sous l'identifiant de trace donné (ou un nouveau)."""
+    token = _trace_id.set(trace_id or new_trace_id())
+    try:
+        yield _trace_id.get()
+    finally:
+        _trace_id.reset(token)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mesure une étape du traitement : durée dans `span_seconds{span=name}`, erreurs
+    dans `span_errors_total`, et une ligne de log structurée liée à la trace courante.
+    """
+    parent = _span.get()
+    token = _span.set(name)
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _span.reset(token)
+        record_span(name, time.perf_counter() - t0, status, parent=parent, **attrs)
+
+
+def record_span(name: str, seconds: float, status: str = "ok", parent: Optional[str] = None, **attrs):
+    """Enregistre un span mesuré ailleurs (ex. callbacks LangChain)."""
+    metrics.histogram("span_seconds", span=name).observe(seconds)
+    if status != "ok":
+        metrics.counter("span_errors_total", span=name).inc()
+    if logger.isEnabledFor(TRACE_SPANS_LOG_LEVEL):
+        logger.log(TRACE_SPANS_LOG_LEVEL, json.dumps({
+            "span": name, "parent": parent if parent is not None else _span.get(),
+            "ms": round(seconds * 1000, 2), "status": status, **attrs,
+        }, ensure_ascii=False, default=str))
+
+
+# --- Logs ---
+class TraceIdFilter(logging.Filter):
+    """Ajoute `trace_id` à chaque enregistrement de log."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = _trace_id.get() or "-"
+        return True
+
+
+def configure_logging(level: int = logging.INFO):
+    """Format de log avec identifiant de trace, sur tous les handlers racine."""
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+
+# --- Flask ---
+def init_app(app):
+    """Ouvre une trace par requête HTTP (reprise de l'en-tête X-Trace-Id s'il est fourni)."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_trace():
+        g.trace_token = _trace_id.set(request.headers.get(TRACE_HEADER) or new_trace_id())
+        g.trace_t0 = time.perf_counter()
+
+    @app.after_request
+    def _end_trace(response):
+        if "trace_t0" in g:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            record_span(f"http {request.method} {route}", time.perf_counter() - g.trace_t0,
+                        "ok" if response.status_code < 500 else "error", status_code=response.status_code)
+            metrics.counter("http_requests_total", route=route, method=request.method,
+                            status=str(response.status_code)).inc()
+        response.headers[TRACE_HEADER] = _trace_id.get() or ""
+        return response
+
+    @app.teardown_request
+    def _reset_trace(exc):
+        token = g.pop("trace_token", None)
+        if token is not None:
+            _trace_id.reset(token)
+
+
+# --- aiohttp (async_app) ---
+def init_aiohttp(app, skip_routes: tuple = ()):
+    """
+    Équivalent de init_app pour une application aiohttp. Les routes nommées dans `skip_routes`
+    (ex. le pont WSGI vers Flask, déjà tracé par Flask) sont ignorées.
+    """
+    from aiohttp import web
+
+    @web.middleware
+    async def _trace(request, handler):
+        route = request.match_info.route
+        if route.name in skip_routes:
+            return await handler(request)
+        name = route.resource.canonical if route.resource is not None else "unmatched"
+        with trace(request.headers.get(TRACE_HEADER)):
+            t0 = time.perf_counter()
+            status_code = 500
+            try:
+                response = await handler(request)
+                status_code = response.status
+                if not response.prepared:
+                    response.headers.setdefault(TRACE_HEADER, _trace_id.get())
+                return response
+            except web.HTTPException as e:
+                status_code = e.status
+                raise
+            finally:
+                record_span(f"http {request.method} {name}", time.perf_counter() - t0,
+                            "ok" if status_code < 500 else "error", status_code=status_code)
+                metrics.counter("http_requests_total", route=name, method=request.method,
+                                status=str(status_code)).inc()
+
+    async def _trace_header(request, response):
+        # Flux (SSE) : en-têtes envoyés depuis le handler, donc encore sous la trace de la requête
+        if _trace_id.get():
+            response.headers.setdefault(TRACE_HEADER, _trace_id.get())
+
+    app.middlewares.append(_trace)
+    app.on_response_prepare.append(_trace_header)
+
+
+# --- LangChain ---
+class SpanCallbackHandler(BaseCallbackHandler):
+    """Spans des appels LLM (`llm:<modèle>`) et des outils (`tool:<nom>`) exécutés par l'agent."""
+
+    # Appelé directement, y compris dans la boucle asyncio (traitement léger, sans attente)
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def _start(self, run_id, name: str):
+        self._runs[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id, status: str = "ok"):
+        started = self._runs.pop(run_id, None)
+        if started is not None:
+            record_span(started[0], time.perf_counter() - started[1], status)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, f"llm:{(metadata or {}).get('ls_model_name', 'chat')}")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._start(run_id, f"llm:{(metadata or {}).get('ls_model_name', 'llm')}")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, f"tool:{(serialized or {}).get('name') or kwargs.get('name', 'tool')}")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, "error")
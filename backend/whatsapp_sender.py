@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+WHATSAPP_API_BASE = os.getenv("WHATSAPP_API_BASE", "https://graph.facebook.com/v17.0")
+WHATSAPP_POOL_SIZE = int(os.getenv("WHATSAPP_POOL_SIZE", "10"))
+WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", "4"))
+WHATSAPP_BACKOFF_BASE = float(os.getenv("WHATSAPP_BACKOFF_BASE", "0.5"))
+WHATSAPP_BACKOFF_MAX = float(os.getenv("WHATSAPP_BACKOFF_MAX", "8"))
+# Débit maximal d'envoi pour le numéro WhatsApp Business (messages/seconde)
+WHATSAPP_RATE_PER_SECOND = float(os.getenv("WHATSAPP_RATE_PER_SECOND", "20"))
+WHATSAPP_TIMEOUT = float(os.getenv("WHATSAPP_TIMEOUT", "15"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """Seau à jetons : au plus `rate` envois par seconde, avec une rafale de `burst`."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self) -> float:
+        """Prend un jeton s'il y en a un (retourne 0), sinon retourne l'attente nécessaire."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while (wait := self._take()) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        while (wait := self._take()) > 0:
+            await asyncio.sleep(wait)
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    """Délai avant un nouvel essai : Retry-After s'il est fourni, sinon backoff exponentiel avec gigue."""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), WHATSAPP_BACKOFF_MAX)
+    delay = min(WHATSAPP_BACKOFF_MAX, WHATSAPP_BACKOFF_BASE * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _request_not_sent(err: requests.exceptions.RequestException) -> bool:
+    """
+    True si la connexion à l'API n'a pas pu s'établir : rien n'a été reçu, le message peut être renvoyé.
+    Après un timeout de lecture ou une connexion coupée en cours d'échange, le message a pu partir.
+    """
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(err, requests.exceptions.Timeout):
+        return False
+    reason = getattr(err.args[0], "reason", None) if err.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class WhatsAppSender:
+    """
+    Envoi des messages WhatsApp via l'API Graph, sur une session HTTP keep-alive partagée.
+    Réessaie avec un backoff exponentiel sur 429, 5xx et échec de connexion, et limite le débit
+    d'envoi. Un timeout de lecture n'est pas réessayé : le patient recevrait le message en double.
+    """
+
+    def __init__(self, token: str, phone_id: str, base_url: str = WHATSAPP_API_BASE,
+                 pool_size: int = WHATSAPP_POOL_SIZE, max_retries: int = WHATSAPP_MAX_RETRIES,
+                 rate_per_second: float = WHATSAPP_RATE_PER_SECOND, timeout: float = WHATSAPP_TIMEOUT):
+        self.url = f"{base_url.rstrip('/')}/{phone_id}/messages"
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {token}", "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        return backoff_delay(attempt, response.headers.get("Retry-After") if response is not None else None)
+
+    def send(self, to_number: str, message_text: str) -> dict:
+        """Envoie un message texte ; retourne la réponse de l'API ou {"error": ...}."""
+        with tracing.span("whatsapp:send"):
+            return self._send(to_number, message_text)
+
+    def _send(self, to_number: str, message_text: str) -> dict:
+        payload = {"messaging_product": "whatsapp", "to": to_number, "type": "text", "text": {"body": message_text}}
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                self.rate_limiter.acquire()
+                try:
+                    response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                    if attempt == self.max_retries or not _request_not_sent(err):
+                        print(f"[WHATSAPP_SEND] Request error for {to_number}: {err}")
+                        return {"error": "Timeout sending." if isinstance(err, requests.exceptions.Timeout) else f"Request error: {err}"}
+                    metrics.counter("whatsapp_send_retries_total", reason="network").inc()
+                    time.sleep(self._backoff(attempt))
+                    continue
+
+                if response.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                    metrics.counter("whatsapp_send_retries_total", reason=str(response.status_code)).inc()
+                    delay = self._backoff(attempt, response)
+                    print(f"[WHATSAPP_SEND] HTTP {response.status_code} for {to_number}, retry in {delay:.2f}s")
+                    time.sleep(delay)
+                    continue
+
+                if response.status_code >= 400:
+                    print(f"[WHATSAPP_SEND] API Error ({response.status_code}): {response.text}")
+                    metrics.counter("whatsapp_send_errors_total", status=str(response.status_code)).inc()
+                    return {"error": f"HTTP {response.status_code}."}
+                return response.json()
+        except Exception as e:
+            print(f"[WHATSAPP_SEND] Unexpected exception for {to_number}: '{e}'\n{traceback.format_exc()}")
+            return {"error": "Unexpected server error."}
+        finally:
+            metrics.histogram("whatsapp_send_seconds").observe(time.perf_counter() - t0)
+
+    def send_many(self, to_number: str, messages: list) -> list:
+        """Envoie plusieurs messages en file à un même destinataire, dans l'ordre, sur la même connexion."""
+        return [self.send(to_number, text) for text in messages]
+
+
+class AsyncWhatsAppSender:
+    """
+    Variante asyncio de WhatsAppSender (mode async_app) : session aiohttp keep-alive, mêmes
+    réessais (échec de connexion, jamais un timeout de lecture), backoff et limite de débit,
+    sans bloquer la boucle d'événements.
+    La session est créée au premier envoi, dans la boucle qui l'utilise.
+    """
+
+    def __init__(self, token: str, phone_id: str, base_url: str = WHATSAPP_API_BASE,
+                 pool_size: int = WHATSAPP_POOL_SIZE, max_retries: int = WHATSAPP_MAX_RETRIES,
+                 rate_per_second: float = WHATSAPP_RATE_PER_SECOND, timeout: float = WHATSAPP_TIMEOUT):
+        self.url = f"{base_url.rstrip('/')}/{phone_id}/messages"
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate_per_second)
+        self._session = None
+
+    def _client(self):
+        if self._session is None or self._session.closed:
+            import aiohttp  # Dépendance du seul mode asynchrone
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.timeout),
+            )
+        return self._session
+
+    async def send(self, to_number: str, message_text: str) -> dict:
+        """Envoie un message texte ; retourne la réponse de l'API ou {"error": ...}."""
+        with tracing.span("whatsapp:send"):
+            return await self._send(to_number, message_text)
+
+    async def _send(self, to_number: str, message_text: str) -> dict:
+        import aiohttp
+        payload = {"messaging_product": "whatsapp", "to": to_number, "type": "text", "text": {"body": message_text}}
+        t0 = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.rate_limiter.acquire_async()
+                try:
+                    async with self._client().post(self.url, json=payload) as response:
+                        if response.status in RETRYABLE_STATUS and attempt < self.max_retries:
+                            metrics.counter("whatsapp_send_retries_total", reason=str(response.status)).inc()
+                            delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+                            print(f"[WHATSAPP_SEND] HTTP {response.status} for {to_number}, retry in {delay:.2f}s")
+                        elif response.status >= 400:
+                            print(f"[WHATSAPP_SEND] API Error ({response.status}): {await response.text()}")
+                            metrics.counter("whatsapp_send_errors_total", status=str(response.status)).inc()
+                            return {"error": f"HTTP {response.status}."}
+                        else:
+                            return await response.json()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                    # Seul un échec de connexion garantit que l'API n'a rien reçu
+                    not_sent = isinstance(err, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError))
+                    if attempt == self.max_retries or not not_sent:
+                        print(f"[WHATSAPP_SEND] Request error for {to_number}: {err}")
+                        return {"error": "Timeout sending." if isinstance(err, asyncio.TimeoutError) else f"Request error: {err}"}
+                    metrics.counter("whatsapp_send_retries_total", reason="network").inc()
+                    delay = backoff_delay(attempt)
+                await asyncio.sleep(delay)
+        except Exception as e:
+            print(f"[WHATSAPP_SEND] Unexpected exception for {to_number}: '{e}'\n{traceback.format_exc()}")
+            return {"error": "Unexpected server error."}
+        finally:
+            metrics.histogram("whatsapp_send_seconds").observe(time.perf_counter() - t0)
+
+
+_sender = None
+_async_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_whatsapp_sender(token: str, phone_id: str) -> WhatsAppSender:
+    """Retourne l'expéditeur partagé par le processus."""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                _sender = WhatsAppSender(token, phone_id)
+    return _sender
+
+
+def get_async_whatsapp_sender(token: str, phone_id: str) -> AsyncWhatsAppSender:
+    """Retourne l'expéditeur asynchrone partagé par le processus (mode async_app)."""
+    global _async_sender
+    if _async_sender is None:
+        with _sender_lock:
+            if _async_sender is None:
+                _async_sender = AsyncWhatsAppSender(token, phone_id)
+    return _async_sender
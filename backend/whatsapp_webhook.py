@@ -1,14 +1,20 @@
+import asyncio
 import os
 import json
-import requests
 import logging
 from flask import Blueprint, request, jsonify
 from dotenv import load_dotenv
 import traceback
-from langchain.memory import ConversationBufferMemory
+from session_store import open_session, run_blocking, save_session
 
 # Import de la nouvelle architecture (l'agent) et des types de messages
-from lead_graph import get_agent_executor, moderate_content
+from lead_graph import get_agent_executor, moderate_content, amoderate_content, answer_appointment_turn, booking_in_progress, confirm_appointment, CONFIRM_SENTINEL, PROCESSING_REPLY
+import moderation
+import faq
+from admission import BUSY_REPLY, Overloaded, admit_turn
+from message_queue import KeyedWorkQueue, QueueFull
+from whatsapp_sender import get_whatsapp_sender, get_async_whatsapp_sender
+from session_turns import get_session_turns, get_async_session_turns, merge_messages
 from langchain_core.messages import HumanMessage, AIMessage
 print("[WHATSAPP_WEBHOOK_INIT] Successfully imported AGENT components from lead_graph.")
 
@@ -18,10 +24,9 @@ whatsapp = Blueprint('whatsapp', __name__)
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
 WHATSAPP_PHONE_ID = os.getenv('WHATSAPP_PHONE_ID')
 VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
-
-# Dictionnaire pour stocker l'historique de conversation de chaque utilisateur
-# Va maintenant stocker des objets ConversationBufferMemory
-user_memories = {}
+# Messages d'un même numéro envoyés à la suite (« bonjour », « je voudrais un rdv », « demain 10h ») :
+# fusionnés en un seul tour d'agent après ce délai sans nouveau message (s)
+WHATSAPP_DEBOUNCE_SECONDS = float(os.getenv('WHATSAPP_DEBOUNCE_SECONDS', '1.0'))
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
@@ -64,57 +69,174 @@ def format_whatsapp_response(response_text: str) -> str:
         # Retourner le message original si pas de formatage spécial
         return response_text
 
+BLOCKED_INPUT_REPLY = "Je ne peux pas répondre à cette demande. Ma mission est de vous assister pour les prises de rendez-vous à la clinique."
+BLOCKED_OUTPUT_REPLY = "Je ne suis pas en mesure de répondre à cette question. Comment puis-je vous aider avec les services de la clinique ?"
+
+def _moderate_output(response_text: str) -> bool:
+    """
+    Modération de la réponse de l'agent. Le tour est déjà sauvegardé : une surcharge (Overloaded)
+    ne doit plus remonter (le patient renverrait un message déjà traité), la réponse est bloquée.
+    """
+    try:
+        return moderate_content(response_text)
+    except Overloaded as e:
+        logger.warning(f"[MODERATION] Réponse non modérée (surcharge : {e}), bloquée par précaution.")
+        return False
+
+async def _amoderate_output(response_text: str) -> bool:
+    """Variante asyncio de _moderate_output."""
+    try:
+        return await amoderate_content(response_text)
+    except Overloaded as e:
+        logger.warning(f"[MODERATION] Réponse non modérée (surcharge : {e}), bloquée par précaution.")
+        return False
+
+def _open_conversation(phone_number: str):
+    """Ouvre la session du numéro (stockage de sessions partagé), avec le message de bienvenue si elle est nouvelle."""
+    session = open_session(f"whatsapp:{phone_number}")
+    if session.is_new:
+        print(f"[WHATSAPP_PROCESS] Création d'une nouvelle mémoire pour : {phone_number}")
+        # Ajouter le message de bienvenue à la mémoire pour le contexte initial
+        welcome_text = "Bonjour ! Je suis l'assistant virtuel de la Clinique Dentaire St Dominique. Comment puis-je vous aider ?"
+        session.memory.save_context({"input": "start"}, {"output": welcome_text})
+        save_session(session)
+    return session
+
+def _answer_locally(session, message_body: str):
+    """
+    Réponse sans appel à l'agent (récapitulatif/confirmation du rendez-vous, questions fréquentes),
+    mémoire non encore sauvegardée ; None si l'agent est nécessaire.
+    """
+    # Récapitulatif et confirmation du rendez-vous : traités localement, sans appel LLM
+    local = answer_appointment_turn(session, message_body)
+    if local is not None:
+        return local["response"]
+
+    # Questions fréquentes (horaires, adresse, téléphone) : réponse directe sans l'agent,
+    # sauf pendant la collecte d'un rendez-vous (« samedi », « téléphone » y sont des réponses)
+    faq_reply = None if booking_in_progress(session) else faq.answer(message_body)
+    if faq_reply is not None:
+        session.memory.save_context({"input": message_body}, {"output": faq_reply})
+    return faq_reply
+
 def process_message(message_body: str, phone_number: str) -> str:
     """Traite un message entrant en utilisant l'agent et retourne la réponse."""
     
     # --- 1. Modération du message entrant ---
-    if not moderate_content(message_body):
+    # En mode parallèle, la modération tourne pendant l'appel à l'agent ;
+    # la réponse est écartée (et la mémoire non sauvegardée) si le message est bloqué.
+    input_check = None
+    if moderation.MODERATION_PARALLEL:
+        input_check = moderation.submit(moderate_content, message_body)
+    elif not moderate_content(message_body):
         logger.warning(f"[MODERATION] Message entrant de {phone_number} bloqué : '{message_body}'")
-        return "Je ne peux pas répondre à cette demande. Ma mission est de vous assister pour les prises de rendez-vous à la clinique."
+        return BLOCKED_INPUT_REPLY
 
-    # --- 2. Gestion de la mémoire par numéro de téléphone ---
-    if phone_number not in user_memories:
-        print(f"[WHATSAPP_PROCESS] Création d'une nouvelle mémoire pour : {phone_number}")
-        user_memories[phone_number] = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-        # Ajouter le message de bienvenue à la mémoire pour le contexte initial
-        welcome_text = "Bonjour ! Je suis l'assistant virtuel de la Clinique Dentaire St Dominique. Comment puis-je vous aider ?"
-        user_memories[phone_number].save_context({"input": "start"}, {"output": welcome_text})
-        
-    memory = user_memories[phone_number]
+    # --- 2. Un seul tour à la fois par numéro : la mémoire de la session n'est jamais modifiée en concurrence ---
+    with get_session_turns().lock(f"whatsapp:{phone_number}"):
+        # Mémoire du numéro, depuis le stockage de sessions partagé
+        session = _open_conversation(phone_number)
+        memory = session.memory
     
-    # Message d'erreur par défaut
-    response_text = "Je rencontre un problème technique. Veuillez réessayer plus tard." 
+        # Message d'erreur par défaut
+        response_text = "Je rencontre un problème technique. Veuillez réessayer plus tard." 
 
-    if not callable(get_agent_executor):
-        print("[PROCESS_MESSAGE] Critical: agent executor not available.")
-        memory.chat_memory.add_ai_message(response_text) # Sauvegarder l'erreur dans la mémoire
-        return response_text
+        if not callable(get_agent_executor):
+            print("[PROCESS_MESSAGE] Critical: agent executor not available.")
+            memory.chat_memory.add_ai_message(response_text) # Sauvegarder l'erreur dans la mémoire
+            save_session(session)
+            return response_text
 
-    try:
-        # La logique de prompt est maintenant gérée dans lead_graph.py
-        agent_executor = get_agent_executor(memory=memory)
+        try:
+            local_reply = _answer_locally(session, message_body)
+            if local_reply is not None:
+                if input_check is not None and not input_check.result():
+                    logger.warning(f"[MODERATION] Message entrant de {phone_number} bloqué : '{message_body}'")
+                    return BLOCKED_INPUT_REPLY
+                save_session(session)
+                return format_whatsapp_response(local_reply)
+
+            # La logique de prompt est maintenant gérée dans lead_graph.py
+            agent_executor = get_agent_executor(memory=memory)
                 
-        # Invoquer l'agent avec juste le nouvel input. La mémoire gère le reste.
-        result = agent_executor.invoke({
-            "input": message_body
-        })
+            # Invoquer l'agent avec juste le nouvel input. La mémoire gère le reste.
+            result = agent_executor.invoke({
+                "input": message_body
+            })
+            if input_check is not None and not input_check.result():
+                logger.warning(f"[MODERATION] Message entrant de {phone_number} bloqué, réponse écartée : '{message_body}'")
+                return BLOCKED_INPUT_REPLY
+            save_session(session)
         
-        response_text = result.get('output', "Désolé, je n'ai pas pu générer de réponse.")
+            response_text = result.get('output', "Désolé, je n'ai pas pu générer de réponse.")
+
+            # --- ⚡️ Si l'agent confirme la prise de RDV ---
+            if CONFIRM_SENTINEL in response_text:
+                print(f"[WHATSAPP_PROCESS] Confirmation détectée pour {phone_number}. Traitement asynchrone lancé.")
+                confirm_appointment(session)
+                save_session(session)
+                return format_whatsapp_response(PROCESSING_REPLY)  # Texte fixe : pas de modération
         
-        # --- 3. Modération de la réponse sortante ---
-        if not moderate_content(response_text):
-            logger.warning(f"[MODERATION] Réponse de l'agent bloquée : '{response_text}'")
-            return "Je ne suis pas en mesure de répondre à cette question. Comment puis-je vous aider avec les services de la clinique ?"
+            # --- 3. Modération de la réponse sortante (Overloaded ne remonte plus : tour déjà sauvegardé) ---
+            if not _moderate_output(response_text):
+                logger.warning(f"[MODERATION] Réponse de l'agent bloquée : '{response_text}'")
+                return BLOCKED_OUTPUT_REPLY
 
-        # Formater la réponse pour WhatsApp
-        formatted_response = format_whatsapp_response(response_text)
+            # Formater la réponse pour WhatsApp
+            formatted_response = format_whatsapp_response(response_text)
         
-    except Exception as e:
-        print(f"[PROCESS_MESSAGE] Error invoking agent: '{e}'\n{traceback.format_exc()}")
-        # La réponse sera déjà dans la mémoire, on retourne juste le message d'erreur
-        formatted_response = response_text
+        except Overloaded:
+            raise  # Modération du message entrant ou agent : rien n'est encore sauvegardé
+        except Exception as e:
+            print(f"[PROCESS_MESSAGE] Error invoking agent: '{e}'\n{traceback.format_exc()}")
+            # La réponse sera déjà dans la mémoire, on retourne juste le message d'erreur
+            formatted_response = response_text
     
-    return formatted_response
+        return formatted_response
+
+async def aprocess_message(message_body: str, phone_number: str) -> str:
+    """
+    Variante asyncio de process_message (mode async_app) : modération et agent sont attendus
+    sans occuper de thread. La modération du message entrant suit MODERATION_PARALLEL.
+    """
+    input_check = None
+    if moderation.MODERATION_PARALLEL:
+        input_check = asyncio.ensure_future(amoderate_content(message_body))
+    elif not await amoderate_content(message_body):
+        logger.warning(f"[MODERATION] Message entrant de {phone_number} bloqué : '{message_body}'")
+        return BLOCKED_INPUT_REPLY
+
+    async with get_async_session_turns().lock(f"whatsapp:{phone_number}"):
+        # Stockage de sessions et file de tâches : accès bloquants, faits hors de la boucle
+        session = await run_blocking(_open_conversation, phone_number)
+        response_text = "Je rencontre un problème technique. Veuillez réessayer plus tard."
+        try:
+            local_reply = await run_blocking(_answer_locally, session, message_body)
+            if local_reply is None:
+                result = await get_agent_executor(memory=session.memory).ainvoke({"input": message_body})
+            if input_check is not None and not await input_check:
+                logger.warning(f"[MODERATION] Message entrant de {phone_number} bloqué, réponse écartée : '{message_body}'")
+                return BLOCKED_INPUT_REPLY
+            await run_blocking(save_session, session)
+            if local_reply is not None:
+                return format_whatsapp_response(local_reply)
+
+            response_text = result.get('output', "Désolé, je n'ai pas pu générer de réponse.")
+            if CONFIRM_SENTINEL in response_text:
+                print(f"[WHATSAPP_PROCESS] Confirmation détectée pour {phone_number}. Traitement asynchrone lancé.")
+                await run_blocking(confirm_appointment, session)
+                await run_blocking(save_session, session)
+                return format_whatsapp_response(PROCESSING_REPLY)
+
+            if not await _amoderate_output(response_text):
+                logger.warning(f"[MODERATION] Réponse de l'agent bloquée : '{response_text}'")
+                return BLOCKED_OUTPUT_REPLY
+            return format_whatsapp_response(response_text)
+        except Overloaded:
+            raise  # Modération du message entrant ou agent : rien n'est encore sauvegardé
+        except Exception as e:
+            print(f"[PROCESS_MESSAGE] Error invoking agent: '{e}'\n{traceback.format_exc()}")
+            return response_text
 
 @whatsapp.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -129,59 +251,99 @@ def verify_webhook():
         print("[WEBHOOK_VERIFY] Failed.")
         return 'Forbidden', 403
 
+def handle_incoming_message(from_number: str, msg_body: str):
+    """Traite un message de la file : agent, puis envoi de la réponse."""
+    print(f'[WEBHOOK_WORKER] Processing text message from {from_number}: "{msg_body}"')
+    try:
+        admit_turn(f"whatsapp:{from_number}")
+        response_text_val = process_message(msg_body, from_number)
+    except Overloaded as e:
+        # Réponse immédiate plutôt qu'une longue attente ; le patient renverra son message
+        print(f"[WEBHOOK_WORKER] Overloaded for {from_number}: '{e}'")
+        response_text_val = BUSY_REPLY
+    print(f'[WEBHOOK_WORKER] Generated response for {from_number}: "{response_text_val}"')
+    if response_text_val:
+        send_whatsapp_message(from_number, response_text_val)
+    else:
+        print(f"[WEBHOOK_WORKER] No response for {from_number}.")
+
+async def ahandle_incoming_message(from_number: str, msg_body: str):
+    """Variante asyncio de handle_incoming_message (file AsyncKeyedWorkQueue de async_app)."""
+    print(f'[WEBHOOK_WORKER] Processing text message from {from_number}: "{msg_body}"')
+    try:
+        admit_turn(f"whatsapp:{from_number}")
+        response_text_val = await aprocess_message(msg_body, from_number)
+    except Overloaded as e:
+        print(f"[WEBHOOK_WORKER] Overloaded for {from_number}: '{e}'")
+        response_text_val = BUSY_REPLY
+    print(f'[WEBHOOK_WORKER] Generated response for {from_number}: "{response_text_val}"')
+    if response_text_val:
+        await asend_whatsapp_message(from_number, response_text_val)
+    else:
+        print(f"[WEBHOOK_WORKER] No response for {from_number}.")
+
+# File des messages entrants : traitement hors de la requête de Meta, strictement ordonné
+# par numéro, dédoublonné par identifiant de message, et fusion des messages rapprochés.
+incoming_queue = KeyedWorkQueue(
+    handle_incoming_message,
+    name="whatsapp",
+    workers=int(os.getenv("WHATSAPP_WORKERS", "8")),
+    max_pending=int(os.getenv("WHATSAPP_QUEUE_MAX", "1000")),
+    merge=merge_messages,
+    debounce=WHATSAPP_DEBOUNCE_SECONDS,
+)
+
+def enqueue_notification(data: dict, work_queue: KeyedWorkQueue):
+    """Dépose les messages texte d'une notification Meta dans la file. Lève QueueFull si elle est pleine."""
+    if data.get('object') == 'whatsapp_business_account':
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                value = change.get('value', {})
+                if value.get('messages'):
+                    for msg_obj in value.get('messages', []):
+                        from_number_val = msg_obj.get('from') 
+                        msg_type = msg_obj.get('type')
+                        if from_number_val and msg_type == 'text':
+                            msg_body = msg_obj['text']['body']
+                            if work_queue.submit(from_number_val, msg_body, item_id=msg_obj.get('id')):
+                                print(f'[WEBHOOK_POST] Queued text message from {from_number_val} (depth: {work_queue.depth()})')
+                        elif from_number_val:
+                            print(f"[WEBHOOK_POST] Non-text type '{msg_type}' from {from_number_val}.") 
+
 @whatsapp.route('/webhook', methods=['POST'])
 def webhook():
     data = request.get_json()
     try:
-        if data.get('object') == 'whatsapp_business_account':
-            for entry in data.get('entry', []):
-                for change in entry.get('changes', []):
-                    value = change.get('value', {})
-                    if value.get('messages'):
-                        for msg_obj in value.get('messages', []):
-                            from_number_val = msg_obj.get('from') 
-                            msg_type = msg_obj.get('type')
-                            if from_number_val and msg_type == 'text':
-                                msg_body = msg_obj['text']['body']
-                                print(f'[WEBHOOK_POST] Processing text message from {from_number_val}: "{msg_body}"') 
-                                response_text_val = process_message(msg_body, from_number_val) 
-                                print(f'[WEBHOOK_POST] Generated response for {from_number_val}: "{response_text_val}"') 
-                                if response_text_val:
-                                    send_whatsapp_message(from_number_val, response_text_val)
-                                else:
-                                    print(f"[WEBHOOK_POST] No response for {from_number_val}.")
-                            elif from_number_val:
-                                print(f"[WEBHOOK_POST] Non-text type '{msg_type}' from {from_number_val}.") 
+        enqueue_notification(data, incoming_queue)
         return jsonify({'status': 'success'}), 200
+    except QueueFull as e:
+        # Meta renverra la notification plus tard ; les messages déjà en file seront dédoublonnés
+        print(f"[WEBHOOK_POST] Queue full: '{e}'")
+        return jsonify({'status': 'error', 'message': "Service busy"}), 503
     except Exception as e:
         print(f"[WEBHOOK_POST] Error: '{str(e)}'\n{traceback.format_exc()}") 
         return jsonify({'status': 'error', 'message': "Internal server error"}), 500
 
+@whatsapp.route('/queue', methods=['GET'])
+def queue_stats():
+    """Profondeur de la file et temps d'attente des messages entrants."""
+    return jsonify(incoming_queue.stats()), 200
+
 def send_whatsapp_message(to_number: str, message_text: str): 
     if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_ID:
         print("[WHATSAPP_SEND] CRITICAL: Token/PhoneID missing.")
         return {"error": "Server WhatsApp config error."}
-    url = f"https://graph.facebook.com/v17.0/{WHATSAPP_PHONE_ID}/messages"
-    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}", "Content-Type": "application/json"}
-    payload = {"messaging_product": "whatsapp", "to": to_number, "type": "text", "text": {"body": message_text}}
     
     print(f'[WHATSAPP_SEND] To {to_number}: "{message_text}"') 
     
-    try:
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
-        response.raise_for_status()
-        result = response.json()
-        return result
-    except requests.exceptions.Timeout:
-        print(f"[WHATSAPP_SEND] Error: Timeout for {to_number}")
-        return {"error": "Timeout sending."}
-    except requests.exceptions.HTTPError as err:
-        print(f"[WHATSAPP_SEND] HTTP error for {to_number}: {err}") 
-        if err.response is not None: print(f"[WHATSAPP_SEND] API Error ({err.response.status_code}): {err.response.text}")
-        return {"error": f"HTTP {err.response.status_code}."} 
-    except requests.exceptions.RequestException as err:
-        print(f"[WHATSAPP_SEND] Request error for {to_number}: {err}") 
-        return {"error": f"Request error: {err}"} 
-    except Exception as e:
-        print(f"[WHATSAPP_SEND] Unexpected exception for {to_number}: '{e}'\n{traceback.format_exc()}") 
-        return {"error": "Unexpected server error."}
+    # Session keep-alive partagée, avec réessais et limitation de débit (voir whatsapp_sender.py)
+    return get_whatsapp_sender(WHATSAPP_TOKEN, WHATSAPP_PHONE_ID).send(to_number, message_text)
+
+async def asend_whatsapp_message(to_number: str, message_text: str):
+    """Variante asyncio de send_whatsapp_message (mode async_app)."""
+    if not WHATSAPP_TOKEN or not WHATSAPP_PHONE_ID:
+        print("[WHATSAPP_SEND] CRITICAL: Token/PhoneID missing.")
+        return {"error": "Server WhatsApp config error."}
+
+    print(f'[WHATSAPP_SEND] To {to_number}: "{message_text}"')
+    return await get_async_whatsapp_sender(WHATSAPP_TOKEN, WHATSAPP_PHONE_ID).send(to_number, message_text)